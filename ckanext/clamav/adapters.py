@@ -1,7 +1,25 @@
+from __future__ import annotations
+
+import contextlib
 import socket
+import math
+import struct
 import sys
+from typing import Any, Iterator, Optional, Union
+
+from clamd import (
+    BufferTooLongError,
+    ClamdNetworkSocket,
+    ClamdUnixSocket,
+    ConnectionError,
+)
+
+from . import metrics, tracing
 
-from clamd import ClamdNetworkSocket, ConnectionError
+PROBE_REPLY_TIMEOUT: float = 0.2
+MAX_CHUNK_SIZE: int = 2**32 - 1
+INSTREAM_CHUNK_SIZE: int = 64 * 1024
+INSTREAM_SIZE_LIMIT_REPLY: str = "INSTREAM size limit exceeded. ERROR"
 
 
 class CustomClamdNetworkSocket(ClamdNetworkSocket):
@@ -14,17 +32,306 @@ class CustomClamdNetworkSocket(ClamdNetworkSocket):
         host (str): Hostname or IP address of ClamAV server
         port (int): Port number ClamAV is listening on
         timeout (float): Socket timeout in seconds
+        connect_timeout (float): Connection timeout in seconds, defaults to
+            the socket timeout
     """
 
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 3310,
+        timeout: Optional[float] = None,
+        connect_timeout: Optional[float] = None,
+    ):
+        super().__init__(host, port, timeout)
+        self.connect_timeout = timeout if connect_timeout is None else connect_timeout
+
     def _init_socket(self):
         """
         internal use only
         """
         try:
             self.clamd_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.clamd_socket.settimeout(self.connect_timeout)
+            with instrument_connect(socket.AF_INET, (self.host, self.port)):
+                self.clamd_socket.connect((self.host, self.port))
             self.clamd_socket.settimeout(self.timeout)
-            self.clamd_socket.connect((self.host, self.port))
 
         except (OSError, socket.timeout):
             e = sys.exc_info()[1]
             raise ConnectionError(self._error_message(e))
+
+    def settimeout(self, timeout: Optional[float]) -> None:
+        """Change the timeout of the open connection."""
+        self.clamd_socket.settimeout(timeout)
+
+    def instream(self, buff: Any) -> Optional[dict[str, tuple[str, Optional[str]]]]:
+        return instream(self, buff)
+
+
+class CustomClamdUnixSocket(ClamdUnixSocket):
+    """Extends the default ClamdUnixSocket adapter with the FILDES command.
+
+    FILDES passes an open file descriptor to clamd over the unix socket, so
+    clamd reads the file itself and nothing is copied through Python.
+
+    Args:
+        path (str): Path to the clamd unix socket
+        timeout (float): Socket timeout in seconds
+        connect_timeout (float): Connection timeout in seconds, defaults to
+            the socket timeout
+    """
+
+    def __init__(
+        self,
+        path: str = "/var/run/clamav/clamd.ctl",
+        timeout: Optional[float] = None,
+        connect_timeout: Optional[float] = None,
+    ):
+        super().__init__(path, timeout)
+        self.connect_timeout = timeout if connect_timeout is None else connect_timeout
+
+    def _init_socket(self):
+        """
+        internal use only
+        """
+        try:
+            self.clamd_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.clamd_socket.settimeout(self.connect_timeout)
+            with instrument_connect(socket.AF_UNIX, self.unix_socket):
+                self.clamd_socket.connect(self.unix_socket)
+            self.clamd_socket.settimeout(self.timeout)
+        except OSError as e:
+            raise ConnectionError(self._error_message(e))
+
+    def settimeout(self, timeout: Optional[float]) -> None:
+        """Change the timeout of the open connection."""
+        self.clamd_socket.settimeout(timeout)
+
+    def instream(self, buff: Any) -> Optional[dict[str, tuple[str, Optional[str]]]]:
+        return instream(self, buff)
+
+    def fildes(self, fd: int) -> dict[str, tuple[str, Optional[str]]]:
+        """Scan an open file by its descriptor.
+
+        Returns:
+            dict: {"fd[<n>]": (status, virusname)}
+
+        May raise:
+            ConnectionError: in case of communication problem
+            ResponseError: if clamd can't parse the reply
+        """
+        try:
+            self._init_socket()
+            self._send_command("FILDES")
+            send_fd(self.clamd_socket, fd)
+
+            result = self._recv_response()
+            filename, reason, status = self._parse_response(result)
+            return {filename: (status, reason)}
+        finally:
+            self._close_socket()
+
+
+class InstreamWriter:
+    """An INSTREAM command kept open while the content arrives.
+
+    The content is sent as it's written, and the verdict is read once the
+    content is over, so a file can be scanned while it's being received.
+
+    Args:
+        conn (Union[CustomClamdNetworkSocket, CustomClamdUnixSocket]): a
+            connection, opened by the writer
+
+    May raise:
+        ConnectionError: if clamd is not accessible
+    """
+
+    def __init__(self, conn: Union[CustomClamdNetworkSocket, CustomClamdUnixSocket]):
+        self.conn = conn
+
+        conn._init_socket()
+        try:
+            conn._send_command("INSTREAM")
+        except OSError as e:
+            conn._close_socket()
+            raise ConnectionError(f"Error while opening the stream: {e}")
+
+    def write(self, data: bytes) -> None:
+        """Send the next part of the content.
+
+        May raise:
+            ConnectionError: in case of communication problem, e.g. when
+                clamd has refused the content over its stream limit
+        """
+        view = memoryview(data)
+        try:
+            for offset in range(0, len(view), INSTREAM_CHUNK_SIZE):
+                chunk = view[offset:offset + INSTREAM_CHUNK_SIZE]
+                self.conn.clamd_socket.sendall(struct.pack("!L", len(chunk)))
+                self.conn.clamd_socket.sendall(chunk)
+        except OSError as e:
+            raise ConnectionError(f"Error while streaming to clamd: {e}")
+
+    def finish(self) -> dict[str, tuple[str, Optional[str]]]:
+        """End the content and read the verdict.
+
+        Returns:
+            dict: {"stream": (status, virusname)}
+
+        May raise:
+            BufferTooLongError: if the content exceeds the clamd limit
+            ConnectionError: in case of communication problem
+            ResponseError: if clamd can't parse the reply
+        """
+        try:
+            try:
+                self.conn.clamd_socket.sendall(struct.pack("!L", 0))
+            except OSError as e:
+                raise ConnectionError(f"Error while streaming to clamd: {e}")
+
+            result = self.conn._recv_response()
+            if result == INSTREAM_SIZE_LIMIT_REPLY:
+                raise BufferTooLongError(result)
+
+            filename, reason, status = self.conn._parse_response(result)
+            return {filename: (status, reason)}
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self.conn._close_socket()
+
+
+def instream(
+    conn: Union[CustomClamdNetworkSocket, CustomClamdUnixSocket],
+    buff: Any,
+) -> Optional[dict[str, tuple[str, Optional[str]]]]:
+    """Scan a buffer, same as `clamd.ClamdNetworkSocket.instream`.
+
+    clamd drops the connection as soon as StreamMaxLength is reached, so a
+    write may fail with a broken pipe. The reason is read from the reply
+    then, instead of letting the socket error through.
+
+    Returns:
+        dict: {"stream": (status, virusname)}, or None if clamd replied
+            with nothing
+
+    May raise:
+        BufferTooLongError: if the buffer size exceeds clamd limits
+        ConnectionError: in case of communication problem
+    """
+    try:
+        conn._init_socket()
+        try:
+            conn._send_command("INSTREAM")
+
+            chunk = buff.read(INSTREAM_CHUNK_SIZE)
+            while chunk:
+                conn.clamd_socket.sendall(struct.pack("!L", len(chunk)) + chunk)
+                chunk = buff.read(INSTREAM_CHUNK_SIZE)
+
+            conn.clamd_socket.sendall(struct.pack("!L", 0))
+        except OSError as e:
+            try:
+                result = conn._recv_response()
+            except ConnectionError:
+                result = None
+            if result == INSTREAM_SIZE_LIMIT_REPLY:
+                raise BufferTooLongError(result)
+            raise ConnectionError(f"Error while writing to socket: {e}")
+
+        result = conn._recv_response()
+        if not result:
+            return None
+        if result == INSTREAM_SIZE_LIMIT_REPLY:
+            raise BufferTooLongError(result)
+
+        filename, reason, status = conn._parse_response(result)
+        return {filename: (status, reason)}
+    finally:
+        conn._close_socket()
+
+
+@contextlib.contextmanager
+def instrument_connect(family: int, address: Any) -> Iterator[None]:
+    """Trace and time opening a connection to clamd."""
+    with tracing.connect_span(family, address), metrics.time_connect(family, address):
+        yield
+
+
+def send_fd(sock: socket.socket, fd: int) -> None:
+    """Send a file descriptor as SCM_RIGHTS ancillary data.
+
+    At least one byte of regular data must accompany the descriptor.
+    """
+    try:
+        sock.sendmsg(
+            [b"\0"],
+            [(socket.SOL_SOCKET, socket.SCM_RIGHTS, struct.pack("i", fd))],
+        )
+    except OSError as e:
+        raise ConnectionError(f"Error while sending the file descriptor: {e}")
+
+
+def probe_stream_max_length(
+    family: int,
+    address: Union[str, tuple[str, int]],
+    timeout: float,
+) -> Optional[int]:
+    """Find out the clamd stream size limit, `StreamMaxLength`.
+
+    clamd checks the size of every INSTREAM chunk against the remaining
+    limit as soon as the chunk header is read, before the chunk data. So
+    sending a bare header of the probed size is enough: a chunk over the
+    limit is refused immediately, while a chunk below the limit makes clamd
+    wait for the data, which we never send.
+
+    The limit is searched for until it's known within 1/64 of its value.
+    A reply that is slower than PROBE_REPLY_TIMEOUT is taken for a wait,
+    which can only make the result higher than the real limit, never lower.
+
+    Returns:
+        The smallest refused size, or None if even the largest chunk is
+        accepted.
+
+    May raise:
+        ConnectionError: if clamd is not accessible
+    """
+    accepted, refused = 1, MAX_CHUNK_SIZE + 1
+
+    while refused - accepted > refused // 64:
+        if refused > accepted * 2:
+            size = math.isqrt(accepted * refused)
+        else:
+            size = (accepted + refused) // 2
+
+        if _chunk_refused(family, address, timeout, size):
+            refused = size
+        else:
+            accepted = size
+
+    return refused if refused <= MAX_CHUNK_SIZE else None
+
+
+def _chunk_refused(
+    family: int,
+    address: Union[str, tuple[str, int]],
+    timeout: float,
+    size: int,
+) -> bool:
+    try:
+        with socket.socket(family, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(address)
+            sock.sendall(b"zINSTREAM\0" + struct.pack("!L", size))
+
+            sock.settimeout(PROBE_REPLY_TIMEOUT)
+            try:
+                reply = sock.recv(1024)
+            except socket.timeout:
+                return False
+    except OSError as e:
+        raise ConnectionError(f"Error while probing the stream limit: {e}")
+
+    return b"size limit exceeded" in reply
@@ -0,0 +1,290 @@
+from __future__ import annotations
+
+import contextlib
+import fcntl
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from typing import Any, Iterator, Optional
+
+from ckan.exceptions import CkanConfigurationException
+from ckan.lib.redis import connect_to_redis
+
+from . import config as c
+from . import metrics
+
+log = logging.getLogger(__name__)
+
+# an upload of unknown size is queued as a file of this size
+UNKNOWN_SIZE: int = 1024 * 1024 * 1024
+POLL_MIN_INTERVAL: float = 0.005
+POLL_MAX_INTERVAL: float = 0.1
+REDIS_KEY: str = "ckanext:clamav:admission"
+# a slot of a process that died while scanning is freed after this time
+REDIS_LEASE: int = 3600
+
+_controller: Optional[AdmissionController] = None
+_controller_settings: Optional[tuple[Any, ...]] = None
+_controller_lock = threading.Lock()
+
+
+class AdmissionTimeout(Exception):
+    """The scan hasn't got a free slot within the queue timeout."""
+
+
+class FileSemaphore:
+    """Semaphore shared by the processes of a host, built on lock files.
+
+    Every slot is a file in the directory, held with an exclusive `flock`.
+    The lock is released by the OS when the holder dies, so a crashed
+    worker never leaks a slot.
+
+    Args:
+        directory (str): the directory of the lock files
+        limit (int): the number of slots
+    """
+
+    def __init__(self, directory: str, limit: int):
+        self.directory = directory
+        self.limit = limit
+        os.makedirs(directory, exist_ok=True)
+
+    def try_acquire(self) -> Optional[int]:
+        """Take a free slot without waiting.
+
+        Returns:
+            The descriptor of the held lock file, or None if all the slots
+            are taken.
+        """
+        first = random.randrange(self.limit)
+        for number in range(self.limit):
+            slot = (first + number) % self.limit
+            fd = os.open(
+                os.path.join(self.directory, f"slot-{slot}"),
+                os.O_CREAT | os.O_RDWR,
+                0o600,
+            )
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            return fd
+
+        return None
+
+    def release(self, token: int) -> None:
+        os.close(token)
+
+
+class RedisSemaphore:
+    """Semaphore shared by all the hosts, built on a Redis sorted set.
+
+    The holders are kept with the time they took the slot. A slot of a
+    holder that hasn't released it within REDIS_LEASE seconds is freed.
+
+    Args:
+        limit (int): the number of slots
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+
+    def try_acquire(self) -> Optional[str]:
+        """Take a free slot without waiting.
+
+        Returns:
+            The holder token, or None if all the slots are taken. If Redis
+            is not available, the scan is let through with an empty token.
+        """
+        token = uuid.uuid4().hex
+        now = time.time()
+
+        try:
+            redis = connect_to_redis()
+            pipeline = redis.pipeline()
+            pipeline.zremrangebyscore(REDIS_KEY, "-inf", now - REDIS_LEASE)
+            pipeline.zadd(REDIS_KEY, {token: now})
+            pipeline.zrank(REDIS_KEY, token)
+            _removed, _added, rank = pipeline.execute()
+
+            if rank is not None and rank < self.limit:
+                return token
+
+            redis.zrem(REDIS_KEY, token)
+        except Exception:  # noqa: BLE001
+            log.exception("Clamd: unable to take the shared scan slot")
+            return ""
+
+        return None
+
+    def release(self, token: str) -> None:
+        if not token:
+            return
+
+        try:
+            connect_to_redis().zrem(REDIS_KEY, token)
+        except Exception:  # noqa: BLE001
+            log.exception("Clamd: unable to release the shared scan slot")
+
+
+class AdmissionController:
+    """Limits the number of scans in flight and queues the rest.
+
+    Waiting scans are admitted smallest file first. To keep large files
+    from starving, a waiting file is treated as smaller by `aging_rate`
+    bytes for every second it waits. As all the waiting files age at the
+    same rate, the order is fixed once a file is queued.
+
+    With a shared semaphore, an admitted scan also takes a slot shared with
+    the other processes, polling until one is free.
+
+    Args:
+        limit (int): the maximum number of scans in flight in the process
+        timeout (float): seconds a scan waits for the slots
+        aging_rate (float): bytes per second of waiting
+        semaphore (Optional[Any]): the semaphore shared with other processes
+    """
+
+    def __init__(
+        self,
+        limit: int,
+        timeout: float,
+        aging_rate: float,
+        semaphore: Optional[Any] = None,
+    ):
+        self.limit = limit
+        self.timeout = timeout
+        self.aging_rate = aging_rate
+        self.semaphore = semaphore
+
+        self.in_flight = 0
+        self._queue: list[tuple[float, int]] = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    @contextlib.contextmanager
+    def admit(self, size: Optional[int]) -> Iterator[None]:
+        """Wait for a free slot and hold it for the duration of the block.
+
+        Args:
+            size (Optional[int]): the file size in bytes, if known
+
+        Raises:
+            AdmissionTimeout: if there is no free slot within the timeout
+        """
+        started_at = time.monotonic()
+        deadline = started_at + self.timeout
+
+        self._acquire_local(size, deadline)
+        try:
+            token = self._acquire_shared(deadline) if self.semaphore else None
+            metrics.observe_admission_wait(time.monotonic() - started_at)
+            try:
+                yield
+            finally:
+                if token is not None:
+                    self.semaphore.release(token)
+        finally:
+            self._release_local()
+
+    def _acquire_local(self, size: Optional[int], deadline: float) -> None:
+        priority = (UNKNOWN_SIZE if size is None else size) + (
+            time.monotonic() * self.aging_rate
+        )
+        entry = (priority, next(self._counter))
+
+        with self._condition:
+            if self.in_flight < self.limit and not self._queue:
+                self.in_flight += 1
+                return
+
+            heapq.heappush(self._queue, entry)
+            while self.in_flight >= self.limit or self._queue[0] != entry:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._queue.remove(entry)
+                    heapq.heapify(self._queue)
+                    # the next waiter may be at the head now
+                    self._condition.notify_all()
+                    raise AdmissionTimeout
+                self._condition.wait(remaining)
+
+            heapq.heappop(self._queue)
+            self.in_flight += 1
+            # the next waiter may be admitted too, if there are free slots
+            self._condition.notify_all()
+
+    def _release_local(self) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def _acquire_shared(self, deadline: float) -> Any:
+        interval = POLL_MIN_INTERVAL
+        while True:
+            token = self.semaphore.try_acquire()
+            if token is not None:
+                return token
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise AdmissionTimeout
+
+            time.sleep(min(remaining, interval * random.uniform(0.5, 1.5)))
+            interval = min(interval * 2, POLL_MAX_INTERVAL)
+
+
+def get_controller() -> AdmissionController:
+    """Return the admission controller of the current process.
+
+    The controller is re-created if its settings have been changed since
+    the last call, which only happens in tests.
+    """
+    global _controller, _controller_settings
+
+    settings = (
+        c.admission_max_in_flight(),
+        c.admission_queue_timeout(),
+        c.admission_aging_rate(),
+        c.admission_shared_limit(),
+        c.admission_shared_backend(),
+        c.admission_lock_dir(),
+    )
+
+    with _controller_lock:
+        if _controller is None or _controller_settings != settings:
+            _controller = _make_controller(*settings)
+            _controller_settings = settings
+
+    return _controller
+
+
+def _make_controller(
+    limit: int,
+    timeout: int,
+    aging_rate: int,
+    shared_limit: int,
+    shared_backend: str,
+    lock_dir: str,
+) -> AdmissionController:
+    semaphore: Optional[Any] = None
+    if shared_limit and shared_backend == "file":
+        semaphore = FileSemaphore(lock_dir, shared_limit)
+    elif shared_limit and shared_backend == "redis":
+        semaphore = RedisSemaphore(shared_limit)
+    elif shared_limit:
+        raise CkanConfigurationException(
+            f"Clamd: unsupported admission shared backend {shared_backend}",
+        )
+
+    return AdmissionController(limit, timeout, aging_rate, semaphore)
@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import asyncio
+import inspect
+import socket
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Optional, TypeVar
+
+from clamd import BufferTooLongError, ConnectionError, ResponseError
+
+from .adapters import instrument_connect
+from .pool import INSTREAM_CHUNK_SIZE, INSTREAM_SIZE_LIMIT_REPLY, _parse_scan_reply
+from .router import Address
+
+T = TypeVar("T")
+
+
+class AsyncClamd:
+    """An asyncio clamd client.
+
+    Every operation opens its own connection, so any number of them can run
+    concurrently on one event loop. The whole operation, from connecting to
+    reading the reply, must finish within the timeout.
+
+    Args:
+        family (int): socket family, AF_UNIX or AF_INET
+        address (Address): unix socket path or (host, port) pair
+        timeout (float): default deadline of an operation in seconds
+    """
+
+    def __init__(self, family: int, address: Address, timeout: Optional[float]):
+        self.family = family
+        self.address = address
+        self.timeout = timeout
+
+    async def ping(self, timeout: Optional[float] = None) -> str:
+        return await self._with_deadline(self._basic_command("PING"), timeout)
+
+    async def version(self, timeout: Optional[float] = None) -> str:
+        return await self._with_deadline(self._basic_command("VERSION"), timeout)
+
+    async def scan(
+        self,
+        path: str,
+        timeout: Optional[float] = None,
+    ) -> dict[str, tuple[str, Optional[str]]]:
+        """Scan a file by its path, which must be readable by clamd."""
+        reply = await self._with_deadline(self._basic_command(f"SCAN {path}"), timeout)
+        return _parse_scan_reply(reply)
+
+    async def instream(
+        self,
+        buff: Any,
+        timeout: Optional[float] = None,
+    ) -> dict[str, tuple[str, Optional[str]]]:
+        """Scan a buffer, same as `clamd.ClamdNetworkSocket.instream`.
+
+        The buffer is read in chunks with its `read` method, which may be
+        a coroutine function.
+
+        Raises:
+            BufferTooLongError: if the buffer size exceeds clamd limits
+            ConnectionError: in case of communication problem or when the
+                deadline is over
+        """
+        return await self._with_deadline(self._instream(buff), timeout)
+
+    async def _instream(self, buff: Any) -> dict[str, tuple[str, Optional[str]]]:
+        reader, writer = await self._connect()
+
+        # clamd replies and drops the connection as soon as StreamMaxLength
+        # is reached, so the reply is awaited while the chunks are written
+        reply_task = asyncio.ensure_future(_recv_reply(reader))
+
+        try:
+            try:
+                writer.write(b"zINSTREAM\0")
+
+                chunk = await _read(buff, INSTREAM_CHUNK_SIZE)
+                while chunk and not reply_task.done():
+                    writer.write(struct.pack("!L", len(chunk)) + chunk)
+                    await writer.drain()
+                    chunk = await _read(buff, INSTREAM_CHUNK_SIZE)
+
+                if not reply_task.done():
+                    writer.write(struct.pack("!L", 0))
+                    await writer.drain()
+            except OSError as e:
+                if not reply_task.done():
+                    reply_task.cancel()
+                    raise ConnectionError(f"Error while writing to socket: {e}")
+
+            reply = await reply_task
+        finally:
+            reply_task.cancel()
+            await _close(writer)
+
+        if reply == INSTREAM_SIZE_LIMIT_REPLY:
+            raise BufferTooLongError(reply)
+
+        return _parse_scan_reply(reply)
+
+    async def _basic_command(self, command: str) -> str:
+        reader, writer = await self._connect()
+
+        try:
+            try:
+                writer.write(f"z{command}\0".encode())
+                await writer.drain()
+            except OSError as e:
+                raise ConnectionError(f"Error while writing to socket: {e}")
+
+            reply = await _recv_reply(reader)
+        finally:
+            await _close(writer)
+
+        if reply.endswith("ERROR"):
+            raise ResponseError(reply.rsplit("ERROR", 1)[0])
+        return reply
+
+    async def _connect(self) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        try:
+            with instrument_connect(self.family, self.address):
+                if self.family == socket.AF_UNIX:
+                    return await asyncio.open_unix_connection(self.address)
+
+                host, port = self.address
+                return await asyncio.open_connection(host, port)
+        except OSError as e:
+            raise ConnectionError(f"Error connecting to {self.address}. {e}.")
+
+    async def _with_deadline(self, coro: Awaitable[T], timeout: Optional[float]) -> T:
+        timeout = self.timeout if timeout is None else timeout
+
+        try:
+            return await asyncio.wait_for(coro, timeout)
+        except asyncio.TimeoutError:
+            raise ConnectionError(
+                f"Clamd {self.address} didn't reply within {timeout} seconds",
+            )
+
+
+class SyncClamd:
+    """A blocking facade over AsyncClamd.
+
+    Has the same interface as the `clamd` sockets, so it can be used
+    wherever they are. Each call runs on its own event loop, in a helper
+    thread if the calling thread is already running one.
+    """
+
+    def __init__(self, family: int, address: Address, timeout: Optional[float]):
+        self.client = AsyncClamd(family, address, timeout)
+
+    def ping(self) -> str:
+        return _run(self.client.ping())
+
+    def version(self) -> str:
+        return _run(self.client.version())
+
+    def scan(self, path: str) -> dict[str, tuple[str, Optional[str]]]:
+        return _run(self.client.scan(path))
+
+    def instream(self, buff: Any) -> dict[str, tuple[str, Optional[str]]]:
+        return _run(self.client.instream(buff))
+
+
+def _run(coro: Awaitable[T]) -> T:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)  # type: ignore
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()  # type: ignore
+
+
+async def _read(buff: Any, size: int) -> bytes:
+    chunk = buff.read(size)
+    if inspect.isawaitable(chunk):
+        chunk = await chunk
+    return chunk
+
+
+async def _recv_reply(reader: asyncio.StreamReader) -> str:
+    """Read one null-terminated reply."""
+    try:
+        reply = await reader.readuntil(b"\0")
+    except asyncio.IncompleteReadError:
+        raise ConnectionError("Connection closed by clamd")
+    except OSError as e:
+        raise ConnectionError(f"Error while reading from socket: {e}")
+
+    return reply[:-1].decode("utf-8").strip()
+
+
+async def _close(writer: asyncio.StreamWriter) -> None:
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import logging
+import time
+from typing import Any, Optional
+
+log = logging.getLogger(__name__)
+
+
+class BreakerStates:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Stops sending scans to a clamd that is known to be down.
+
+    The breaker opens after `failure_threshold` consecutive connection
+    errors. While it's open, scans are refused without connecting. After
+    `reset_timeout` seconds it lets a single trial scan through, and closes
+    again if the trial succeeds. A successful background PING closes it
+    right away.
+
+    The breaker is not thread-safe, the router calls it under its own lock.
+
+    Args:
+        name (str): the endpoint name, for logging
+        failure_threshold (int): consecutive errors before the breaker opens
+        reset_timeout (float): seconds before a trial scan is let through
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = BreakerStates.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_started_at: Optional[float] = None
+
+    def available(self) -> bool:
+        """Check whether a scan would be let through, without starting it."""
+        if self.state == BreakerStates.CLOSED:
+            return True
+
+        now = time.monotonic()
+        if self.state == BreakerStates.OPEN:
+            return now - self.opened_at >= self.reset_timeout
+
+        # a trial that never reported back doesn't block the breaker forever
+        return (
+            self.trial_started_at is None
+            or now - self.trial_started_at >= self.reset_timeout
+        )
+
+    def acquire(self) -> bool:
+        """Let a scan through, if the state allows it.
+
+        Moves an open breaker to half-open, when the reset timeout is over,
+        and reserves the single trial scan.
+        """
+        if not self.available():
+            return False
+
+        if self.state != BreakerStates.CLOSED:
+            if self.state == BreakerStates.OPEN:
+                log.info("Clamd: circuit of %s is half-open", self.name)
+            self.state = BreakerStates.HALF_OPEN
+            self.trial_started_at = time.monotonic()
+
+        return True
+
+    def release(self) -> None:
+        """Give back the trial of a scan that never reached clamd."""
+        if self.state == BreakerStates.HALF_OPEN:
+            self.trial_started_at = None
+
+    def record_success(self) -> None:
+        if self.state != BreakerStates.CLOSED:
+            log.info("Clamd: circuit of %s is closed", self.name)
+
+        self.state = BreakerStates.CLOSED
+        self.failures = 0
+        self.trial_started_at = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+
+        if self.state == BreakerStates.HALF_OPEN or (
+            self.state == BreakerStates.CLOSED
+            and self.failures >= self.failure_threshold
+        ):
+            log.warning(
+                "Clamd: circuit of %s is open after %s errors",
+                self.name,
+                self.failures,
+            )
+            self.state = BreakerStates.OPEN
+            self.trial_started_at = None
+
+        if self.state == BreakerStates.OPEN:
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> dict[str, Any]:
+        return {"state": self.state, "failures": self.failures}
@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import IO, Optional
+
+from ckan.lib.redis import connect_to_redis
+
+from . import config as c
+
+log = logging.getLogger(__name__)
+
+REDIS_KEY_PREFIX: str = "ckanext:clamav:verdict:"
+HASH_CHUNK_SIZE: int = 64 * 1024
+
+_cache: Optional[VerdictCache] = None
+_cache_lock = threading.Lock()
+
+
+class VerdictCache:
+    """Two-tier cache of clamd verdicts.
+
+    The first tier is a bounded in-process LRU with a TTL. The second,
+    optional tier is Redis, shared across all CKAN workers. A miss in the
+    first tier falls through to the second one and warms the first tier up.
+
+    Args:
+        max_size (int): maximum number of entries in the in-process tier
+        ttl (int): time to live of an entry in seconds, for both tiers
+        shared (bool): whether to use the Redis tier
+    """
+
+    def __init__(self, max_size: int, ttl: int, shared: bool = False):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared = shared
+
+        self._entries: OrderedDict[str, tuple[float, tuple[str, Optional[str]]]] = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[tuple[str, Optional[str]]]:
+        """Return a cached verdict or None if there is no fresh entry."""
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, verdict = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    return verdict
+                del self._entries[key]
+
+        if not self.shared:
+            return None
+
+        verdict = self._get_shared(key)
+        if verdict is not None:
+            self._set_local(key, verdict)
+        return verdict
+
+    def set(self, key: str, verdict: tuple[str, Optional[str]]) -> None:
+        """Store a verdict in all the enabled tiers."""
+        self._set_local(key, verdict)
+
+        if self.shared:
+            self._set_shared(key, verdict)
+
+    def clear(self) -> None:
+        """Drop all the entries from the in-process tier."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _set_local(self, key: str, verdict: tuple[str, Optional[str]]) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, verdict)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _get_shared(self, key: str) -> Optional[tuple[str, Optional[str]]]:
+        try:
+            value = connect_to_redis().get(REDIS_KEY_PREFIX + key)
+        except Exception:  # noqa: BLE001
+            log.exception("Clamd: unable to read the verdict from the shared cache")
+            return None
+
+        if not value:
+            return None
+
+        status, signature = json.loads(value)
+        return (status, signature)
+
+    def _set_shared(self, key: str, verdict: tuple[str, Optional[str]]) -> None:
+        try:
+            connect_to_redis().setex(
+                REDIS_KEY_PREFIX + key,
+                self.ttl,
+                json.dumps(list(verdict)),
+            )
+        except Exception:  # noqa: BLE001
+            log.exception("Clamd: unable to write the verdict to the shared cache")
+
+
+def get_cache() -> VerdictCache:
+    """Return the process-wide verdict cache.
+
+    The cache is re-created if its settings have been changed since the
+    last call, which only happens in tests.
+    """
+    global _cache
+
+    max_size, ttl, shared = c.cache_size(), c.cache_ttl(), c.cache_shared()
+
+    with _cache_lock:
+        if _cache is None or (_cache.max_size, _cache.ttl, _cache.shared) != (
+            max_size,
+            ttl,
+            shared,
+        ):
+            _cache = VerdictCache(max_size, ttl, shared)
+
+    return _cache
+
+
+def make_key(content_hash: str, db_version: str) -> str:
+    """Build a cache key from the content hash and signature database version.
+
+    Including the database version means that entries produced by older
+    signatures are never hit once clamd has been updated.
+    """
+    return f"{db_version}:{content_hash}"
+
+
+def hash_stream(stream: IO[bytes]) -> Optional[str]:
+    """Compute SHA-256 of the stream content and rewind it.
+
+    Returns:
+        The hex digest, or None if the stream can't be rewound and
+        therefore can't be read twice.
+    """
+    try:
+        if not stream.seekable():
+            return None
+        start = stream.tell()
+    except (AttributeError, OSError):
+        return None
+
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b""):
+        digest.update(chunk)
+
+    stream.seek(start)
+    return digest.hexdigest()
@@ -0,0 +1,264 @@
+from __future__ import annotations
+
+import itertools
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import IO, Any, Iterator, Optional
+
+import click
+
+import ckan.model as model
+import ckan.plugins.toolkit as tk
+
+from . import config as c
+from . import jobs, reputation, tracking, utils
+from .config import ClamAvStatus
+
+RESCAN_BATCH_SIZE: int = 1000
+CHECKPOINT_EVERY: int = 100
+
+
+@click.group(short_help="ClamAV commands")
+def clamav():
+    pass
+
+
+@clamav.command()
+@click.option(
+    "-w",
+    "--workers",
+    type=int,
+    default=os.cpu_count() or 1,
+    show_default=True,
+    help="Number of worker processes",
+)
+@click.option(
+    "-c",
+    "--checkpoint",
+    type=click.Path(dir_okay=False),
+    help="File to keep the progress in. An interrupted rescan resumes from it",
+)
+def rescan(workers: int, checkpoint: Optional[str]):
+    """Scan the uploaded files of all active resources.
+
+    Files are scanned in parallel by a pool of worker processes. Infected
+    resources are reported, but left untouched.
+    """
+    last_id = _read_checkpoint(checkpoint)
+    if last_id:
+        click.echo(f"Resuming the rescan after resource {last_id}")
+
+    counts = dict.fromkeys(("clean", "infected", "failed", "missing"), 0)
+    # [resource id, whether it's scanned] in the order of submission
+    pending: deque[list[Any]] = deque()
+    in_flight: dict[Future[utils.ScanReport], list[Any]] = {}
+    done_count = 0
+
+    def collect(done: set[Future[utils.ScanReport]]) -> None:
+        nonlocal last_id, done_count
+
+        for future in done:
+            item = in_flight.pop(future)
+            _report(item[0], future, counts)
+            item[1] = True
+
+        # only a resource with all the preceding ones scanned is a checkpoint
+        while pending and pending[0][1]:
+            last_id = pending.popleft()[0]
+            done_count += 1
+            if checkpoint and not done_count % CHECKPOINT_EVERY:
+                _write_checkpoint(checkpoint, last_id)
+
+    # workers are forked, so they inherit the loaded CKAN config
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("fork"),
+    ) as executor:
+        try:
+            for resource_id, path in _iter_stored_files(last_id):
+                if path is None:
+                    counts["missing"] += 1
+                    pending.append([resource_id, True])
+                    continue
+
+                future = executor.submit(utils.scan_stored_file, path, resource_id)
+                in_flight[future] = [resource_id, False]
+                pending.append(in_flight[future])
+
+                if len(in_flight) >= workers * 2:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+
+            done, _ = wait(in_flight)
+            collect(done)
+        finally:
+            for future in in_flight:
+                future.cancel()
+            if checkpoint and last_id:
+                _write_checkpoint(checkpoint, last_id)
+
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+    click.secho(
+        "Rescan is complete. Clean: {clean}, infected: {infected}, "
+        "failed: {failed}, missing: {missing}".format(**counts),
+        fg="red" if counts["infected"] else "green",
+    )
+
+
+@clamav.command("rescan-stale")
+@click.option(
+    "-b",
+    "--budget",
+    type=int,
+    help="Number of bytes to rescan. Defaults to ckanext.clamav.tracking.rescan_budget",
+)
+@click.option("--enqueue", is_flag=True, help="Run the rescan as a background job")
+def rescan_stale(budget: Optional[int], enqueue: bool):
+    """Rescan the resources scanned with an older signature database.
+
+    Requires ckanext.clamav.tracking.enabled. Meant to be run on schedule,
+    e.g. daily from cron.
+    """
+    if not c.tracking_enabled():
+        tk.error_shout("The scan tracking is disabled")
+        raise click.Abort()
+
+    if enqueue:
+        tk.enqueue_job(
+            jobs.rescan_stale_resources,
+            [budget],
+            title="ClamAV rescan of stale resources",
+            queue=c.async_queue(),
+        )
+        click.echo("The rescan is enqueued")
+        return
+
+    counts = jobs.rescan_stale_resources(budget)
+    click.secho(
+        "Rescan is complete. Clean: {clean}, infected: {infected}, "
+        "failed: {failed}".format(**counts),
+        fg="red" if counts["infected"] else "green",
+    )
+
+
+@clamav.command()
+@click.option("--burst", is_flag=True, help="Enqueue the due retries and exit")
+def scheduler(burst: bool):
+    """Enqueue the retries of the background scans once they are due.
+
+    Run it next to `ckan jobs worker` in the async scan mode, or with
+    `--burst` from cron, e.g. every minute.
+    """
+    jobs.enqueue_due_retries(burst)
+
+
+@clamav.command("build-hash-list")
+@click.argument("output", type=click.Path(dir_okay=False))
+@click.argument("feeds", nargs=-1, required=True, type=click.File())
+@click.option(
+    "-e",
+    "--error-rate",
+    type=click.FloatRange(0, 1, min_open=True, max_open=True),
+    default=reputation.ERROR_RATE,
+    show_default=True,
+    help="False positive rate of the Bloom filter",
+)
+def build_hash_list(output: str, feeds: tuple[IO[str], ...], error_rate: float):
+    """Build a hash list from SHA-256 feed files.
+
+    The list is used as ckanext.clamav.reputation.denylist or allowlist.
+    Every feed line starts with a hex digest, as in the `sha256sum` output
+    or the ClamAV `.hsb` signatures. Use `-` to read a feed from stdin. The
+    running CKAN processes pick the rebuilt list up on the next scan.
+    """
+    digests = itertools.chain.from_iterable(reputation.read_feed(f) for f in feeds)
+    size = reputation.build(output, digests, error_rate)
+
+    click.secho(f"The hash list of {size} digests is saved to {output}", fg="green")
+
+
+def _iter_stored_files(after: Optional[str]) -> Iterator[tuple[str, Optional[str]]]:
+    """Walk the uploaded resources ordered by id, page by page.
+
+    Yields:
+        The resource id and the file path, or None if the file doesn't exist.
+    """
+    while True:
+        query = (
+            model.Session.query(model.Resource.id, model.Resource.url)
+            .filter(model.Resource.state == model.State.ACTIVE)
+            .filter(model.Resource.url_type == "upload")
+            .order_by(model.Resource.id)
+        )
+        if after:
+            query = query.filter(model.Resource.id > after)
+
+        rows = query.limit(RESCAN_BATCH_SIZE).all()
+        if not rows:
+            return
+
+        for resource_id, url in rows:
+            yield resource_id, utils.get_stored_path(resource_id, url)
+
+        after = rows[-1][0]
+
+
+def _report(
+    resource_id: str,
+    future: Future[utils.ScanReport],
+    counts: dict[str, int],
+) -> None:
+    try:
+        report = future.result()
+    except Exception as e:  # noqa: BLE001
+        report = utils.ScanReport(
+            ClamAvStatus.ERROR,
+            str(e),
+            None,
+            None,
+            None,
+            None,
+            0.0,
+        )
+
+    if report.status == ClamAvStatus.OK:
+        counts["clean"] += 1
+    elif report.status == ClamAvStatus.FOUND:
+        counts["infected"] += 1
+        click.secho(
+            f"Resource {resource_id} is infected: {report.signature}",
+            fg="red",
+        )
+    else:
+        counts["failed"] += 1
+        click.secho(
+            f"Resource {resource_id} is not scanned: {report.signature}",
+            fg="yellow",
+        )
+        return
+
+    if tracking.is_enabled():
+        tracking.record(resource_id, report)
+
+
+def _read_checkpoint(path: Optional[str]) -> Optional[str]:
+    if not path or not os.path.exists(path):
+        return None
+
+    with open(path) as f:
+        return f.read().strip() or None
+
+
+def _write_checkpoint(path: str, resource_id: str) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(resource_id)
+    os.replace(tmp_path, path)
+
+
+def get_commands():
+    return [clamav]
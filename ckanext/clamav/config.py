@@ -1,18 +1,67 @@
-from typing import Optional
+from __future__ import annotations
+
+import functools
+import hashlib
+import os
+import socket
+import tempfile
+from typing import TYPE_CHECKING, Any, Callable, NamedTuple, Optional, TypeVar
 
 import ckan.plugins.toolkit as tk
 from ckan.exceptions import CkanConfigurationException
 
+from .router import Address, parse_endpoint
+
+if TYPE_CHECKING:
+    from ckan.config.declaration import Declaration, Key
+
+T = TypeVar("T")
+
 
 class SocketTypes:
     UNIX = "unix"
     TCP = "tcp"
 
 
+class ScanStatus:
+    PENDING = "pending"
+    CLEAN = "clean"
+    INFECTED = "infected"
+    UNSCANNED = "unscanned"
+    ERROR = "error"
+
+
 class ClamAvStatus:
+    OK = "OK"
     FOUND = "FOUND"
+    ERROR = "ERROR"
     ERR_FILELIMIT = "ERR_FILELIMIT"
     ERR_DISABLE = "ERR_DISABLED"
+    ERR_BUSY = "ERR_BUSY"
+    # scanned in windows, so archives and compressed content weren't unpacked
+    ERR_PARTIAL = "ERR_PARTIAL"
+
+
+class EndpointSettings(NamedTuple):
+    family: int
+    address: Address
+    weight: int
+
+
+class Settings(NamedTuple):
+    """The clamd connection settings, parsed and validated once.
+
+    Read on every upload, so they are kept as an immutable tuple instead of
+    re-parsing the config each time. See `get_settings`.
+    """
+
+    endpoints: tuple[EndpointSettings, ...]
+    timeout: int
+    connect_timeout: float
+    idle_timeout: float
+    upload_unscanned: bool
+    asyncio_enabled: bool
+    pool_enabled: bool
 
 
 CLAMAV_CONF_SOCKET_PATH: str = "ckanext.clamav.socket_path"
@@ -26,8 +75,191 @@ CLAMAV_CONF_SOCK_TCP_HOST: str = "ckanext.clamav.tcp.host"
 CLAMAV_CONF_SOCK_TCP_PORT: str = "ckanext.clamav.tcp.port"
 CLAMAV_CONF_CONN_TIMEOUT: str = "ckanext.clamav.timeout"
 CLAMAV_CONF_CONN_TIMEOUT_DF: int = 60
+CLAMAV_CONF_CONNECT_TIMEOUT: str = "ckanext.clamav.timeout.connect"
+CLAMAV_CONF_IDLE_TIMEOUT: str = "ckanext.clamav.timeout.idle"
+CLAMAV_CONF_ADAPTIVE_TIMEOUT: str = "ckanext.clamav.timeout.adaptive"
+CLAMAV_CONF_ADAPTIVE_TIMEOUT_DF: bool = False
+CLAMAV_CONF_TIMEOUT_FLOOR: str = "ckanext.clamav.timeout.floor"
+CLAMAV_CONF_TIMEOUT_FLOOR_DF: float = 10.0
+CLAMAV_CONF_TIMEOUT_CEILING: str = "ckanext.clamav.timeout.ceiling"
+CLAMAV_CONF_TIMEOUT_CEILING_DF: float = 3600.0
+CLAMAV_CONF_ENDPOINTS: str = "ckanext.clamav.endpoints"
+CLAMAV_CONF_ASYNCIO_ENABLED: str = "ckanext.clamav.asyncio.enabled"
+CLAMAV_CONF_ASYNCIO_ENABLED_DF: bool = False
+CLAMAV_CONF_STREAM_MAX_LENGTH: str = "ckanext.clamav.stream_max_length"
+CLAMAV_CONF_STREAM_MAX_LENGTH_PROBE: str = "ckanext.clamav.stream_max_length.probe"
+CLAMAV_CONF_STREAM_MAX_LENGTH_PROBE_DF: bool = False
+
+CLAMAV_CONF_ROUTER_STRATEGY: str = "ckanext.clamav.router.strategy"
+CLAMAV_CONF_ROUTER_STRATEGY_DF: str = "least_outstanding"
+CLAMAV_CONF_ROUTER_MAX_FAILURES: str = "ckanext.clamav.router.max_failures"
+CLAMAV_CONF_ROUTER_MAX_FAILURES_DF: int = 3
+CLAMAV_CONF_ROUTER_PING_INTERVAL: str = "ckanext.clamav.router.ping_interval"
+CLAMAV_CONF_ROUTER_PING_INTERVAL_DF: int = 10
+CLAMAV_CONF_ROUTER_RETRIES: str = "ckanext.clamav.router.retries"
+CLAMAV_CONF_ROUTER_RETRIES_DF: int = 1
+
+CLAMAV_CONF_BREAKER_ENABLED: str = "ckanext.clamav.breaker.enabled"
+CLAMAV_CONF_BREAKER_ENABLED_DF: bool = False
+CLAMAV_CONF_BREAKER_FAILURE_THRESHOLD: str = "ckanext.clamav.breaker.failure_threshold"
+CLAMAV_CONF_BREAKER_FAILURE_THRESHOLD_DF: int = 3
+CLAMAV_CONF_BREAKER_RESET_TIMEOUT: str = "ckanext.clamav.breaker.reset_timeout"
+CLAMAV_CONF_BREAKER_RESET_TIMEOUT_DF: int = 30
+
+CLAMAV_CONF_FILDES_ENABLED: str = "ckanext.clamav.fildes.enabled"
+CLAMAV_CONF_FILDES_ENABLED_DF: bool = False
+CLAMAV_CONF_SHARED_SCAN_DIR: str = "ckanext.clamav.shared_scan_dir"
+
+CLAMAV_CONF_TEE_ENABLED: str = "ckanext.clamav.tee.enabled"
+CLAMAV_CONF_TEE_ENABLED_DF: bool = False
+CLAMAV_CONF_TEE_ALGORITHMS: str = "ckanext.clamav.tee.algorithms"
+CLAMAV_CONF_TEE_ALGORITHMS_DF: str = "sha256"
+
+CLAMAV_CONF_SPOOL_ENABLED: str = "ckanext.clamav.spool.enabled"
+CLAMAV_CONF_SPOOL_ENABLED_DF: bool = False
+CLAMAV_CONF_SPOOL_THRESHOLD: str = "ckanext.clamav.spool.threshold"
+CLAMAV_CONF_SPOOL_THRESHOLD_DF: int = 5 * 1024 * 1024
+CLAMAV_CONF_SPOOL_DIR: str = "ckanext.clamav.spool.dir"
+
+CLAMAV_CONF_CHUNKED_ENABLED: str = "ckanext.clamav.chunked.enabled"
+CLAMAV_CONF_CHUNKED_ENABLED_DF: bool = False
+CLAMAV_CONF_CHUNKED_MAX_STREAMING: str = "ckanext.clamav.chunked.max_streaming"
+CLAMAV_CONF_CHUNKED_MAX_STREAMING_DF: int = 4
+CLAMAV_CONF_CHUNKED_SESSION_TIMEOUT: str = "ckanext.clamav.chunked.session_timeout"
+CLAMAV_CONF_CHUNKED_SESSION_TIMEOUT_DF: int = 3600
+
+CLAMAV_CONF_RECEIVE_SCAN_ENABLED: str = "ckanext.clamav.receive_scan.enabled"
+CLAMAV_CONF_RECEIVE_SCAN_ENABLED_DF: bool = False
+CLAMAV_CONF_RECEIVE_SCAN_MAX_STREAMING: str = (
+    "ckanext.clamav.receive_scan.max_streaming"
+)
+CLAMAV_CONF_RECEIVE_SCAN_MAX_STREAMING_DF: int = 4
+
+CLAMAV_CONF_SEGMENTED_ENABLED: str = "ckanext.clamav.segmented.enabled"
+CLAMAV_CONF_SEGMENTED_ENABLED_DF: bool = False
+CLAMAV_CONF_SEGMENTED_WINDOW_SIZE: str = "ckanext.clamav.segmented.window_size"
+CLAMAV_CONF_SEGMENTED_WINDOW_SIZE_DF: int = 16 * 1024 * 1024
+CLAMAV_CONF_SEGMENTED_OVERLAP: str = "ckanext.clamav.segmented.overlap"
+CLAMAV_CONF_SEGMENTED_OVERLAP_DF: int = 1024 * 1024
+CLAMAV_CONF_SEGMENTED_CONCURRENCY: str = "ckanext.clamav.segmented.concurrency"
+CLAMAV_CONF_SEGMENTED_CONCURRENCY_DF: int = 4
+
+CLAMAV_CONF_CACHE_ENABLED: str = "ckanext.clamav.cache.enabled"
+CLAMAV_CONF_CACHE_ENABLED_DF: bool = False
+CLAMAV_CONF_CACHE_SIZE: str = "ckanext.clamav.cache.size"
+CLAMAV_CONF_CACHE_SIZE_DF: int = 1024
+CLAMAV_CONF_CACHE_TTL: str = "ckanext.clamav.cache.ttl"
+CLAMAV_CONF_CACHE_TTL_DF: int = 3600
+CLAMAV_CONF_CACHE_SHARED: str = "ckanext.clamav.cache.shared"
+CLAMAV_CONF_CACHE_SHARED_DF: bool = False
+CLAMAV_CONF_CACHE_VERSION_TTL: str = "ckanext.clamav.cache.version_ttl"
+CLAMAV_CONF_CACHE_VERSION_TTL_DF: int = 60
+
+CLAMAV_CONF_POOL_ENABLED: str = "ckanext.clamav.pool.enabled"
+CLAMAV_CONF_POOL_ENABLED_DF: bool = False
+CLAMAV_CONF_POOL_MIN_SIZE: str = "ckanext.clamav.pool.min_size"
+CLAMAV_CONF_POOL_MIN_SIZE_DF: int = 1
+CLAMAV_CONF_POOL_MAX_SIZE: str = "ckanext.clamav.pool.max_size"
+CLAMAV_CONF_POOL_MAX_SIZE_DF: int = 10
+CLAMAV_CONF_POOL_IDLE_TIMEOUT: str = "ckanext.clamav.pool.idle_timeout"
+CLAMAV_CONF_POOL_IDLE_TIMEOUT_DF: int = 20
+
+CLAMAV_CONF_ASYNC_ENABLED: str = "ckanext.clamav.async.enabled"
+CLAMAV_CONF_ASYNC_ENABLED_DF: bool = False
+CLAMAV_CONF_ASYNC_QUEUE: str = "ckanext.clamav.async.queue"
+CLAMAV_CONF_ASYNC_QUEUE_DF: str = "default"
+CLAMAV_CONF_ASYNC_MAX_RETRIES: str = "ckanext.clamav.async.max_retries"
+CLAMAV_CONF_ASYNC_MAX_RETRIES_DF: int = 5
+CLAMAV_CONF_ASYNC_RETRY_DELAY: str = "ckanext.clamav.async.retry_delay"
+CLAMAV_CONF_ASYNC_RETRY_DELAY_DF: int = 30
+CLAMAV_CONF_QUARANTINE_PATH: str = "ckanext.clamav.quarantine_path"
+
+CLAMAV_CONF_TRACKING_ENABLED: str = "ckanext.clamav.tracking.enabled"
+CLAMAV_CONF_TRACKING_ENABLED_DF: bool = False
+CLAMAV_CONF_TRACKING_RESCAN_BUDGET: str = "ckanext.clamav.tracking.rescan_budget"
+CLAMAV_CONF_TRACKING_RESCAN_BUDGET_DF: int = 1024 * 1024 * 1024
+
+CLAMAV_CONF_RESULTS_ENABLED: str = "ckanext.clamav.results.enabled"
+CLAMAV_CONF_RESULTS_ENABLED_DF: bool = False
+
+CLAMAV_CONF_BATCH_CONCURRENCY: str = "ckanext.clamav.batch.concurrency"
+CLAMAV_CONF_BATCH_CONCURRENCY_DF: int = 4
+
+CLAMAV_CONF_URL_SCAN_ENABLED: str = "ckanext.clamav.url_scan.enabled"
+CLAMAV_CONF_URL_SCAN_ENABLED_DF: bool = False
+CLAMAV_CONF_URL_SCAN_MAX_SIZE: str = "ckanext.clamav.url_scan.max_size"
+CLAMAV_CONF_URL_SCAN_MAX_SIZE_DF: int = 100 * 1024 * 1024
+CLAMAV_CONF_URL_SCAN_TIMEOUT: str = "ckanext.clamav.url_scan.timeout"
+CLAMAV_CONF_URL_SCAN_TIMEOUT_DF: int = 60
+CLAMAV_CONF_URL_SCAN_ALLOW_PRIVATE: str = "ckanext.clamav.url_scan.allow_private"
+CLAMAV_CONF_URL_SCAN_ALLOW_PRIVATE_DF: bool = False
+
+CLAMAV_CONF_ADMISSION_ENABLED: str = "ckanext.clamav.admission.enabled"
+CLAMAV_CONF_ADMISSION_ENABLED_DF: bool = False
+CLAMAV_CONF_ADMISSION_MAX_IN_FLIGHT: str = "ckanext.clamav.admission.max_in_flight"
+CLAMAV_CONF_ADMISSION_MAX_IN_FLIGHT_DF: int = 4
+CLAMAV_CONF_ADMISSION_SHARED_LIMIT: str = "ckanext.clamav.admission.shared_limit"
+CLAMAV_CONF_ADMISSION_SHARED_LIMIT_DF: int = 0
+CLAMAV_CONF_ADMISSION_SHARED_BACKEND: str = "ckanext.clamav.admission.shared_backend"
+CLAMAV_CONF_ADMISSION_SHARED_BACKEND_DF: str = "file"
+CLAMAV_CONF_ADMISSION_LOCK_DIR: str = "ckanext.clamav.admission.lock_dir"
+CLAMAV_CONF_ADMISSION_QUEUE_TIMEOUT: str = "ckanext.clamav.admission.queue_timeout"
+CLAMAV_CONF_ADMISSION_QUEUE_TIMEOUT_DF: int = 60
+CLAMAV_CONF_ADMISSION_AGING_RATE: str = "ckanext.clamav.admission.aging_rate"
+CLAMAV_CONF_ADMISSION_AGING_RATE_DF: int = 32 * 1024 * 1024
+
+CLAMAV_CONF_REPUTATION_DENYLIST: str = "ckanext.clamav.reputation.denylist"
+CLAMAV_CONF_REPUTATION_ALLOWLIST: str = "ckanext.clamav.reputation.allowlist"
+
+CLAMAV_CONF_METRICS_EXPORTER: str = "ckanext.clamav.metrics.exporter"
+CLAMAV_CONF_STATSD_HOST: str = "ckanext.clamav.metrics.statsd.host"
+CLAMAV_CONF_STATSD_HOST_DF: str = "localhost"
+CLAMAV_CONF_STATSD_PORT: str = "ckanext.clamav.metrics.statsd.port"
+CLAMAV_CONF_STATSD_PORT_DF: int = 8125
+CLAMAV_CONF_STATSD_PREFIX: str = "ckanext.clamav.metrics.statsd.prefix"
+CLAMAV_CONF_STATSD_PREFIX_DF: str = "clamav"
+CLAMAV_CONF_PROMETHEUS_MULTIPROCESS_DIR: str = (
+    "ckanext.clamav.metrics.prometheus.multiprocess_dir"
+)
+
+CLAMAV_CONF_WARM_UP: str = "ckanext.clamav.warm_up"
+CLAMAV_CONF_WARM_UP_DF: bool = False
 
+# the integer options without a default value
+INT_OPTIONS: tuple[str, ...] = (
+    CLAMAV_CONF_SOCK_TCP_PORT,
+    CLAMAV_CONF_STREAM_MAX_LENGTH,
+)
 
+_settings: Optional[Settings] = None
+
+# the values of the option getters, parsed on the first call
+_parsed: dict[str, Any] = {}
+_getters: list[Callable[[], Any]] = []
+
+
+def parsed_once(getter: Callable[[], T]) -> Callable[[], T]:
+    """Parse the option of a getter once and return the same value after.
+
+    The options don't change while CKAN is running, but the getters are
+    called on every scan. `configure` parses all of them at startup and
+    `reset` forgets the parsed values.
+    """
+    name = getter.__name__
+
+    @functools.wraps(getter)
+    def wrapper() -> T:
+        try:
+            return _parsed[name]
+        except KeyError:
+            value = _parsed[name] = getter()
+            return value
+
+    _getters.append(wrapper)
+    return wrapper
+
+
+@parsed_once
 def upload_unscanned() -> bool:
     """Get whether unscanned files should be uploaded.
 
@@ -40,6 +272,7 @@ def upload_unscanned() -> bool:
     )
 
 
+@parsed_once
 def socket_type() -> str:
     """Get the socket type.
 
@@ -54,6 +287,7 @@ def socket_type() -> str:
     return socket_type_val
 
 
+@parsed_once
 def conn_timeout() -> int:
     """Get the connection timeout.
 
@@ -66,6 +300,74 @@ def conn_timeout() -> int:
     )
 
 
+@parsed_once
+def connect_timeout() -> float:
+    """Get the time limit of opening a connection to clamd.
+
+    Returns:
+        The time in seconds.
+        Defaults to ckanext.clamav.timeout via ckanext.clamav.timeout.connect
+            config option.
+    """
+    return float(tk.config.get(CLAMAV_CONF_CONNECT_TIMEOUT) or conn_timeout())
+
+
+@parsed_once
+def idle_timeout() -> float:
+    """Get the time limit of a single read or write on a clamd connection.
+
+    A scan that makes no progress for this long, e.g. a hung clamd, fails.
+
+    Returns:
+        The time in seconds.
+        Defaults to ckanext.clamav.timeout via ckanext.clamav.timeout.idle
+            config option.
+    """
+    return float(tk.config.get(CLAMAV_CONF_IDLE_TIMEOUT) or conn_timeout())
+
+
+@parsed_once
+def adaptive_timeout() -> bool:
+    """Get whether every scan gets a total deadline based on the file size.
+
+    Returns:
+        True if the total deadline is enforced, False otherwise.
+        Defaults to False via ckanext.clamav.timeout.adaptive config option.
+    """
+    return tk.asbool(
+        tk.config.get(CLAMAV_CONF_ADAPTIVE_TIMEOUT, CLAMAV_CONF_ADAPTIVE_TIMEOUT_DF),
+    )
+
+
+@parsed_once
+def timeout_floor() -> float:
+    """Get the shortest total deadline of a scan.
+
+    Returns:
+        The time in seconds.
+        Defaults to 10 via ckanext.clamav.timeout.floor config option.
+    """
+    return float(
+        tk.config.get(CLAMAV_CONF_TIMEOUT_FLOOR, CLAMAV_CONF_TIMEOUT_FLOOR_DF),
+    )
+
+
+@parsed_once
+def timeout_ceiling() -> float:
+    """Get the longest total deadline of a scan.
+
+    It's also the deadline of a file of unknown size.
+
+    Returns:
+        The time in seconds.
+        Defaults to 3600 via ckanext.clamav.timeout.ceiling config option.
+    """
+    return float(
+        tk.config.get(CLAMAV_CONF_TIMEOUT_CEILING, CLAMAV_CONF_TIMEOUT_CEILING_DF),
+    )
+
+
+@parsed_once
 def socket_path() -> str:
     """Get the socket path.
 
@@ -77,6 +379,7 @@ def socket_path() -> str:
     return tk.config.get(CLAMAV_CONF_SOCKET_PATH, CLAMAV_CONF_SOCKET_PATH_DF)
 
 
+@parsed_once
 def tcp_host() -> str:
     """Get the TCP host.
 
@@ -87,6 +390,7 @@ def tcp_host() -> str:
     return tk.config.get(CLAMAV_CONF_SOCK_TCP_HOST)
 
 
+@parsed_once
 def tcp_port() -> Optional[int]:
     """Get the TCP port.
 
@@ -97,3 +401,1062 @@ def tcp_port() -> Optional[int]:
     if tk.config.get(CLAMAV_CONF_SOCK_TCP_PORT):
         return tk.asint(tk.config.get(CLAMAV_CONF_SOCK_TCP_PORT))
     return None
+
+
+@parsed_once
+def endpoints() -> list[str]:
+    """Get the list of clamd endpoint URLs.
+
+    Returns:
+        The endpoint URLs, e.g. `unix:///var/run/clamav/clamd.ctl` or
+            `tcp://clamd:3310?weight=2`.
+        Defaults to an empty list via ckanext.clamav.endpoints config option,
+            in which case the single socket_type endpoint is used.
+    """
+    return tk.aslist(tk.config.get(CLAMAV_CONF_ENDPOINTS, ""))
+
+
+@parsed_once
+def asyncio_enabled() -> bool:
+    """Get whether clamd is accessed with the asyncio client.
+
+    Returns:
+        True if the asyncio client is used, False if the `clamd` library is.
+        Defaults to False via ckanext.clamav.asyncio.enabled config option.
+    """
+    return tk.asbool(
+        tk.config.get(CLAMAV_CONF_ASYNCIO_ENABLED, CLAMAV_CONF_ASYNCIO_ENABLED_DF),
+    )
+
+
+@parsed_once
+def stream_max_length() -> Optional[int]:
+    """Get the clamd stream size limit, `StreamMaxLength` in clamd.conf.
+
+    Files over the limit are not streamed to clamd at all.
+
+    Returns:
+        The limit in bytes or None if it's not set.
+    """
+    value = tk.config.get(CLAMAV_CONF_STREAM_MAX_LENGTH)
+    return tk.asint(value) if value else None
+
+
+@parsed_once
+def stream_max_length_probe() -> bool:
+    """Get whether the clamd stream size limit should be probed.
+
+    The probe is used only if the limit is not set explicitly.
+
+    Returns:
+        True if the limit should be probed, False otherwise.
+        Defaults to False via ckanext.clamav.stream_max_length.probe config option.
+    """
+    return tk.asbool(
+        tk.config.get(
+            CLAMAV_CONF_STREAM_MAX_LENGTH_PROBE,
+            CLAMAV_CONF_STREAM_MAX_LENGTH_PROBE_DF,
+        ),
+    )
+
+
+@parsed_once
+def router_strategy() -> str:
+    """Get the strategy used to pick a clamd endpoint for a scan.
+
+    Returns:
+        Either `least_outstanding` or `round_robin`.
+        Defaults to `least_outstanding` via ckanext.clamav.router.strategy
+            config option.
+    """
+    return tk.config.get(CLAMAV_CONF_ROUTER_STRATEGY, CLAMAV_CONF_ROUTER_STRATEGY_DF)
+
+
+@parsed_once
+def router_max_failures() -> int:
+    """Get the number of consecutive errors that take an endpoint out.
+
+    Returns:
+        The number of errors.
+        Defaults to 3 via ckanext.clamav.router.max_failures config option.
+    """
+    return tk.asint(
+        tk.config.get(
+            CLAMAV_CONF_ROUTER_MAX_FAILURES,
+            CLAMAV_CONF_ROUTER_MAX_FAILURES_DF,
+        ),
+    )
+
+
+@parsed_once
+def router_ping_interval() -> int:
+    """Get the interval between the background PINGs of the endpoints.
+
+    Returns:
+        The interval in seconds, 0 disables the PINGs.
+        Defaults to 10 via ckanext.clamav.router.ping_interval config option.
+    """
+    return tk.asint(
+        tk.config.get(
+            CLAMAV_CONF_ROUTER_PING_INTERVAL,
+            CLAMAV_CONF_ROUTER_PING_INTERVAL_DF,
+        ),
+    )
+
+
+@parsed_once
+def router_retries() -> int:
+    """Get how many times a scan is retried on another endpoint.
+
+    Returns:
+        The number of retries after a connection error.
+        Defaults to 1 via ckanext.clamav.router.retries config option.
+    """
+    return tk.asint(
+        tk.config.get(CLAMAV_CONF_ROUTER_RETRIES, CLAMAV_CONF_ROUTER_RETRIES_DF),
+    )
+
+
+@parsed_once
+def breaker_enabled() -> bool:
+    """Get whether the clamd endpoints are guarded by circuit breakers.
+
+    Returns:
+        True if the circuit breakers are enabled, False otherwise.
+        Defaults to False via ckanext.clamav.breaker.enabled config option.
+    """
+    return tk.asbool(
+        tk.config.get(CLAMAV_CONF_BREAKER_ENABLED, CLAMAV_CONF_BREAKER_ENABLED_DF),
+    )
+
+
+@parsed_once
+def breaker_failure_threshold() -> int:
+    """Get the number of consecutive errors that open the circuit.
+
+    Returns:
+        The number of errors.
+        Defaults to 3 via ckanext.clamav.breaker.failure_threshold config option.
+    """
+    return tk.asint(
+        tk.config.get(
+            CLAMAV_CONF_BREAKER_FAILURE_THRESHOLD,
+            CLAMAV_CONF_BREAKER_FAILURE_THRESHOLD_DF,
+        ),
+    )
+
+
+@parsed_once
+def breaker_reset_timeout() -> int:
+    """Get the time before an open circuit lets a trial scan through.
+
+    Returns:
+        The timeout in seconds.
+        Defaults to 30 via ckanext.clamav.breaker.reset_timeout config option.
+    """
+    return tk.asint(
+        tk.config.get(
+            CLAMAV_CONF_BREAKER_RESET_TIMEOUT,
+            CLAMAV_CONF_BREAKER_RESET_TIMEOUT_DF,
+        ),
+    )
+
+
+@parsed_once
+def fildes_enabled() -> bool:
+    """Get whether files on local disk should be passed to clamd by descriptor.
+
+    Returns:
+        True if the FILDES fast path is enabled for unix socket endpoints,
+            False otherwise.
+        Defaults to False via ckanext.clamav.fildes.enabled config option.
+    """
+    return tk.asbool(
+        tk.config.get(CLAMAV_CONF_FILDES_ENABLED, CLAMAV_CONF_FILDES_ENABLED_DF),
+    )
+
+
+@parsed_once
+def shared_scan_dir() -> Optional[str]:
+    """Get the directory readable by clamd, where files are scanned by path.
+
+    Returns:
+        The shared directory.
+        Defaults to None via ckanext.clamav.shared_scan_dir config option,
+            which disables the SCAN fast path.
+    """
+    return tk.config.get(CLAMAV_CONF_SHARED_SCAN_DIR)
+
+
+@parsed_once
+def tee_enabled() -> bool:
+    """Get whether the upload should be hashed and spooled while it's scanned.
+
+    Returns:
+        True if the single-pass tee is enabled, False otherwise.
+        Defaults to False via ckanext.clamav.tee.enabled config option.
+    """
+    return tk.asbool(
+        tk.config.get(CLAMAV_CONF_TEE_ENABLED, CLAMAV_CONF_TEE_ENABLED_DF),
+    )
+
+
+@parsed_once
+def tee_algorithms() -> list[str]:
+    """Get the hash algorithms computed while the upload is scanned.
+
+    The digest of the first one is used as the resource hash.
+
+    Returns:
+        The hashlib algorithm names.
+        Defaults to `sha256` via ckanext.clamav.tee.algorithms config option.
+    """
+    algorithms = tk.aslist(
+        tk.config.get(CLAMAV_CONF_TEE_ALGORITHMS, CLAMAV_CONF_TEE_ALGORITHMS_DF),
+    )
+
+    unsupported = set(algorithms) - hashlib.algorithms_available
+    if unsupported:
+        raise CkanConfigurationException(
+            f"Clamd: unsupported hash algorithms: {', '.join(sorted(unsupported))}",
+        )
+
+    return algorithms
+
+
+@parsed_once
+def spool_enabled() -> bool:
+    """Get whether large in-memory uploads are moved to disk before the scan.
+
+    Returns:
+        True if the uploads are spooled, False otherwise.
+        Defaults to False via ckanext.clamav.spool.enabled config option.
+    """
+    return tk.asbool(
+        tk.config.get(CLAMAV_CONF_SPOOL_ENABLED, CLAMAV_CONF_SPOOL_ENABLED_DF),
+    )
+
+
+@parsed_once
+def spool_threshold() -> int:
+    """Get the size of the largest upload that is kept in memory.
+
+    Returns:
+        The size in bytes.
+        Defaults to 5MiB via ckanext.clamav.spool.threshold config option.
+    """
+    return tk.asint(
+        tk.config.get(CLAMAV_CONF_SPOOL_THRESHOLD, CLAMAV_CONF_SPOOL_THRESHOLD_DF),
+    )
+
+
+@parsed_once
+def spool_dir() -> Optional[str]:
+    """Get the directory of the spool files.
+
+    Returns:
+        The directory.
+        Defaults to ckanext.clamav.shared_scan_dir, if it's set, so clamd can
+            read the spool files by path, or to the system temporary
+            directory via ckanext.clamav.spool.dir config option.
+    """
+    return tk.config.get(CLAMAV_CONF_SPOOL_DIR) or shared_scan_dir()
+
+
+@parsed_once
+def chunked_enabled() -> bool:
+    """Get whether chunked uploads are scanned while the chunks arrive.
+
+    Returns:
+        True if the chunks are scanned incrementally, False otherwise.
+        Defaults to False via ckanext.clamav.chunked.enabled config option.
+    """
+    return tk.asbool(
+        tk.config.get(CLAMAV_CONF_CHUNKED_ENABLED, CLAMAV_CONF_CHUNKED_ENABLED_DF),
+    )
+
+
+@parsed_once
+def chunked_max_streaming() -> int:
+    """Get the number of chunked uploads streamed to clamd at once.
+
+    Returns:
+        The number of uploads, per process.
+        Defaults to 4 via ckanext.clamav.chunked.max_streaming config option.
+    """
+    return tk.asint(
+        tk.config.get(
+            CLAMAV_CONF_CHUNKED_MAX_STREAMING,
+            CLAMAV_CONF_CHUNKED_MAX_STREAMING_DF,
+        ),
+    )
+
+
+@parsed_once
+def chunked_session_timeout() -> int:
+    """Get how long an unfinished chunked upload is waited for.
+
+    Returns:
+        The time in seconds since the last chunk.
+        Defaults to 3600 via ckanext.clamav.chunked.session_timeout config
+            option.
+    """
+    return tk.asint(
+        tk.config.get(
+            CLAMAV_CONF_CHUNKED_SESSION_TIMEOUT,
+            CLAMAV_CONF_CHUNKED_SESSION_TIMEOUT_DF,
+        ),
+    )
+
+
+@parsed_once
+def receive_scan_enabled() -> bool:
+    """Get whether uploads are streamed to clamd while the body is received.
+
+    Returns:
+        True if the resource uploads are scanned while they are received,
+            False otherwise.
+        Defaults to False via ckanext.clamav.receive_scan.enabled config
+            option.
+    """
+    return tk.asbool(
+        tk.config.get(
+            CLAMAV_CONF_RECEIVE_SCAN_ENABLED,
+            CLAMAV_CONF_RECEIVE_SCAN_ENABLED_DF,
+        ),
+    )
+
+
+@parsed_once
+def receive_scan_max_streaming() -> int:
+    """Get the number of uploads streamed to clamd while they are received.
+
+    Returns:
+        The number of uploads, per process.
+        Defaults to 4 via ckanext.clamav.receive_scan.max_streaming config
+            option.
+    """
+    return tk.asint(
+        tk.config.get(
+            CLAMAV_CONF_RECEIVE_SCAN_MAX_STREAMING,
+            CLAMAV_CONF_RECEIVE_SCAN_MAX_STREAMING_DF,
+        ),
+    )
+
+
+@parsed_once
+def segmented_enabled() -> bool:
+    """Get whether files over the clamd stream limit are scanned in windows.
+
+    Returns:
+        True if the segmented mode is enabled, False otherwise.
+        Defaults to False via ckanext.clamav.segmented.enabled config option.
+    """
+    return tk.asbool(
+        tk.config.get(CLAMAV_CONF_SEGMENTED_ENABLED, CLAMAV_CONF_SEGMENTED_ENABLED_DF),
+    )
+
+
+@parsed_once
+def segmented_window_size() -> int:
+    """Get the size of a window in the segmented mode.
+
+    It must be lower than `StreamMaxLength` in clamd.conf.
+
+    Returns:
+        The window size in bytes.
+        Defaults to 16MiB via ckanext.clamav.segmented.window_size config option.
+    """
+    return tk.asint(
+        tk.config.get(
+            CLAMAV_CONF_SEGMENTED_WINDOW_SIZE,
+            CLAMAV_CONF_SEGMENTED_WINDOW_SIZE_DF,
+        ),
+    )
+
+
+@parsed_once
+def segmented_overlap() -> int:
+    """Get the number of bytes shared by adjacent windows.
+
+    Returns:
+        The overlap in bytes.
+        Defaults to 1MiB via ckanext.clamav.segmented.overlap config option.
+
+    Raises:
+        CkanConfigurationException: if the overlap is not smaller than
+            the window
+    """
+    overlap = tk.asint(
+        tk.config.get(CLAMAV_CONF_SEGMENTED_OVERLAP, CLAMAV_CONF_SEGMENTED_OVERLAP_DF),
+    )
+    if not 0 <= overlap < segmented_window_size():
+        raise CkanConfigurationException(
+            "Clamd: the segment overlap must be smaller than the window size",
+        )
+
+    return overlap
+
+
+@parsed_once
+def segmented_concurrency() -> int:
+    """Get the number of windows scanned in parallel.
+
+    Returns:
+        The number of windows.
+        Defaults to 4 via ckanext.clamav.segmented.concurrency config option.
+    """
+    return tk.asint(
+        tk.config.get(
+            CLAMAV_CONF_SEGMENTED_CONCURRENCY,
+            CLAMAV_CONF_SEGMENTED_CONCURRENCY_DF,
+        ),
+    )
+
+
+@parsed_once
+def cache_enabled() -> bool:
+    """Get whether the scan verdicts should be cached.
+
+    Returns:
+        True if the verdict cache is enabled, False otherwise.
+        Defaults to False via ckanext.clamav.cache.enabled config option.
+    """
+    return tk.asbool(
+        tk.config.get(CLAMAV_CONF_CACHE_ENABLED, CLAMAV_CONF_CACHE_ENABLED_DF),
+    )
+
+
+@parsed_once
+def cache_size() -> int:
+    """Get the maximum number of verdicts kept in the in-process cache.
+
+    Returns:
+        The in-process cache size.
+        Defaults to 1024 via ckanext.clamav.cache.size config option.
+    """
+    return tk.asint(
+        tk.config.get(CLAMAV_CONF_CACHE_SIZE, CLAMAV_CONF_CACHE_SIZE_DF),
+    )
+
+
+@parsed_once
+def cache_ttl() -> int:
+    """Get the time to live of a cached verdict.
+
+    Returns:
+        The verdict TTL in seconds.
+        Defaults to 3600 via ckanext.clamav.cache.ttl config option.
+    """
+    return tk.asint(
+        tk.config.get(CLAMAV_CONF_CACHE_TTL, CLAMAV_CONF_CACHE_TTL_DF),
+    )
+
+
+@parsed_once
+def cache_shared() -> bool:
+    """Get whether the verdicts should be shared between workers via Redis.
+
+    Returns:
+        True if the shared cache tier is enabled, False otherwise.
+        Defaults to False via ckanext.clamav.cache.shared config option.
+    """
+    return tk.asbool(
+        tk.config.get(CLAMAV_CONF_CACHE_SHARED, CLAMAV_CONF_CACHE_SHARED_DF),
+    )
+
+
+@parsed_once
+def cache_version_ttl() -> int:
+    """Get for how long the signature database version is remembered.
+
+    Returns:
+        The number of seconds between VERSION requests to clamd.
+        Defaults to 60 via ckanext.clamav.cache.version_ttl config option.
+    """
+    return tk.asint(
+        tk.config.get(
+            CLAMAV_CONF_CACHE_VERSION_TTL,
+            CLAMAV_CONF_CACHE_VERSION_TTL_DF,
+        ),
+    )
+
+
+@parsed_once
+def pool_enabled() -> bool:
+    """Get whether persistent clamd sessions should be pooled.
+
+    Returns:
+        True if the connection pool is enabled, False otherwise.
+        Defaults to False via ckanext.clamav.pool.enabled config option.
+    """
+    return tk.asbool(
+        tk.config.get(CLAMAV_CONF_POOL_ENABLED, CLAMAV_CONF_POOL_ENABLED_DF),
+    )
+
+
+@parsed_once
+def pool_min_size() -> int:
+    """Get the number of sessions the pool keeps open when idle.
+
+    Returns:
+        The minimum pool size.
+        Defaults to 1 via ckanext.clamav.pool.min_size config option.
+    """
+    return tk.asint(
+        tk.config.get(CLAMAV_CONF_POOL_MIN_SIZE, CLAMAV_CONF_POOL_MIN_SIZE_DF),
+    )
+
+
+@parsed_once
+def pool_max_size() -> int:
+    """Get the maximum number of sessions the pool opens.
+
+    Returns:
+        The maximum pool size.
+        Defaults to 10 via ckanext.clamav.pool.max_size config option.
+    """
+    return tk.asint(
+        tk.config.get(CLAMAV_CONF_POOL_MAX_SIZE, CLAMAV_CONF_POOL_MAX_SIZE_DF),
+    )
+
+
+@parsed_once
+def pool_idle_timeout() -> int:
+    """Get for how long an idle pooled session is kept open.
+
+    It must be lower than `IdleTimeout` in clamd.conf, otherwise clamd
+    closes the sessions first.
+
+    Returns:
+        The idle timeout in seconds.
+        Defaults to 20 via ckanext.clamav.pool.idle_timeout config option.
+    """
+    return tk.asint(
+        tk.config.get(
+            CLAMAV_CONF_POOL_IDLE_TIMEOUT,
+            CLAMAV_CONF_POOL_IDLE_TIMEOUT_DF,
+        ),
+    )
+
+
+@parsed_once
+def async_enabled() -> bool:
+    """Get whether uploads should be scanned in a background job.
+
+    Returns:
+        True if the scan-after-upload mode is enabled, False otherwise.
+        Defaults to False via ckanext.clamav.async.enabled config option.
+    """
+    return tk.asbool(
+        tk.config.get(CLAMAV_CONF_ASYNC_ENABLED, CLAMAV_CONF_ASYNC_ENABLED_DF),
+    )
+
+
+@parsed_once
+def async_queue() -> str:
+    """Get the name of the background jobs queue used for scans.
+
+    Returns:
+        The queue name.
+        Defaults to `default` via ckanext.clamav.async.queue config option.
+    """
+    return tk.config.get(CLAMAV_CONF_ASYNC_QUEUE, CLAMAV_CONF_ASYNC_QUEUE_DF)
+
+
+@parsed_once
+def async_max_retries() -> int:
+    """Get how many times the background scan of a file is retried.
+
+    The scan is retried if clamd is not accessible or busy, or if the job
+    fails.
+
+    Returns:
+        The number of retries.
+        Defaults to 5 via ckanext.clamav.async.max_retries config option.
+    """
+    return tk.asint(
+        tk.config.get(CLAMAV_CONF_ASYNC_MAX_RETRIES, CLAMAV_CONF_ASYNC_MAX_RETRIES_DF),
+    )
+
+
+@parsed_once
+def async_retry_delay() -> int:
+    """Get the delay before the first retry of a background scan.
+
+    The delay doubles with every next retry.
+
+    Returns:
+        The delay in seconds.
+        Defaults to 30 via ckanext.clamav.async.retry_delay config option.
+    """
+    return tk.asint(
+        tk.config.get(CLAMAV_CONF_ASYNC_RETRY_DELAY, CLAMAV_CONF_ASYNC_RETRY_DELAY_DF),
+    )
+
+
+def quarantine_path() -> str:
+    """Get the directory where uploads wait for the background scan.
+
+    Returns:
+        The quarantine path.
+        Defaults to `clamav_quarantine` inside ckan.storage_path via
+            ckanext.clamav.quarantine_path config option.
+
+    Raises:
+        CkanConfigurationException: if neither the quarantine path nor
+            ckan.storage_path are configured
+    """
+    path = tk.config.get(CLAMAV_CONF_QUARANTINE_PATH)
+    if path:
+        return path
+
+    storage_path = tk.config.get("ckan.storage_path")
+    if not storage_path:
+        raise CkanConfigurationException(
+            "Clamd: please, provide either ckanext.clamav.quarantine_path "
+            "or ckan.storage_path for the async scan mode",
+        )
+
+    return os.path.join(storage_path, "clamav_quarantine")
+
+
+@parsed_once
+def tracking_enabled() -> bool:
+    """Get whether the signature version of every resource scan is recorded.
+
+    Returns:
+        True if the scans are recorded, False otherwise.
+        Defaults to False via ckanext.clamav.tracking.enabled config option.
+    """
+    return tk.asbool(
+        tk.config.get(CLAMAV_CONF_TRACKING_ENABLED, CLAMAV_CONF_TRACKING_ENABLED_DF),
+    )
+
+
+@parsed_once
+def tracking_rescan_budget() -> int:
+    """Get the number of bytes rescanned by a single stale resources rescan.
+
+    Returns:
+        The budget in bytes.
+        Defaults to 1GiB via ckanext.clamav.tracking.rescan_budget config option.
+    """
+    return tk.asint(
+        tk.config.get(
+            CLAMAV_CONF_TRACKING_RESCAN_BUDGET,
+            CLAMAV_CONF_TRACKING_RESCAN_BUDGET_DF,
+        ),
+    )
+
+
+@parsed_once
+def results_enabled() -> bool:
+    """Get whether the results of resource scans are persisted.
+
+    Returns:
+        True if the scan results are persisted, False otherwise.
+        Defaults to False via ckanext.clamav.results.enabled config option.
+    """
+    return tk.asbool(
+        tk.config.get(CLAMAV_CONF_RESULTS_ENABLED, CLAMAV_CONF_RESULTS_ENABLED_DF),
+    )
+
+
+@parsed_once
+def metrics_exporter() -> Optional[str]:
+    """Get the exporter of the scan metrics.
+
+    Returns:
+        `prometheus`, `statsd` or an import path of a custom exporter class,
+            e.g. `ckanext.myext.metrics:MyExporter`.
+        Defaults to None via ckanext.clamav.metrics.exporter config option,
+            which disables the metrics.
+    """
+    return tk.config.get(CLAMAV_CONF_METRICS_EXPORTER) or None
+
+
+@parsed_once
+def statsd_host() -> str:
+    """Get the StatsD host the metrics are sent to.
+
+    Returns:
+        The hostname.
+        Defaults to `localhost` via ckanext.clamav.metrics.statsd.host config option.
+    """
+    return tk.config.get(CLAMAV_CONF_STATSD_HOST, CLAMAV_CONF_STATSD_HOST_DF)
+
+
+@parsed_once
+def statsd_port() -> int:
+    """Get the StatsD UDP port the metrics are sent to.
+
+    Returns:
+        The port.
+        Defaults to 8125 via ckanext.clamav.metrics.statsd.port config option.
+    """
+    return tk.asint(tk.config.get(CLAMAV_CONF_STATSD_PORT, CLAMAV_CONF_STATSD_PORT_DF))
+
+
+@parsed_once
+def statsd_prefix() -> str:
+    """Get the prefix of the StatsD metric names.
+
+    Returns:
+        The prefix.
+        Defaults to `clamav` via ckanext.clamav.metrics.statsd.prefix config option.
+    """
+    return tk.config.get(CLAMAV_CONF_STATSD_PREFIX, CLAMAV_CONF_STATSD_PREFIX_DF)
+
+
+@parsed_once
+def prometheus_multiprocess_dir() -> Optional[str]:
+    """Get the directory where the worker processes keep their metrics.
+
+    Returns:
+        The directory path.
+        Defaults to None via ckanext.clamav.metrics.prometheus.multiprocess_dir
+            config option, so a scrape gets the metrics of a single process.
+    """
+    return tk.config.get(CLAMAV_CONF_PROMETHEUS_MULTIPROCESS_DIR) or None
+
+
+@parsed_once
+def batch_concurrency() -> int:
+    """Get the number of uploads of a single dataset update scanned at once.
+
+    Returns:
+        The number of concurrent scans, 1 scans the uploads one by one.
+        Defaults to 4 via ckanext.clamav.batch.concurrency config option.
+    """
+    return max(
+        1,
+        tk.asint(
+            tk.config.get(
+                CLAMAV_CONF_BATCH_CONCURRENCY,
+                CLAMAV_CONF_BATCH_CONCURRENCY_DF,
+            ),
+        ),
+    )
+
+
+@parsed_once
+def url_scan_enabled() -> bool:
+    """Get whether the content of URL-linked resources is scanned.
+
+    Returns:
+        True if the linked content is scanned, False otherwise.
+        Defaults to False via ckanext.clamav.url_scan.enabled config option.
+    """
+    return tk.asbool(
+        tk.config.get(CLAMAV_CONF_URL_SCAN_ENABLED, CLAMAV_CONF_URL_SCAN_ENABLED_DF),
+    )
+
+
+@parsed_once
+def url_scan_max_size() -> int:
+    """Get the maximum number of bytes of the linked content to scan.
+
+    Returns:
+        The size cap in bytes.
+        Defaults to 100MiB via ckanext.clamav.url_scan.max_size config option.
+    """
+    return tk.asint(
+        tk.config.get(CLAMAV_CONF_URL_SCAN_MAX_SIZE, CLAMAV_CONF_URL_SCAN_MAX_SIZE_DF),
+    )
+
+
+@parsed_once
+def url_scan_timeout() -> int:
+    """Get the time limit of downloading and scanning the linked content.
+
+    Returns:
+        The time cap in seconds.
+        Defaults to 60 via ckanext.clamav.url_scan.timeout config option.
+    """
+    return tk.asint(
+        tk.config.get(CLAMAV_CONF_URL_SCAN_TIMEOUT, CLAMAV_CONF_URL_SCAN_TIMEOUT_DF),
+    )
+
+
+@parsed_once
+def url_scan_allow_private() -> bool:
+    """Get whether links to private and loopback addresses are downloaded.
+
+    Returns:
+        True if private addresses are allowed, False otherwise.
+        Defaults to False via ckanext.clamav.url_scan.allow_private config option.
+    """
+    return tk.asbool(
+        tk.config.get(
+            CLAMAV_CONF_URL_SCAN_ALLOW_PRIVATE,
+            CLAMAV_CONF_URL_SCAN_ALLOW_PRIVATE_DF,
+        ),
+    )
+
+
+@parsed_once
+def reputation_denylist() -> Optional[str]:
+    """Get the hash list of known malicious files.
+
+    Returns:
+        The path of a list built with `ckan clamav build-hash-list`.
+        Defaults to None via ckanext.clamav.reputation.denylist config option,
+            which disables the denylist.
+    """
+    return tk.config.get(CLAMAV_CONF_REPUTATION_DENYLIST) or None
+
+
+@parsed_once
+def reputation_allowlist() -> Optional[str]:
+    """Get the hash list of known clean files.
+
+    Returns:
+        The path of a list built with `ckan clamav build-hash-list`.
+        Defaults to None via ckanext.clamav.reputation.allowlist config option,
+            which disables the allowlist.
+    """
+    return tk.config.get(CLAMAV_CONF_REPUTATION_ALLOWLIST) or None
+
+
+@parsed_once
+def admission_enabled() -> bool:
+    """Get whether the concurrent scans are limited and queued.
+
+    Returns:
+        True if the admission control is enabled, False otherwise.
+        Defaults to False via ckanext.clamav.admission.enabled config option.
+    """
+    return tk.asbool(
+        tk.config.get(CLAMAV_CONF_ADMISSION_ENABLED, CLAMAV_CONF_ADMISSION_ENABLED_DF),
+    )
+
+
+@parsed_once
+def admission_max_in_flight() -> int:
+    """Get the maximum number of scans in flight in a single process.
+
+    Returns:
+        The number of scans.
+        Defaults to 4 via ckanext.clamav.admission.max_in_flight config option.
+    """
+    return max(
+        1,
+        tk.asint(
+            tk.config.get(
+                CLAMAV_CONF_ADMISSION_MAX_IN_FLIGHT,
+                CLAMAV_CONF_ADMISSION_MAX_IN_FLIGHT_DF,
+            ),
+        ),
+    )
+
+
+@parsed_once
+def admission_shared_limit() -> int:
+    """Get the maximum number of scans in flight across all the processes.
+
+    Returns:
+        The number of scans, 0 disables the shared limit.
+        Defaults to 0 via ckanext.clamav.admission.shared_limit config option.
+    """
+    return max(
+        0,
+        tk.asint(
+            tk.config.get(
+                CLAMAV_CONF_ADMISSION_SHARED_LIMIT,
+                CLAMAV_CONF_ADMISSION_SHARED_LIMIT_DF,
+            ),
+        ),
+    )
+
+
+@parsed_once
+def admission_shared_backend() -> str:
+    """Get where the scans in flight across the processes are counted.
+
+    Returns:
+        `file` for lock files, shared by the processes of a host, or `redis`,
+            shared by all the hosts.
+        Defaults to `file` via ckanext.clamav.admission.shared_backend config
+            option.
+    """
+    return tk.config.get(
+        CLAMAV_CONF_ADMISSION_SHARED_BACKEND,
+        CLAMAV_CONF_ADMISSION_SHARED_BACKEND_DF,
+    )
+
+
+@parsed_once
+def admission_lock_dir() -> str:
+    """Get the directory of the lock files of the shared limit.
+
+    Returns:
+        The directory path.
+        Defaults to `ckanext-clamav-admission` inside the system temporary
+            directory via ckanext.clamav.admission.lock_dir config option.
+    """
+    return tk.config.get(CLAMAV_CONF_ADMISSION_LOCK_DIR) or os.path.join(
+        tempfile.gettempdir(),
+        "ckanext-clamav-admission",
+    )
+
+
+@parsed_once
+def admission_queue_timeout() -> int:
+    """Get how long a scan waits for a free slot.
+
+    Returns:
+        The time in seconds.
+        Defaults to 60 via ckanext.clamav.admission.queue_timeout config option.
+    """
+    return tk.asint(
+        tk.config.get(
+            CLAMAV_CONF_ADMISSION_QUEUE_TIMEOUT,
+            CLAMAV_CONF_ADMISSION_QUEUE_TIMEOUT_DF,
+        ),
+    )
+
+
+@parsed_once
+def admission_aging_rate() -> int:
+    """Get how fast a waiting scan moves up the queue.
+
+    Returns:
+        The number of bytes a waiting file is treated as smaller by, per
+            second of waiting.
+        Defaults to 32MiB via ckanext.clamav.admission.aging_rate config option.
+    """
+    return tk.asint(
+        tk.config.get(
+            CLAMAV_CONF_ADMISSION_AGING_RATE,
+            CLAMAV_CONF_ADMISSION_AGING_RATE_DF,
+        ),
+    )
+
+
+@parsed_once
+def warm_up() -> bool:
+    """Get whether clamd connections are opened when CKAN starts.
+
+    Returns:
+        True if every endpoint is asked for its VERSION, and the connection
+            pool is filled, at startup, False otherwise.
+        Defaults to False via ckanext.clamav.warm_up config option.
+    """
+    return tk.asbool(tk.config.get(CLAMAV_CONF_WARM_UP, CLAMAV_CONF_WARM_UP_DF))
+
+
+def get_settings() -> Settings:
+    """Return the clamd connection settings built by `configure`.
+
+    Raises:
+        CkanConfigurationException: if the settings are invalid
+    """
+    global _settings
+
+    settings = _settings
+    if settings is None:
+        settings = _settings = load_settings()
+    return settings
+
+
+def configure() -> None:
+    """Parse and validate every option, so a misconfiguration fails the startup.
+
+    Raises:
+        CkanConfigurationException: if an option is invalid
+    """
+    global _settings
+
+    reset()
+    try:
+        _settings = load_settings()
+        for getter in _getters:
+            getter()
+    except ValueError as e:
+        reset()
+        raise CkanConfigurationException(f"Clamd: invalid configuration: {e}") from e
+    except CkanConfigurationException:
+        reset()
+        raise
+
+
+def reset() -> None:
+    """Forget the parsed options, so they are parsed again from the config."""
+    global _settings
+
+    _settings = None
+    _parsed.clear()
+
+
+def load_settings() -> Settings:
+    """Parse and validate the clamd connection settings.
+
+    Endpoints come from ckanext.clamav.endpoints. If it's not set, the single
+    endpoint configured with ckanext.clamav.socket_type is used.
+
+    Raises:
+        CkanConfigurationException: if the settings are invalid
+    """
+    urls = endpoints()
+    if urls:
+        parsed = tuple(
+            EndpointSettings(endpoint.family, endpoint.address, endpoint.weight)
+            for endpoint in map(parse_endpoint, urls)
+        )
+    else:
+        parsed = (EndpointSettings(*_get_socket_address(), 1),)
+
+    return Settings(
+        endpoints=parsed,
+        timeout=conn_timeout(),
+        connect_timeout=connect_timeout(),
+        idle_timeout=idle_timeout(),
+        upload_unscanned=upload_unscanned(),
+        asyncio_enabled=asyncio_enabled(),
+        pool_enabled=pool_enabled(),
+    )
+
+
+def _get_socket_address() -> tuple[int, Address]:
+    """Get the socket family and address of ClamAV from the config.
+
+    Raises:
+        CkanConfigurationException: if the TCP/IP connection mechanism has been
+        choosen, but the host:port are not provided
+    """
+    if socket_type() == SocketTypes.UNIX:
+        return (socket.AF_UNIX, socket_path())
+
+    host, port = tcp_host(), tcp_port()
+    if not port or not host:
+        raise CkanConfigurationException(
+            f"Clamd: please, provide TCP/IP host:port for ClamAV "
+            f"received host: '{host}', port: '{port}'",
+        )
+
+    return (socket.AF_INET, (host, port))
+
+
+def declare_config_options(declaration: Declaration, key: Key) -> None:
+    """Declare every ckanext.clamav option with its default value and type.
+
+    Boolean and integer options are validated by CKAN at startup.
+    """
+    declaration.annotate("ckanext-clamav")
+
+    for name, option in globals().items():
+        if not name.startswith("CLAMAV_CONF_") or name.endswith("_DF"):
+            continue
+
+        default = globals().get(f"{name}_DF")
+        if isinstance(default, bool):
+            declaration.declare_bool(key.from_string(option), default)
+        elif isinstance(default, int):
+            declaration.declare_int(key.from_string(option), default)
+        elif option in INT_OPTIONS:
+            declaration.declare(key.from_string(option), default).set_validators(
+                "ignore_empty int_validator",
+            )
+        else:
+            declaration.declare(key.from_string(option), default)
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import contextlib
+import threading
+import time
+from typing import Any, Optional
+
+from clamd import ConnectionError as ClamConnectionError
+
+from . import config as c
+
+# the throughput assumed before the first scan on an endpoint is observed
+INITIAL_THROUGHPUT: float = 8 * 1024 * 1024
+# weight of the latest observation in the moving average
+SMOOTHING: float = 0.2
+# the deadline allows the scan to be this many times slower than expected
+SAFETY_FACTOR: float = 4
+# scans of smaller files are dominated by latency and don't tell the throughput
+MIN_OBSERVED_SIZE: int = 1024 * 1024
+
+_model: Optional[ThroughputModel] = None
+_model_lock = threading.Lock()
+
+
+class ThroughputModel:
+    """Estimates the scan throughput of every clamd endpoint.
+
+    The estimate is an exponentially weighted moving average of the
+    throughput of recent scans, so it follows changes of the clamd load
+    within a few scans.
+
+    Args:
+        initial (float): the estimate before the first observation, in
+            bytes per second
+        smoothing (float): weight of the latest observation, from 0 to 1
+    """
+
+    def __init__(self, initial: float, smoothing: float):
+        self.initial = initial
+        self.smoothing = smoothing
+
+        self._estimates: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint: str, size: Optional[int], seconds: float) -> None:
+        """Update the estimate with a successful scan."""
+        if not size or size < MIN_OBSERVED_SIZE or seconds <= 0:
+            return
+
+        throughput = size / seconds
+        with self._lock:
+            previous = self._estimates.get(endpoint)
+            self._estimates[endpoint] = (
+                throughput
+                if previous is None
+                else previous + self.smoothing * (throughput - previous)
+            )
+
+    def estimate(self, endpoint: str) -> float:
+        """Get the expected throughput of the endpoint in bytes per second."""
+        with self._lock:
+            return self._estimates.get(endpoint, self.initial)
+
+
+class DeadlineStream:
+    """Wraps the stream sent to clamd and enforces the total deadline.
+
+    Before every chunk, and before the reply is awaited, the socket timeout
+    is lowered to the time left, but never above the idle timeout. Once the
+    scan is over, `restore` gives the connection its idle timeout back, as a
+    pooled connection outlives the scan.
+
+    Args:
+        stream (Any): the stream to send
+        conn (Any): the clamd connection, a timeout is set with its
+            `settimeout` method, if it has one
+        deadline (float): time.monotonic() value the scan must be over by
+        idle_timeout (float): the longest wait for a single socket operation
+    """
+
+    def __init__(self, stream: Any, conn: Any, deadline: float, idle_timeout: float):
+        self.stream = stream
+        self.conn = conn
+        self.deadline = deadline
+        self.idle_timeout = idle_timeout
+
+    def read(self, size: int = -1) -> bytes:
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise ClamConnectionError("The scan has not finished within its deadline")
+
+        settimeout = getattr(self.conn, "settimeout", None)
+        if settimeout is not None:
+            settimeout(min(self.idle_timeout, remaining))
+
+        return self.stream.read(size)
+
+    def restore(self) -> None:
+        """Set the socket timeout back to the idle timeout."""
+        settimeout = getattr(self.conn, "settimeout", None)
+        if settimeout is None:
+            return
+
+        # the connection may be closed already, e.g. after a clamd error
+        with contextlib.suppress(OSError, ClamConnectionError):
+            settimeout(self.idle_timeout)
+
+
+def get_model() -> ThroughputModel:
+    """Return the throughput model of the current process."""
+    global _model
+
+    with _model_lock:
+        if _model is None:
+            _model = ThroughputModel(INITIAL_THROUGHPUT, SMOOTHING)
+
+    return _model
+
+
+def get_total_timeout(endpoint: str, size: Optional[int]) -> float:
+    """Get the total deadline of a scan of the file on the endpoint.
+
+    Returns:
+        The time in seconds the file is expected to be scanned in, with a
+        safety margin, kept between ckanext.clamav.timeout.floor and
+        ckanext.clamav.timeout.ceiling. A file of unknown size gets the
+        ceiling.
+    """
+    floor, ceiling = c.timeout_floor(), c.timeout_ceiling()
+    if size is None:
+        return ceiling
+
+    expected = size / get_model().estimate(endpoint) * SAFETY_FACTOR
+    return min(ceiling, max(floor, expected))
@@ -0,0 +1,291 @@
+from __future__ import annotations
+
+import logging
+import os
+import time
+from datetime import timedelta
+from typing import Any, Optional
+
+from rq.scheduler import RQScheduler
+from werkzeug.datastructures import FileStorage
+
+import ckan.plugins.toolkit as tk
+from ckan.lib import jobs as bg_jobs
+
+from . import config as c
+from . import tracking, utils
+from .config import ClamAvStatus, ScanStatus
+from .model import ResourceScan
+
+log = logging.getLogger(__name__)
+
+SCHEDULER_INTERVAL: int = 1
+
+
+def enqueue_scan(resource: dict[str, Any]) -> None:
+    """Enqueue the background scan of a quarantined resource file.
+
+    Does nothing, unless the resource is waiting for a scan. It's safe to
+    enqueue the same resource more than once, as only one job can claim
+    the quarantined file.
+    """
+    quarantine_id: Optional[str] = resource.get("clamav_quarantine_id")
+
+    if resource.get("scan_status") != ScanStatus.PENDING or not quarantine_id:
+        return
+
+    tk.enqueue_job(
+        scan_quarantined_resource,
+        [resource["id"], quarantine_id],
+        title=f"ClamAV scan of resource {resource['id']}",
+        queue=c.async_queue(),
+    )
+
+
+def scan_quarantined_resource(
+    resource_id: str,
+    quarantine_id: str,
+    attempt: int = 0,
+) -> None:
+    """Scan the quarantined file and either promote or delete it.
+
+    A clean file is handed over to the real uploader through
+    `resource_update`. An infected file is deleted and the resource is
+    flagged with the infected scan status.
+
+    If clamd is not accessible or busy, or the job fails, the file is put
+    back into the quarantine and the retry is scheduled, up to
+    ckanext.clamav.async.max_retries times.
+
+    Args:
+        resource_id (str): the resource the file has been uploaded to
+        quarantine_id (str): the id of the file in the quarantine
+        attempt (int): the number of the earlier attempts
+    """
+    path = utils.get_quarantine_path(quarantine_id)
+    claimed_path = path + ".scanning"
+
+    try:
+        os.rename(path, claimed_path)
+    except FileNotFoundError:
+        log.info("Clamd: quarantined file %s is already processed", quarantine_id)
+        return
+
+    try:
+        processed = _process_quarantined_file(
+            resource_id,
+            claimed_path,
+            attempt >= c.async_max_retries(),
+        )
+    except tk.ObjectNotFound:
+        log.info("Clamd: resource %s doesn't exist anymore", resource_id)
+        os.remove(claimed_path)
+        return
+    except Exception:
+        # the resource is still pending, so the file must not be lost
+        os.rename(claimed_path, path)
+        _retry_scan(resource_id, quarantine_id, attempt)
+        raise
+
+    if processed:
+        os.remove(claimed_path)
+    else:
+        os.rename(claimed_path, path)
+        _retry_scan(resource_id, quarantine_id, attempt)
+
+
+def _retry_scan(resource_id: str, quarantine_id: str, attempt: int) -> None:
+    if attempt >= c.async_max_retries():
+        log.error(
+            "Clamd: the scan of resource %s has failed %s times, "
+            "the file is left in the quarantine as %s",
+            resource_id,
+            attempt + 1,
+            quarantine_id,
+        )
+        return
+
+    # clamd gets some time to recover, without holding the worker
+    delay = _get_retry_delay(attempt + 1)
+    log.info(
+        "Clamd: the scan of resource %s is retried in %s seconds",
+        resource_id,
+        delay,
+    )
+    bg_jobs.get_queue(c.async_queue()).enqueue_in(
+        timedelta(seconds=delay),
+        scan_quarantined_resource,
+        args=[resource_id, quarantine_id],
+        kwargs={"attempt": attempt + 1},
+        meta={"title": f"ClamAV scan of resource {resource_id}"},
+    )
+
+
+def _get_retry_delay(attempt: int) -> float:
+    return c.async_retry_delay() * 2 ** (attempt - 1)
+
+
+def enqueue_due_retries(burst: bool = False) -> None:
+    """Move the scheduled scan retries to the queue once they are due.
+
+    `ckan jobs worker` doesn't run the RQ scheduler, so the retries would
+    never be picked up without it. See `ckan clamav scheduler`.
+
+    Args:
+        burst (bool): whether to stop after the retries that are due now
+    """
+    queue = bg_jobs.get_queue(c.async_queue())
+    scheduler = RQScheduler([queue], connection=queue.connection)
+
+    try:
+        while True:
+            # only one scheduler moves the jobs of a queue at a time
+            if scheduler.acquire_locks():
+                scheduler.enqueue_scheduled_jobs()
+                scheduler.heartbeat()
+
+            if burst:
+                return
+            time.sleep(SCHEDULER_INTERVAL)
+    finally:
+        scheduler.release_locks()
+
+
+def _process_quarantined_file(resource_id: str, path: str, final: bool) -> bool:
+    """Scan the quarantined file and update the resource with the verdict.
+
+    Args:
+        final (bool): whether it's the last attempt to scan the file
+
+    Returns:
+        True if the resource is updated and the file can be deleted, False
+        if the file could not be scanned and the scan must be retried.
+    """
+    resource = tk.get_action("resource_show")(
+        _get_context(),
+        {"id": resource_id},
+    )
+
+    # resource_show turns the uploaded file name into the download URL
+    filename = resource["url"].rsplit("/", 1)[-1]
+
+    with open(path, "rb") as stream:
+        file = FileStorage(stream, filename)
+        report = utils.scan_with_report(file)
+        status, signature = report.status, report.signature
+
+        if status == ClamAvStatus.FOUND:
+            log.warning(
+                "Clamd: malware has been found. Resource: %s, signature: %s.",
+                resource_id,
+                signature,
+            )
+            # the file is deleted, so the upload is never recorded otherwise
+            if tracking.is_enabled():
+                tracking.record(resource_id, report)
+            _update_status(resource, ScanStatus.INFECTED, url="", url_type="")
+            return True
+
+        if status == ClamAvStatus.OK:
+            scan_status = ScanStatus.CLEAN
+        else:
+            log.warning("Clamd: unable to scan resource %s. %s", resource_id, signature)
+            transient = status in (ClamAvStatus.ERR_DISABLE, ClamAvStatus.ERR_BUSY)
+            if transient and not final:
+                return False
+
+            if not c.get_settings().upload_unscanned:
+                _update_status(resource, ScanStatus.ERROR, url="", url_type="")
+                return True
+
+            scan_status = ScanStatus.UNSCANNED
+
+        stream.seek(0)
+        utils.attach_verdict(file, (status, signature))
+        _update_status(resource, scan_status, upload=file)
+
+    log.info("Clamd: resource %s has been promoted from the quarantine", resource_id)
+    return True
+
+
+def rescan_stale_resources(budget: Optional[int] = None) -> dict[str, int]:
+    """Rescan the resources scanned with an older signature database.
+
+    The least recently scanned resources are rescanned first, until the
+    total size of the rescanned files reaches the budget, so every run
+    costs about the same. At least one file is rescanned, even if it's
+    larger than the budget. Meant to be run on schedule, e.g. daily, with
+    `ckan clamav rescan-stale`.
+
+    Args:
+        budget (Optional[int]): number of bytes to rescan. Defaults to
+            ckanext.clamav.tracking.rescan_budget
+
+    Returns:
+        The number of clean, infected and failed resources.
+    """
+    budget = c.tracking_rescan_budget() if budget is None else budget
+    counts = dict.fromkeys(("clean", "infected", "failed"), 0)
+
+    db_version = utils.get_signature_version()
+    if db_version is None:
+        log.error("Clamd: unable to get the signature version, skipping the rescan")
+        return counts
+
+    selected: list[tuple[str, str]] = []
+    total = 0
+    for scan, url in ResourceScan.stale(db_version).yield_per(100):
+        if selected and total + (scan.size or 0) > budget:
+            break
+        selected.append((scan.resource_id, url))
+        total += scan.size or 0
+
+    for resource_id, url in selected:
+        path = utils.get_stored_path(resource_id, url)
+        if not path:
+            counts["failed"] += 1
+            ResourceScan.touch(resource_id)
+            continue
+
+        report = utils.scan_stored_file(path, resource_id)
+        if report.status == ClamAvStatus.OK:
+            counts["clean"] += 1
+        elif report.status == ClamAvStatus.FOUND:
+            counts["infected"] += 1
+            log.warning(
+                "Clamd: malware has been found by the rescan. "
+                "Resource: %s, signature: %s.",
+                resource_id,
+                report.signature,
+            )
+        else:
+            counts["failed"] += 1
+            ResourceScan.touch(resource_id)
+            continue
+
+        tracking.record(resource_id, report)
+
+    log.info(
+        "Clamd: %s stale resources are rescanned with signatures v%s: %s",
+        len(selected),
+        db_version,
+        counts,
+    )
+    return counts
+
+
+def _update_status(resource: dict[str, Any], status: str, **changes: Any) -> None:
+    resource = dict(resource, scan_status=status, **changes)
+    resource.pop("clamav_quarantine_id", None)
+
+    tk.get_action("resource_update")(_get_context(), resource)
+
+
+def _get_context() -> dict[str, Any]:
+    site_user = tk.get_action("get_site_user")({"ignore_auth": True}, {})
+
+    return {
+        "ignore_auth": True,
+        "user": site_user["name"],
+        utils.SCAN_CONTEXT_KEY: True,
+    }
@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+from typing import Any, Optional
+
+from werkzeug.datastructures import FileStorage
+
+import ckan.model as model
+import ckan.plugins.toolkit as tk
+from ckan.types import Action, Context, DataDict
+
+from ckanext.clamav import pool, router, utils
+from ckanext.clamav.model import ScanResult
+
+SCAN_STATUS_LIST_LIMIT: int = 100
+SCAN_STATUS_LIST_MAX_LIMIT: int = 1000
+
+
+@tk.side_effect_free
+def clamav_pool_stats(context: Context, data_dict: DataDict) -> list[dict[str, Any]]:
+    """Return the stats of the clamd connection pools of the current process.
+
+    There is a pool per clamd endpoint. The stats include the pool size,
+    the number of idle and checked out sessions, and the hit rate of the
+    checkouts. An empty list is returned if no pool has been used yet.
+    """
+    tk.check_access("clamav_pool_stats", context, data_dict)
+
+    return pool.get_stats()
+
+
+@tk.side_effect_free
+def clamav_router_stats(
+    context: Context,
+    data_dict: DataDict,
+) -> list[dict[str, Any]]:
+    """Return the state of the clamd endpoints in the current process.
+
+    For every endpoint, its weight, health, number of outstanding scans and
+    consecutive errors are reported.
+    """
+    tk.check_access("clamav_router_stats", context, data_dict)
+
+    return router.get_stats() or []
+
+
+@tk.side_effect_free
+def clamav_scan_status(context: Context, data_dict: DataDict) -> dict[str, Any]:
+    """Return the latest scan result of the resource file.
+
+    Requires `ckanext.clamav.results.enabled`.
+
+    Args:
+        id (str): the resource id
+
+    Returns:
+        The status, signature, content hash, clamd engine and signature
+        database versions, duration in seconds, size in bytes and the time
+        of the scan.
+    """
+    resource_id = tk.get_or_bust(data_dict, "id")
+    tk.check_access("clamav_scan_status", context, data_dict)
+
+    result = ScanResult.latest(resource_id)
+    if not result:
+        raise tk.ObjectNotFound(f"No scan results for resource {resource_id}")
+
+    return result.dictize()
+
+
+@tk.side_effect_free
+def clamav_scan_status_list(
+    context: Context,
+    data_dict: DataDict,
+) -> dict[str, Any]:
+    """Return the latest scan results of many resources.
+
+    Requires `ckanext.clamav.results.enabled`.
+
+    Args:
+        ids (list[str], optional): the resource ids. Defaults to all resources
+        status (str, optional): only results with this status, e.g. `FOUND`
+        limit (int, optional): defaults to 100, at most 1000
+        offset (int, optional): defaults to 0
+
+    Returns:
+        The number of matching resources and the page of their results,
+        the most recent first.
+    """
+    tk.check_access("clamav_scan_status_list", context, data_dict)
+
+    ids = data_dict.get("ids")
+    limit = _get_int(data_dict, "limit", SCAN_STATUS_LIST_LIMIT)
+    offset = _get_int(data_dict, "offset", 0)
+
+    query = ScanResult.latest_for(
+        tk.aslist(ids) if ids is not None else None,
+        data_dict.get("status"),
+    )
+
+    return {
+        "count": query.count(),
+        "results": [
+            result.dictize()
+            for result in query.limit(
+                max(0, min(limit, SCAN_STATUS_LIST_MAX_LIMIT)),
+            ).offset(max(0, offset))
+        ],
+    }
+
+
+@tk.chained_action
+def package_create(
+    next_action: Action,
+    context: Context,
+    data_dict: DataDict,
+) -> Any:
+    """Scan the uploads of all the new dataset resources concurrently."""
+    _protect_scan_fields(context, data_dict, None)
+    _prescan_uploads("package_create", context, data_dict)
+
+    return next_action(context, data_dict)
+
+
+@tk.chained_action
+def package_update(
+    next_action: Action,
+    context: Context,
+    data_dict: DataDict,
+) -> Any:
+    """Scan the uploads of all the dataset resources concurrently.
+
+    `package_patch`, `package_revise`, `resource_create` and
+    `resource_update` go through it as well.
+    """
+    package = model.Package.get(data_dict.get("id") or data_dict.get("name"))
+    _protect_scan_fields(context, data_dict, package)
+    _prescan_uploads("package_update", context, data_dict)
+
+    return next_action(context, data_dict)
+
+
+def _protect_scan_fields(
+    context: Context,
+    data_dict: DataDict,
+    package: Optional[model.Package],
+) -> None:
+    if context.get(utils.SCAN_CONTEXT_KEY):
+        return
+
+    for resource in data_dict.get("resources") or []:
+        if not isinstance(resource, dict):
+            continue
+
+        stored = model.Resource.get(resource["id"]) if resource.get("id") else None
+        if stored is None or package is None or stored.package_id != package.id:
+            # a new resource, or a resource of another dataset
+            utils.protect_scan_fields(resource, None)
+        else:
+            utils.protect_scan_fields(resource, stored.extras)
+
+
+def _prescan_uploads(action: str, context: Context, data_dict: DataDict) -> None:
+    resources = [
+        resource
+        for resource in data_dict.get("resources") or []
+        if isinstance(resource, dict)
+    ]
+    uploads = [resource.get("upload") for resource in resources]
+    if sum(isinstance(upload, FileStorage) for upload in uploads) < 2:
+        # a single upload is scanned by the uploader
+        return
+
+    # the uploads are streamed to clamd before the action checks the access
+    tk.check_access(action, context, data_dict)
+    utils.prescan_uploads(resources)
+
+
+def _get_int(data_dict: DataDict, key: str, default: int) -> int:
+    try:
+        return tk.asint(data_dict.get(key, default))
+    except ValueError as e:
+        raise tk.ValidationError({key: ["Must be an integer"]}) from e
+
+
+def get_actions() -> dict[str, Any]:
+    return {
+        "clamav_pool_stats": clamav_pool_stats,
+        "clamav_router_stats": clamav_router_stats,
+        "clamav_scan_status": clamav_scan_status,
+        "clamav_scan_status_list": clamav_scan_status_list,
+        "package_create": package_create,
+        "package_update": package_update,
+    }
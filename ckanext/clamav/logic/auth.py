@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+from typing import Any
+
+import ckan.authz as authz
+import ckan.plugins.toolkit as tk
+from ckan.types import AuthResult, Context, DataDict
+
+
+def clamav_pool_stats(context: Context, data_dict: DataDict) -> AuthResult:
+    """Only sysadmins are allowed to see the pool stats."""
+    return {"success": False}
+
+
+def clamav_router_stats(context: Context, data_dict: DataDict) -> AuthResult:
+    """Only sysadmins are allowed to see the endpoint stats."""
+    return {"success": False}
+
+
+@tk.auth_allow_anonymous_access
+def clamav_scan_status(context: Context, data_dict: DataDict) -> AuthResult:
+    """Users allowed to see the resource can see its scan result."""
+    return authz.is_authorized("resource_show", context, data_dict)
+
+
+def clamav_scan_status_list(context: Context, data_dict: DataDict) -> AuthResult:
+    """Only sysadmins are allowed to list the scan results."""
+    return {"success": False}
+
+
+def get_auth_functions() -> dict[str, Any]:
+    return {
+        "clamav_pool_stats": clamav_pool_stats,
+        "clamav_router_stats": clamav_router_stats,
+        "clamav_scan_status": clamav_scan_status,
+        "clamav_scan_status_list": clamav_scan_status_list,
+    }
@@ -0,0 +1,472 @@
+from __future__ import annotations
+
+import bisect
+import contextlib
+import glob
+import importlib
+import json
+import logging
+import os
+import re
+import socket
+import threading
+import time
+from typing import Any, Iterator, Optional, Tuple
+
+from ckan.exceptions import CkanConfigurationException
+
+from . import config as c
+from .router import Address, format_address
+
+log = logging.getLogger(__name__)
+
+# evaluated at runtime, so it's spelled with typing for Python 3.8
+Labels = Tuple[Tuple[str, str], ...]
+
+CONNECT_SECONDS: str = "connect_seconds"
+STREAM_BYTES_PER_SECOND: str = "stream_bytes_per_second"
+SCAN_DURATION_SECONDS: str = "scan_duration_seconds"
+SCANS_TOTAL: str = "scans_total"
+CONNECTION_ERRORS_TOTAL: str = "connection_errors_total"
+SCANS_IN_FLIGHT: str = "scans_in_flight"
+ADMISSION_WAIT_SECONDS: str = "admission_wait_seconds"
+
+DESCRIPTIONS: dict[str, str] = {
+    CONNECT_SECONDS: "Time to open a connection to clamd.",
+    STREAM_BYTES_PER_SECOND: "Throughput of a single scan on clamd.",
+    SCAN_DURATION_SECONDS: "Total duration of a file scan, including retries.",
+    SCANS_TOTAL: "Number of file scans by outcome.",
+    CONNECTION_ERRORS_TOTAL: "Number of connection errors by clamd endpoint.",
+    SCANS_IN_FLIGHT: "Number of file scans in progress.",
+    ADMISSION_WAIT_SECONDS: "Time a scan waits in the admission queue.",
+}
+
+BUCKETS: dict[str, tuple[float, ...]] = {
+    CONNECT_SECONDS: (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5),
+    STREAM_BYTES_PER_SECOND: tuple(2.0**power for power in range(16, 34, 2)),
+    SCAN_DURATION_SECONDS: (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+    ADMISSION_WAIT_SECONDS: (0.001, 0.01, 0.1, 0.5, 1, 5, 10, 30, 60),
+}
+
+SIZE_BUCKETS: tuple[tuple[int, str], ...] = (
+    (1024 * 1024, "1MiB"),
+    (10 * 1024 * 1024, "10MiB"),
+    (100 * 1024 * 1024, "100MiB"),
+    (1024 * 1024 * 1024, "1GiB"),
+)
+
+_exporter: Optional[Exporter] = None
+_exporter_settings: Optional[tuple[Any, ...]] = None
+_exporter_lock = threading.Lock()
+
+
+class Exporter:
+    """Receives the scan metrics.
+
+    Custom exporters subclass it and are enabled with
+    ckanext.clamav.metrics.exporter.
+    """
+
+    enabled: bool = True
+
+    def increment(self, name: str, labels: Labels = (), value: float = 1) -> None:
+        """Add the value to a counter."""
+
+    def add(self, name: str, value: float, labels: Labels = ()) -> None:
+        """Add the value, positive or negative, to a gauge."""
+
+    def observe(self, name: str, value: float, labels: Labels = ()) -> None:
+        """Record a single observation of a histogram."""
+
+
+class NullExporter(Exporter):
+    """Drops the metrics, when they are disabled."""
+
+    enabled = False
+
+
+class PrometheusExporter(Exporter):
+    """Keeps the metrics in memory and renders them in the Prometheus text
+    format.
+
+    Every CKAN worker process has its own metrics. Without a `directory`, a
+    scrape gets the metrics of the process that served it. With one, every
+    process of the host writes its metrics into a file there on change, and
+    a scrape sums up the files of all the processes. Gauges of the processes
+    that are gone are skipped, their counters and histograms are kept.
+
+    Args:
+        directory (Optional[str]): directory shared by the worker processes
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._pid = os.getpid()
+        self._counters: dict[tuple[str, Labels], float] = {}
+        self._gauges: dict[tuple[str, Labels], float] = {}
+        self._histograms: dict[tuple[str, Labels], list[float]] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, labels: Labels = (), value: float = 1) -> None:
+        with self._lock:
+            self._check_pid()
+            key = (name, labels)
+            self._counters[key] = self._counters.get(key, 0) + value
+            self._write()
+
+    def add(self, name: str, value: float, labels: Labels = ()) -> None:
+        with self._lock:
+            self._check_pid()
+            key = (name, labels)
+            self._gauges[key] = self._gauges.get(key, 0) + value
+            self._write()
+
+    def observe(self, name: str, value: float, labels: Labels = ()) -> None:
+        buckets = BUCKETS[name]
+
+        with self._lock:
+            self._check_pid()
+            # counts of the buckets, including +Inf, followed by the sum
+            state = self._histograms.setdefault(
+                (name, labels),
+                [0.0] * (len(buckets) + 2),
+            )
+            state[bisect.bisect_left(buckets, value)] += 1
+            state[-1] += value
+            self._write()
+
+    def render(self) -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        if self.directory:
+            return _render(*self._collect())
+
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {key: list(state) for key, state in self._histograms.items()}
+
+        return _render(counters, gauges, histograms)
+
+    def _check_pid(self) -> None:
+        """Start from scratch in a worker forked after the exporter was made.
+
+        The metrics collected before the fork stay in the file of the parent.
+        """
+        pid = os.getpid()
+        if pid != self._pid:
+            self._pid = pid
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def _write(self) -> None:
+        """Replace the metrics file of the process, called with the lock held."""
+        if not self.directory:
+            return
+
+        state = {
+            "counters": _dump(self._counters),
+            "gauges": _dump(self._gauges),
+            "histograms": _dump(self._histograms),
+        }
+        path = os.path.join(self.directory, f"clamav-{self._pid}.json")
+        try:
+            # the temporary file is per process, and it's renamed atomically
+            with open(path + ".tmp", "w") as dest:
+                json.dump(state, dest)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            log.warning("Clamd: unable to write the metrics of the process. %s", e)
+
+    def _collect(
+        self,
+    ) -> tuple[
+        dict[tuple[str, Labels], float],
+        dict[tuple[str, Labels], float],
+        dict[tuple[str, Labels], list[float]],
+    ]:
+        """Sum up the metrics of all the processes from the shared directory."""
+        counters: dict[tuple[str, Labels], float] = {}
+        gauges: dict[tuple[str, Labels], float] = {}
+        histograms: dict[tuple[str, Labels], list[float]] = {}
+
+        for path in glob.glob(os.path.join(self.directory or "", "clamav-*.json")):
+            try:
+                pid = int(os.path.basename(path)[len("clamav-"):-len(".json")])
+                with open(path) as src:
+                    state = json.load(src)
+            except (OSError, ValueError) as e:
+                log.debug("Clamd: skipping the metrics file %s. %s", path, e)
+                continue
+
+            for key, value in _load(state["counters"]):
+                counters[key] = counters.get(key, 0) + value
+            if _is_alive(pid):
+                for key, value in _load(state["gauges"]):
+                    gauges[key] = gauges.get(key, 0) + value
+            for key, value in _load(state["histograms"]):
+                total = histograms.setdefault(key, [0.0] * len(value))
+                for index, count in enumerate(value):
+                    total[index] += count
+
+        return counters, gauges, histograms
+
+
+class StatsdExporter(Exporter):
+    """Sends the metrics to StatsD over UDP.
+
+    Label values become segments of the metric name, e.g.
+    `clamav.scans_total.FOUND`. Histograms are sent as timers, durations in
+    milliseconds. Sending never blocks and never fails the scan.
+
+    Args:
+        host (str): StatsD host
+        port (int): StatsD port
+        prefix (str): prefix of the metric names
+    """
+
+    def __init__(self, host: str, port: int, prefix: str):
+        self.address = (host, port)
+        self.prefix = prefix
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+
+    def increment(self, name: str, labels: Labels = (), value: float = 1) -> None:
+        self._send(name, labels, f"{value:g}|c")
+
+    def add(self, name: str, value: float, labels: Labels = ()) -> None:
+        self._send(name, labels, f"{value:+g}|g")
+
+    def observe(self, name: str, value: float, labels: Labels = ()) -> None:
+        if name.endswith("_seconds"):
+            name, value = name[: -len("_seconds")] + "_ms", value * 1000
+        self._send(name, labels, f"{value:g}|ms")
+
+    def _send(self, name: str, labels: Labels, value: str) -> None:
+        segments = [self.prefix, name] + [_sanitize(v) for _label, v in labels]
+        try:
+            self._socket.sendto(
+                f"{'.'.join(filter(None, segments))}:{value}".encode(),
+                self.address,
+            )
+        except OSError as e:
+            log.debug("Clamd: unable to send the metric to StatsD. %s", e)
+
+
+def get_exporter() -> Exporter:
+    """Return the metrics exporter of the current process.
+
+    The exporter is re-created if its settings have been changed since the
+    last call, which only happens in tests.
+    """
+    global _exporter, _exporter_settings
+
+    settings = (
+        c.metrics_exporter(),
+        c.statsd_host(),
+        c.statsd_port(),
+        c.statsd_prefix(),
+        c.prometheus_multiprocess_dir(),
+    )
+
+    with _exporter_lock:
+        if _exporter is None or _exporter_settings != settings:
+            _exporter = _make_exporter(*settings)
+            _exporter_settings = settings
+
+    return _exporter
+
+
+def observe_connect(endpoint: str, seconds: float) -> None:
+    exporter = get_exporter()
+    if exporter.enabled:
+        exporter.observe(CONNECT_SECONDS, seconds, (("endpoint", endpoint),))
+
+
+def observe_stream(endpoint: str, size: Optional[int], seconds: float) -> None:
+    """Record the throughput of a scan on the endpoint, if the size is known."""
+    exporter = get_exporter()
+    if exporter.enabled and size and seconds > 0:
+        exporter.observe(
+            STREAM_BYTES_PER_SECOND,
+            size / seconds,
+            (("endpoint", endpoint),),
+        )
+
+
+def observe_scan(status: str, size: Optional[int], seconds: float) -> None:
+    """Record the outcome and the duration of a file scan."""
+    exporter = get_exporter()
+    if not exporter.enabled:
+        return
+
+    exporter.increment(SCANS_TOTAL, (("status", status),))
+    exporter.observe(
+        SCAN_DURATION_SECONDS,
+        seconds,
+        (("size", get_size_bucket(size)),),
+    )
+
+
+def observe_admission_wait(seconds: float) -> None:
+    exporter = get_exporter()
+    if exporter.enabled:
+        exporter.observe(ADMISSION_WAIT_SECONDS, seconds)
+
+
+def count_connection_error(endpoint: str) -> None:
+    exporter = get_exporter()
+    if exporter.enabled:
+        exporter.increment(CONNECTION_ERRORS_TOTAL, (("endpoint", endpoint),))
+
+
+@contextlib.contextmanager
+def track_in_flight() -> Iterator[None]:
+    """Count the scan as in progress for the duration of the block."""
+    exporter = get_exporter()
+    if not exporter.enabled:
+        yield
+        return
+
+    exporter.add(SCANS_IN_FLIGHT, 1)
+    try:
+        yield
+    finally:
+        exporter.add(SCANS_IN_FLIGHT, -1)
+
+
+@contextlib.contextmanager
+def time_connect(family: int, address: Address) -> Iterator[None]:
+    """Record the duration of the block as the connect latency, on success."""
+    started_at = time.monotonic()
+    yield
+    observe_connect(format_address(family, address), time.monotonic() - started_at)
+
+
+def get_size_bucket(size: Optional[int]) -> str:
+    """Get the label of the file size range, e.g. `10MiB` for 1-10MiB."""
+    if size is None:
+        return "unknown"
+
+    for limit, label in SIZE_BUCKETS:
+        if size <= limit:
+            return label
+
+    return "inf"
+
+
+def _make_exporter(
+    name: Optional[str],
+    host: str,
+    port: int,
+    prefix: str,
+    multiprocess_dir: Optional[str],
+) -> Exporter:
+    if not name or name == "none":
+        return NullExporter()
+
+    if name == "prometheus":
+        return PrometheusExporter(multiprocess_dir)
+
+    if name == "statsd":
+        return StatsdExporter(host, port, prefix)
+
+    module_name, _sep, class_name = name.partition(":")
+    try:
+        return getattr(importlib.import_module(module_name), class_name)()
+    except (ImportError, AttributeError, ValueError) as e:
+        raise CkanConfigurationException(
+            f"Clamd: unable to load the metrics exporter {name}. {e}",
+        ) from e
+
+
+def _render(
+    counters: dict[tuple[str, Labels], float],
+    gauges: dict[tuple[str, Labels], float],
+    histograms: dict[tuple[str, Labels], list[float]],
+) -> str:
+    lines: list[str] = []
+    for kind, values in (("counter", counters), ("gauge", gauges)):
+        for name in sorted({name for name, _labels in values}):
+            lines.extend(_describe(name, kind))
+            for (metric, labels), value in sorted(values.items()):
+                if metric == name:
+                    lines.append(
+                        f"{_full_name(name)}{_render_labels(labels)} {value}",
+                    )
+
+    for name in sorted({name for name, _labels in histograms}):
+        lines.extend(_describe(name, "histogram"))
+        for (metric, labels), state in sorted(histograms.items()):
+            if metric == name:
+                lines.extend(_render_histogram(name, labels, state))
+
+    return "\n".join(lines) + "\n"
+
+
+def _dump(values: dict[tuple[str, Labels], Any]) -> list[Any]:
+    return [[name, labels, value] for (name, labels), value in values.items()]
+
+
+def _load(items: list[Any]) -> Iterator[tuple[tuple[str, Labels], Any]]:
+    for name, labels, value in items:
+        yield (name, tuple((label, v) for label, v in labels)), value
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _full_name(name: str) -> str:
+    return f"clamav_{name}"
+
+
+def _describe(name: str, kind: str) -> list[str]:
+    return [
+        f"# HELP {_full_name(name)} {DESCRIPTIONS.get(name, name)}",
+        f"# TYPE {_full_name(name)} {kind}",
+    ]
+
+
+def _render_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+
+    pairs = ",".join(
+        '{}="{}"'.format(
+            label,
+            value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for label, value in labels
+    )
+    return f"{{{pairs}}}"
+
+
+def _render_histogram(name: str, labels: Labels, state: list[float]) -> list[str]:
+    full_name = _full_name(name)
+    lines: list[str] = []
+
+    cumulative = 0.0
+    for bound, count in zip(BUCKETS[name] + (float("inf"),), state):
+        cumulative += count
+        le = "+Inf" if bound == float("inf") else f"{bound:.12g}"
+        bucket_labels = _render_labels(labels + (("le", le),))
+        lines.append(f"{full_name}_bucket{bucket_labels} {cumulative:g}")
+
+    lines.append(f"{full_name}_count{_render_labels(labels)} {cumulative:g}")
+    lines.append(f"{full_name}_sum{_render_labels(labels)} {state[-1]}")
+    return lines
+
+
+def _sanitize(value: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_-]+", "_", value).strip("_")
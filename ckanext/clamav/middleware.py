@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+from typing import IO, Any, Optional
+
+from . import utils
+
+# the API actions that may get a resource upload
+RESOURCE_ACTIONS: frozenset[str] = frozenset(
+    {
+        "resource_create",
+        "resource_update",
+        "resource_patch",
+        "package_create",
+        "package_update",
+        "package_patch",
+        "package_revise",
+    },
+)
+
+
+class ScanningRequestMixin:
+    """Streams the uploaded resource files to clamd while they are received.
+
+    werkzeug asks the request for a container of every file part, before
+    the part is received. For the resource forms and actions it gets a
+    `streaming.ScanningSpool` instead of the default one.
+    """
+
+    def _get_file_stream(
+        self,
+        total_content_length: Optional[int],
+        content_type: Optional[str],
+        filename: Optional[str] = None,
+        content_length: Optional[int] = None,
+    ) -> IO[bytes]:
+        if is_resource_upload(self):
+            container = utils.open_scanning_spool()
+            if container is not None:
+                return container  # type: ignore
+
+        return super()._get_file_stream(  # type: ignore
+            total_content_length,
+            content_type,
+            filename,
+            content_length,
+        )
+
+
+def install(app: Any) -> None:
+    """Make the Flask app use the request class that scans while receiving."""
+    if issubclass(app.request_class, ScanningRequestMixin):
+        return
+
+    app.request_class = type(
+        "ClamavRequest",
+        (ScanningRequestMixin, app.request_class),
+        {},
+    )
+
+
+def is_resource_upload(request: Any) -> bool:
+    """Check whether the request may carry a resource upload."""
+    endpoint = request.endpoint or ""
+    if endpoint == "api.action":
+        return (request.view_args or {}).get("logic_function") in RESOURCE_ACTIONS
+
+    # the resource blueprints are `resource` and `<package type>_resource`
+    blueprint, _, view = endpoint.rpartition(".")
+    return blueprint.endswith("resource") and view in ("new", "edit")
@@ -0,0 +1,40 @@
+"""create clamav_scan_result table
+
+Revision ID: 4f1c2d7e9a30
+Revises: b842605ec56a
+Create Date: 2026-10-18 14:03:52.118064
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "4f1c2d7e9a30"
+down_revision = "b842605ec56a"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "clamav_scan_result",
+        sa.Column("resource_id", sa.Text, primary_key=True),
+        sa.Column("content_hash", sa.Text, primary_key=True),
+        sa.Column("status", sa.Text, nullable=False),
+        sa.Column("signature", sa.Text),
+        sa.Column("engine_version", sa.Text),
+        sa.Column("db_version", sa.Integer),
+        sa.Column("duration", sa.Float),
+        sa.Column("size", sa.BigInteger),
+        sa.Column("scanned_at", sa.DateTime, nullable=False),
+    )
+    op.create_index(
+        "idx_clamav_scan_result_scanned_at",
+        "clamav_scan_result",
+        ["resource_id", "scanned_at"],
+    )
+
+
+def downgrade():
+    op.drop_index("idx_clamav_scan_result_scanned_at")
+    op.drop_table("clamav_scan_result")
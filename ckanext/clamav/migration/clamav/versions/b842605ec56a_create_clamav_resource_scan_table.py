@@ -0,0 +1,35 @@
+"""create clamav_resource_scan table
+
+Revision ID: b842605ec56a
+Revises:
+Create Date: 2026-10-18 10:12:31.402718
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "b842605ec56a"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "clamav_resource_scan",
+        sa.Column("resource_id", sa.Text, primary_key=True),
+        sa.Column("db_version", sa.Integer, nullable=False),
+        sa.Column("scanned_at", sa.DateTime, nullable=False),
+        sa.Column("size", sa.BigInteger),
+    )
+    op.create_index(
+        "idx_clamav_resource_scan_db_version",
+        "clamav_resource_scan",
+        ["db_version", "scanned_at"],
+    )
+
+
+def downgrade():
+    op.drop_index("idx_clamav_resource_scan_db_version")
+    op.drop_table("clamav_resource_scan")
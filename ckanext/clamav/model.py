@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Any, Iterable, Optional
+
+from sqlalchemy import BigInteger, Column, DateTime, Float, Index, Integer, Text
+from sqlalchemy.orm import Query, aliased
+
+import ckan.model as model
+import ckan.plugins.toolkit as tk
+
+
+class ResourceScan(tk.BaseModel):
+    """The signature database a resource file has been last scanned with.
+
+    Created with `ckan db upgrade -p clamav`.
+    """
+
+    __tablename__ = "clamav_resource_scan"
+    __table_args__ = (
+        Index("idx_clamav_resource_scan_db_version", "db_version", "scanned_at"),
+    )
+
+    resource_id = Column(Text, primary_key=True)
+    db_version = Column(Integer, nullable=False)
+    scanned_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    size = Column(BigInteger)
+
+    @classmethod
+    def get(cls, resource_id: str) -> Optional[ResourceScan]:
+        return model.Session.query(cls).get(resource_id)
+
+    @classmethod
+    def record(
+        cls,
+        resource_id: str,
+        db_version: int,
+        size: Optional[int],
+    ) -> None:
+        """Save the latest scan of the resource."""
+        model.Session.merge(
+            cls(
+                resource_id=resource_id,
+                db_version=db_version,
+                scanned_at=datetime.utcnow(),
+                size=size,
+            ),
+        )
+        model.Session.commit()
+
+    @classmethod
+    def touch(cls, resource_id: str) -> None:
+        """Move a resource that failed the rescan to the end of the queue."""
+        model.Session.query(cls).filter(cls.resource_id == resource_id).update(
+            {"scanned_at": datetime.utcnow()},
+        )
+        model.Session.commit()
+
+    @classmethod
+    def stale(cls, db_version: int) -> Query[Any]:
+        """Select the active uploads scanned with an older signature database.
+
+        The least recently scanned resources come first.
+
+        Returns:
+            A query of (ResourceScan, resource url) rows.
+        """
+        return (
+            model.Session.query(cls, model.Resource.url)
+            .join(model.Resource, model.Resource.id == cls.resource_id)
+            .filter(cls.db_version < db_version)
+            .filter(model.Resource.state == model.State.ACTIVE)
+            .filter(model.Resource.url_type == "upload")
+            .order_by(cls.db_version, cls.scanned_at)
+        )
+
+
+class ScanResult(tk.BaseModel):
+    """The result of a resource file scan.
+
+    There is a row per resource and file content, so a resource keeps the
+    history of its uploads, and a rescan of the same content replaces the
+    previous result. The content hash is empty if it's unknown.
+
+    Created with `ckan db upgrade -p clamav`.
+    """
+
+    __tablename__ = "clamav_scan_result"
+    __table_args__ = (
+        Index("idx_clamav_scan_result_scanned_at", "resource_id", "scanned_at"),
+    )
+
+    resource_id = Column(Text, primary_key=True)
+    content_hash = Column(Text, primary_key=True, default="")
+    status = Column(Text, nullable=False)
+    signature = Column(Text)
+    engine_version = Column(Text)
+    db_version = Column(Integer)
+    duration = Column(Float)
+    size = Column(BigInteger)
+    scanned_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    def dictize(self) -> dict[str, Any]:
+        return {
+            "resource_id": self.resource_id,
+            "content_hash": self.content_hash or None,
+            "status": self.status,
+            "signature": self.signature,
+            "engine_version": self.engine_version,
+            "db_version": self.db_version,
+            "duration": self.duration,
+            "size": self.size,
+            "scanned_at": self.scanned_at.isoformat(),
+        }
+
+    @classmethod
+    def record(cls, resource_id: str, **result: Any) -> None:
+        """Save the scan result of the resource file."""
+        result["content_hash"] = result.get("content_hash") or ""
+        model.Session.merge(
+            cls(resource_id=resource_id, scanned_at=datetime.utcnow(), **result),
+        )
+        model.Session.commit()
+
+    @classmethod
+    def latest(cls, resource_id: str) -> Optional[ScanResult]:
+        """Get the most recent scan result of the resource."""
+        return (
+            model.Session.query(cls)
+            .filter(cls.resource_id == resource_id)
+            .order_by(cls.scanned_at.desc())
+            .first()
+        )
+
+    @classmethod
+    def latest_for(
+        cls,
+        resource_ids: Optional[Iterable[str]] = None,
+        status: Optional[str] = None,
+    ) -> Query[ScanResult]:
+        """Select the most recent scan result of every resource.
+
+        Args:
+            resource_ids (Optional[Iterable[str]]): only these resources, or
+                all of them
+            status (Optional[str]): only the results with this status
+
+        Returns:
+            A query of results, the most recent first.
+        """
+        query = model.Session.query(cls)
+        if resource_ids is not None:
+            query = query.filter(cls.resource_id.in_(list(resource_ids)))
+
+        # DISTINCT ON keeps the first row of every resource, the latest one
+        latest = aliased(
+            cls,
+            query.distinct(cls.resource_id)
+            .order_by(cls.resource_id, cls.scanned_at.desc())
+            .subquery(),
+        )
+
+        query = model.Session.query(latest)
+        if status:
+            query = query.filter(latest.status == status)
+
+        return query.order_by(latest.scanned_at.desc(), latest.resource_id)
@@ -5,13 +5,26 @@ from typing import Any, Optional
 import ckan.plugins as p
 from ckan.plugins import toolkit
 from ckan.common import CKANConfig
+from ckan.config.declaration import Declaration, Key
 
-from . import utils
+from . import cli
+from . import config as c
+from . import jobs, middleware, tracking, utils, views
+from .logic import action, auth
 
 
 class ClamavPlugin(p.SingletonPlugin):
     p.implements(p.IConfigurer)
+    p.implements(p.IConfigurable)
+    p.implements(p.IConfigDeclaration)
+    p.implements(p.IMiddleware, inherit=True)
     p.implements(p.IUploader, inherit=True)
+    p.implements(p.IActions)
+    p.implements(p.IAuthFunctions)
+    p.implements(p.IResourceController, inherit=True)
+    p.implements(p.IPackageController, inherit=True)
+    p.implements(p.IClick)
+    p.implements(p.IBlueprint)
 
     # IConfigurer
 
@@ -20,13 +33,95 @@ class ClamavPlugin(p.SingletonPlugin):
         toolkit.add_public_directory(config, "public")
         toolkit.add_resource("fanstatic", "clamav")
 
+    # IConfigurable
+
+    def configure(self, config: "CKANConfig"):
+        # a misconfiguration fails the startup instead of the first upload
+        c.configure()
+
+        if c.warm_up():
+            utils.warm_up()
+
+    # IConfigDeclaration
+
+    def declare_config_options(self, declaration: Declaration, key: Key):
+        c.declare_config_options(declaration, key)
+
+    # IMiddleware
+
+    def make_middleware(self, app: Any, config: "CKANConfig"):
+        if c.receive_scan_enabled() and hasattr(app, "request_class"):
+            middleware.install(app)
+        if tracking.is_enabled() and hasattr(app, "teardown_request"):
+            app.teardown_request(tracking.forget_uploads)
+        return app
+
+    # IActions
+
+    def get_actions(self):
+        return action.get_actions()
+
+    # IAuthFunctions
+
+    def get_auth_functions(self):
+        return auth.get_auth_functions()
+
+    # IClick
+
+    def get_commands(self):
+        return cli.get_commands()
+
+    # IBlueprint
+
+    def get_blueprint(self):
+        return views.get_blueprints()
+
+    # IResourceController
+
+    def after_resource_create(self, context: Any, resource: dict[str, Any]):
+        if tracking.is_enabled():
+            tracking.record_upload(resource)
+        jobs.enqueue_scan(resource)
+
+    def after_resource_update(self, context: Any, resource: dict[str, Any]):
+        if tracking.is_enabled():
+            tracking.record_upload(resource)
+        jobs.enqueue_scan(resource)
+
+    # IPackageController
+
+    def after_dataset_create(self, context: Any, pkg_dict: dict[str, Any]):
+        if tracking.is_enabled():
+            tracking.record_package_uploads(pkg_dict)
+
+    def after_dataset_update(self, context: Any, pkg_dict: dict[str, Any]):
+        if tracking.is_enabled():
+            tracking.record_package_uploads(pkg_dict)
+
     # IUploader
 
     def get_resource_uploader(self, data_dict: dict[str, Any]):
-        if not data_dict.get("upload"):
+        upload = data_dict.get("upload")
+        if not upload:
+            if c.url_scan_enabled():
+                utils.scan_url_for_viruses(data_dict)
+            return
+
+        if c.chunked_enabled():
+            chunk = utils.get_upload_chunk(data_dict)
+            if chunk and not utils.scan_upload_chunk(upload, *chunk):
+                # a part of the file, it's kept in the spool, and the
+                # uploader gets the file once it's complete and scanned
+                data_dict.pop("upload")
+                return
+
+        if c.async_enabled() and not utils.get_attached_verdict(upload):
+            utils.quarantine_upload(data_dict)
             return
 
         utils.scan_file_for_viruses(data_dict)
+        if tracking.is_enabled():
+            tracking.remember_upload(upload)
 
     def get_uploader(self, upload_to: str, old_filename: Optional[str]):
         return
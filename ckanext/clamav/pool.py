@@ -0,0 +1,458 @@
+from __future__ import annotations
+
+import contextlib
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from typing import IO, Any, Iterator, Optional
+
+from clamd import BufferTooLongError, ConnectionError, ResponseError, scan_response
+
+from .adapters import instrument_connect, send_fd
+from .router import Address
+
+log = logging.getLogger(__name__)
+
+INSTREAM_CHUNK_SIZE: int = 64 * 1024
+INSTREAM_SIZE_LIMIT_REPLY: str = "INSTREAM size limit exceeded. ERROR"
+
+_pools: dict[tuple[int, Address], ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+class ClamdSession:
+    """A persistent clamd connection running in the IDSESSION mode.
+
+    Every command is sent as a null-terminated `z` command and clamd
+    prefixes each reply with the request id, e.g. `3: stream: OK`. The
+    connection stays open between commands until `END` is sent.
+
+    Args:
+        family (int): socket family, AF_UNIX or AF_INET
+        address (Address): unix socket path or (host, port) pair
+        timeout (float): socket timeout in seconds
+        connect_timeout (float): connection timeout in seconds, defaults to
+            the socket timeout
+    """
+
+    def __init__(
+        self,
+        family: int,
+        address: Address,
+        timeout: Optional[float],
+        connect_timeout: Optional[float] = None,
+    ):
+        self.family = family
+        self.address = address
+        self.timeout = timeout
+        self.connect_timeout = timeout if connect_timeout is None else connect_timeout
+        self.last_used: float = time.monotonic()
+
+        self._buffer = b""
+        self._socket: Optional[socket.socket] = None
+
+    def open(self) -> None:
+        """Connect to clamd and start the session."""
+        try:
+            self._socket = socket.socket(self.family, socket.SOCK_STREAM)
+            self._socket.settimeout(self.connect_timeout)
+            with instrument_connect(self.family, self.address):
+                self._socket.connect(self.address)
+            self._socket.settimeout(self.timeout)
+            self._socket.sendall(b"zIDSESSION\0")
+        except OSError as e:
+            self._drop()
+            raise ConnectionError(f"Error connecting to {self.address}. {e}.")
+
+    def close(self) -> None:
+        """End the session and close the connection."""
+        if self._socket is None:
+            return
+
+        with contextlib.suppress(OSError):
+            self._socket.sendall(b"zEND\0")
+        self._drop()
+
+    def settimeout(self, timeout: Optional[float]) -> None:
+        """Change the timeout of the open connection."""
+        self._get_socket().settimeout(timeout)
+
+    def ping(self) -> str:
+        return self._basic_command("PING")
+
+    def version(self) -> str:
+        return self._basic_command("VERSION")
+
+    def instream(self, buff: IO[bytes]) -> dict[str, tuple[str, Optional[str]]]:
+        """Scan a buffer, same as `clamd.ClamdNetworkSocket.instream`.
+
+        Raises:
+            BufferTooLongError: if the buffer size exceeds clamd limits
+            ConnectionError: in case of communication problem
+        """
+        sock = self._get_socket()
+
+        try:
+            sock.sendall(b"zINSTREAM\0")
+
+            chunk = buff.read(INSTREAM_CHUNK_SIZE)
+            while chunk:
+                sock.sendall(struct.pack("!L", len(chunk)) + chunk)
+                chunk = buff.read(INSTREAM_CHUNK_SIZE)
+
+            sock.sendall(struct.pack("!L", 0))
+        except OSError as e:
+            # clamd drops the connection as soon as StreamMaxLength is reached,
+            # the reason is waiting for us in the reply
+            reply = self._recv_reply_or_none()
+            if reply == INSTREAM_SIZE_LIMIT_REPLY:
+                raise BufferTooLongError(reply)
+            raise ConnectionError(f"Error while writing to socket: {e}")
+
+        reply = self._recv_reply()
+        if reply == INSTREAM_SIZE_LIMIT_REPLY:
+            raise BufferTooLongError(reply)
+
+        return _parse_scan_reply(reply)
+
+    def fildes(self, fd: int) -> dict[str, tuple[str, Optional[str]]]:
+        """Scan an open file by its descriptor, unix sockets only."""
+        sock = self._get_socket()
+
+        try:
+            sock.sendall(b"zFILDES\0")
+        except OSError as e:
+            raise ConnectionError(f"Error while writing to socket: {e}")
+
+        send_fd(sock, fd)
+        return _parse_scan_reply(self._recv_reply())
+
+    def scan(self, path: str) -> dict[str, tuple[str, Optional[str]]]:
+        """Scan a file by its path, which must be readable by clamd."""
+        sock = self._get_socket()
+
+        try:
+            sock.sendall(f"zSCAN {path}\0".encode())
+        except OSError as e:
+            raise ConnectionError(f"Error while writing to socket: {e}")
+
+        return _parse_scan_reply(self._recv_reply())
+
+    def _basic_command(self, command: str) -> str:
+        sock = self._get_socket()
+
+        try:
+            sock.sendall(f"z{command}\0".encode())
+        except OSError as e:
+            raise ConnectionError(f"Error while writing to socket: {e}")
+
+        reply = self._recv_reply()
+        if reply.endswith("ERROR"):
+            raise ResponseError(reply.rsplit("ERROR", 1)[0])
+        return reply
+
+    def _recv_reply(self) -> str:
+        """Read one null-terminated reply and strip the request id off."""
+        sock = self._get_socket()
+
+        try:
+            while b"\0" not in self._buffer:
+                data = sock.recv(4096)
+                if not data:
+                    raise ConnectionError("Connection closed by clamd")
+                self._buffer += data
+        except OSError as e:
+            raise ConnectionError(f"Error while reading from socket: {e}")
+
+        reply, self._buffer = self._buffer.split(b"\0", 1)
+        self.last_used = time.monotonic()
+
+        _request_id, _sep, message = reply.decode("utf-8").partition(": ")
+        return message.strip()
+
+    def _recv_reply_or_none(self) -> Optional[str]:
+        try:
+            return self._recv_reply()
+        except ConnectionError:
+            return None
+
+    def _get_socket(self) -> socket.socket:
+        if self._socket is None:
+            raise ConnectionError("The clamd session is not open")
+        return self._socket
+
+    def _drop(self) -> None:
+        if self._socket is not None:
+            with contextlib.suppress(OSError):
+                self._socket.close()
+        self._socket = None
+        self._buffer = b""
+
+
+def _parse_scan_reply(reply: str) -> dict[str, tuple[str, Optional[str]]]:
+    match = scan_response.match(reply)
+    if not match:
+        raise ResponseError(reply.rsplit("ERROR", 1)[0])
+
+    filename, reason, status = match.group("path", "virus", "status")
+    return {filename: (status, reason)}
+
+
+class ConnectionPool:
+    """A per-process pool of clamd sessions.
+
+    Sessions are checked out LIFO, so the warmest one is reused first, and
+    are pinged before they are handed out. Sessions idle for longer than
+    `idle_timeout` are closed, but the pool never shrinks below `min_size`.
+
+    Args:
+        family (int): socket family, AF_UNIX or AF_INET
+        address (Address): unix socket path or (host, port) pair
+        timeout (float): socket and checkout timeout in seconds
+        min_size (int): number of sessions kept open when idle
+        max_size (int): maximum number of open sessions
+        idle_timeout (float): number of seconds an idle session is kept open
+        connect_timeout (float): connection timeout in seconds, defaults to
+            the socket timeout
+    """
+
+    def __init__(
+        self,
+        family: int,
+        address: Address,
+        timeout: Optional[float],
+        min_size: int,
+        max_size: int,
+        idle_timeout: float,
+        connect_timeout: Optional[float] = None,
+    ):
+        self.family = family
+        self.address = address
+        self.timeout = timeout
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.pid = os.getpid()
+
+        self.hits = 0
+        self.misses = 0
+
+        self._size = 0
+        self._idle: deque[ClamdSession] = deque()
+        self._cond = threading.Condition()
+
+    @contextlib.contextmanager
+    def session(self) -> Iterator[ClamdSession]:
+        """Check out a session and return it to the pool afterwards.
+
+        A session is discarded instead of being returned, if the block
+        raised an exception, as the connection state is unknown then.
+        """
+        session = self._checkout()
+        try:
+            yield session
+        except BaseException:
+            self._discard(session)
+            raise
+        self._checkin(session)
+
+    def prefill(self) -> None:
+        """Open sessions until there are at least `min_size` of them."""
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+
+            session = self._new_session()
+            self._checkin(session)
+
+    def close(self) -> None:
+        """Close all the idle sessions."""
+        with self._cond:
+            sessions = list(self._idle)
+            self._idle.clear()
+            self._size -= len(sessions)
+
+        for session in sessions:
+            session.close()
+
+    def stats(self) -> dict[str, Any]:
+        with self._cond:
+            requests = self.hits + self.misses
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+            }
+
+    def _checkout(self) -> ClamdSession:
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+
+        while True:
+            session = self._acquire(deadline)
+
+            if session is None:
+                session = self._new_session()
+                with self._cond:
+                    self.misses += 1
+                return session
+
+            try:
+                session.ping()
+            except (ConnectionError, ResponseError):
+                log.debug("Clamd: dropping a broken pooled session")
+                self._discard(session)
+                continue
+
+            with self._cond:
+                self.hits += 1
+            return session
+
+    def _acquire(self, deadline: Optional[float]) -> Optional[ClamdSession]:
+        """Take an idle session or reserve a slot for a new one.
+
+        Returns:
+            An idle session, or None if a slot for a new session has been
+            reserved.
+        """
+        with self._cond:
+            expired = self._pop_expired()
+
+            while not self._idle and self._size >= self.max_size:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise ConnectionError("Timed out waiting for a pooled clamd session")
+                self._cond.wait(remaining)
+
+            session = self._idle.pop() if self._idle else None
+            if session is None:
+                self._size += 1
+
+        for old in expired:
+            old.close()
+
+        return session
+
+    def _pop_expired(self) -> list[ClamdSession]:
+        """Remove the sessions idle for too long. Must be called under lock."""
+        expired = []
+        threshold = time.monotonic() - self.idle_timeout
+
+        # the oldest sessions are at the left end of the deque
+        while (
+            self._idle
+            and self._size - len(expired) > self.min_size
+            and self._idle[0].last_used < threshold
+        ):
+            expired.append(self._idle.popleft())
+
+        self._size -= len(expired)
+        return expired
+
+    def _new_session(self) -> ClamdSession:
+        session = ClamdSession(
+            self.family,
+            self.address,
+            self.timeout,
+            self.connect_timeout,
+        )
+        try:
+            session.open()
+        except ConnectionError:
+            self._release_slot()
+            raise
+        return session
+
+    def _checkin(self, session: ClamdSession) -> None:
+        # a scan with a deadline lowers the timeout of the connection
+        try:
+            session.settimeout(session.timeout)
+        except (OSError, ConnectionError):
+            self._discard(session)
+            return
+
+        with self._cond:
+            session.last_used = time.monotonic()
+            self._idle.append(session)
+            self._cond.notify()
+
+    def _discard(self, session: ClamdSession) -> None:
+        session._drop()
+        self._release_slot()
+
+    def _release_slot(self) -> None:
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+
+def get_pool(
+    family: int,
+    address: Address,
+    timeout: Optional[float],
+    min_size: int,
+    max_size: int,
+    idle_timeout: float,
+    connect_timeout: Optional[float] = None,
+) -> ConnectionPool:
+    """Return the pool of the given clamd address in the current process.
+
+    Every clamd endpoint has a pool of its own. The pools are re-created
+    after a fork, as sockets must not be shared between processes, and when
+    the settings have been changed.
+    """
+    settings = (
+        family,
+        address,
+        timeout,
+        min_size,
+        max_size,
+        idle_timeout,
+        connect_timeout,
+    )
+    key = (family, address)
+
+    with _pools_lock:
+        existing = _pools.get(key)
+        if existing is not None and (
+            existing.pid != os.getpid() or _get_settings(existing) != settings
+        ):
+            if existing.pid == os.getpid():
+                existing.close()
+            existing = None
+
+        if existing is None:
+            existing = _pools[key] = ConnectionPool(*settings)
+
+    return existing
+
+
+def get_stats() -> list[dict[str, Any]]:
+    """Return the stats of the pools of the current process."""
+    with _pools_lock:
+        pools = [p for p in _pools.values() if p.pid == os.getpid()]
+
+    return [dict(p.stats(), address=p.address) for p in pools]
+
+
+def _get_settings(pool: ConnectionPool) -> tuple[Any, ...]:
+    return (
+        pool.family,
+        pool.address,
+        pool.timeout,
+        pool.min_size,
+        pool.max_size,
+        pool.idle_timeout,
+        pool.connect_timeout,
+    )
@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+import functools
+import http.client
+import ipaddress
+import socket
+import time
+import urllib.request
+from typing import Any, Optional
+from urllib.parse import urlparse
+
+REMOTE_CHUNK_SIZE: int = 64 * 1024
+USER_AGENT: str = "ckanext-clamav"
+SCHEMES: tuple[str, ...] = ("http", "https")
+
+
+class RemoteError(Exception):
+    """The remote content can't be downloaded."""
+
+
+class RemoteStream:
+    """File-like view of a remote response, with size and time caps.
+
+    The content is read in blocks of REMOTE_CHUNK_SIZE, so only a block is
+    kept in memory. Once a cap is reached, or the download fails, the stream
+    just ends, so clamd still gets a complete INSTREAM, and the reason is
+    left in the `truncated`, `timed_out` or `error` attributes.
+
+    Args:
+        response (Any): the response, anything with `read(size)`
+        max_size (int): the maximum number of bytes to read
+        deadline (float): time.monotonic() value to stop reading at
+    """
+
+    def __init__(self, response: Any, max_size: int, deadline: float):
+        self.response = response
+        self.max_size = max_size
+        self.deadline = deadline
+
+        self.size = 0
+        self.truncated = False
+        self.timed_out = False
+        self.error: Optional[Exception] = None
+
+        self._block = b""
+        self._offset = 0
+        self._done = False
+
+    @property
+    def complete(self) -> bool:
+        return not (self.truncated or self.timed_out or self.error)
+
+    def read(self, size: int = -1) -> bytes:
+        if self._offset >= len(self._block) and not self._fill():
+            return b""
+
+        end = len(self._block) if size < 0 else self._offset + size
+        data = self._block[self._offset:end]
+        self._offset += len(data)
+        return data
+
+    def _fill(self) -> bool:
+        if self._done:
+            return False
+
+        if time.monotonic() > self.deadline:
+            self.timed_out = True
+            return self._finish()
+
+        try:
+            block = self.response.read(REMOTE_CHUNK_SIZE)
+        except (OSError, http.client.HTTPException) as e:
+            self.error = e
+            return self._finish()
+
+        if not block:
+            return self._finish()
+
+        if self.size + len(block) > self.max_size:
+            self.truncated = True
+            block = block[: self.max_size - self.size]
+            self._done = True
+
+        self.size += len(block)
+        self._block, self._offset = block, 0
+        return bool(block)
+
+    def _finish(self) -> bool:
+        self._done = True
+        return False
+
+
+class _PinnedConnectionMixin:
+    """Connects to the checked address instead of resolving the host again.
+
+    The host is still sent in the Host header and, over TLS, as the SNI and
+    the name the certificate is verified against, so it can't be re-bound
+    to another address between the check and the connection.
+    """
+
+    def __init__(self, *args: Any, address: Optional[str], **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.address = address
+        if address is not None:
+            self._create_connection = self._connect_address
+
+    def _connect_address(self, address: tuple[str, int], *args: Any) -> socket.socket:
+        return socket.create_connection((self.address, address[1]), *args)
+
+
+class _PinnedHTTPConnection(_PinnedConnectionMixin, http.client.HTTPConnection):
+    pass
+
+
+class _PinnedHTTPSConnection(_PinnedConnectionMixin, http.client.HTTPSConnection):
+    pass
+
+
+class _CheckedHTTPHandler(urllib.request.HTTPHandler):
+    def __init__(self, allow_private: bool):
+        super().__init__()
+        self.allow_private = allow_private
+
+    def http_open(self, req):
+        return self.do_open(
+            _get_connection_class(req, _PinnedHTTPConnection, self.allow_private),
+            req,
+        )
+
+
+class _CheckedHTTPSHandler(urllib.request.HTTPSHandler):
+    def __init__(self, allow_private: bool):
+        super().__init__()
+        self.allow_private = allow_private
+
+    def https_open(self, req):
+        return self.do_open(
+            _get_connection_class(req, _PinnedHTTPSConnection, self.allow_private),
+            req,
+            context=self._context,
+        )
+
+
+class _CheckedRedirectHandler(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        # the target address is checked once it's connected to
+        if urlparse(newurl).scheme not in SCHEMES:
+            raise RemoteError(f"Unsupported URL {newurl}")
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+def is_remote_url(url: Any) -> bool:
+    return isinstance(url, str) and urlparse(url).scheme in SCHEMES
+
+
+def check_url(url: str, allow_private: bool) -> str:
+    """Make sure the URL can be downloaded.
+
+    Unless allowed, hosts resolving to private, loopback or otherwise
+    non-global addresses are refused, so the portal can't be used to probe
+    the internal network.
+
+    Returns:
+        The checked address of the host, the one to connect to.
+
+    Raises:
+        RemoteError: if the URL is not allowed
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in SCHEMES or not parsed.hostname:
+        raise RemoteError(f"Unsupported URL {url}")
+
+    try:
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        addresses = [
+            info[4][0]
+            for info in socket.getaddrinfo(parsed.hostname, port, type=socket.SOCK_STREAM)
+        ]
+    except (OSError, ValueError) as e:
+        raise RemoteError(f"Unable to resolve {parsed.hostname}. {e}") from e
+
+    if not addresses:
+        raise RemoteError(f"Unable to resolve {parsed.hostname}")
+
+    if not allow_private:
+        for address in addresses:
+            if not ipaddress.ip_address(address.split("%", 1)[0]).is_global:
+                raise RemoteError(f"{parsed.hostname} is not a public host")
+
+    return addresses[0]
+
+
+def open_url(url: str, timeout: float, allow_private: bool = False) -> Any:
+    """Send a GET request and return the response, without reading its body.
+
+    Redirects are followed. The host of every request, the first one and
+    each redirect, is checked with `check_url` and connected to by the
+    checked address.
+
+    Raises:
+        RemoteError: if the URL is not allowed or the request fails
+    """
+    if not is_remote_url(url):
+        raise RemoteError(f"Unsupported URL {url}")
+
+    opener = urllib.request.build_opener(
+        _CheckedHTTPHandler(allow_private),
+        _CheckedHTTPSHandler(allow_private),
+        _CheckedRedirectHandler(),
+    )
+    request = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
+
+    try:
+        return opener.open(request, timeout=timeout)
+    except (OSError, ValueError, http.client.HTTPException) as e:
+        # urllib.error.URLError and HTTPError are OSError subclasses
+        raise RemoteError(str(e)) from e
+
+
+def _get_connection_class(req: Any, connection_class: type, allow_private: bool) -> Any:
+    """Check the host of the request and pin the connection to its address.
+
+    A request sent through a proxy is only checked, the proxy resolves the
+    host itself.
+    """
+    address: Optional[str] = check_url(req.full_url, allow_private)
+    if req.has_proxy() or getattr(req, "_tunnel_host", None):
+        address = None
+
+    return functools.partial(connection_class, address=address)
@@ -0,0 +1,266 @@
+from __future__ import annotations
+
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+from typing import IO, Iterable, Iterator, Optional
+
+from . import config as c
+from .config import ClamAvStatus
+
+log = logging.getLogger(__name__)
+
+MAGIC: bytes = b"CLAMAVHL"
+FORMAT_VERSION: int = 1
+# magic, format version, number of filter hashes, filter size in bits and
+# number of digests
+HEADER: struct.Struct = struct.Struct("<8sIIQQ")
+DIGEST_SIZE: int = 32
+ERROR_RATE: float = 0.001
+DENYLIST_SIGNATURE: str = "Reputation.Denylist.SHA256"
+
+_lists: dict[str, HashList] = {}
+_lists_lock = threading.Lock()
+
+
+class HashListError(Exception):
+    """The file is not a valid hash list."""
+
+
+class HashList:
+    """Memory-mapped set of SHA-256 digests.
+
+    The file holds a Bloom filter over the digests, followed by the sorted
+    digests. A lookup checks the filter first, so most unknown files are
+    rejected by reading a few bits, and confirms a filter hit with a binary
+    search over the digests, so there are no false positives. Only the
+    pages being read are loaded, and they are shared by all the processes
+    mapping the file.
+
+    Args:
+        path (str): a file built with `build`
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        with open(path, "rb") as f:
+            self.stat = os.fstat(f.fileno())
+            if self.stat.st_size < HEADER.size:
+                raise HashListError(f"{path} is not a hash list")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.hash_count, self.bit_count, self.size = (
+            HEADER.unpack_from(self._map)
+        )
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise HashListError(f"{path} is not a hash list")
+
+        self._digests_offset = HEADER.size + _get_filter_size(self.bit_count)
+        if len(self._map) != self._digests_offset + self.size * DIGEST_SIZE:
+            raise HashListError(f"{path} is truncated")
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, digest: bytes) -> bool:
+        return self.might_contain(digest) and self._search(digest)
+
+    def might_contain(self, digest: bytes) -> bool:
+        """Check the digest against the Bloom filter only."""
+        for position in _get_positions(digest, self.hash_count, self.bit_count):
+            if not self._map[HEADER.size + (position >> 3)] & (1 << (position & 7)):
+                return False
+        return True
+
+    def is_current(self) -> bool:
+        """Check that the file hasn't been rebuilt since it was mapped.
+
+        Raises:
+            OSError: if the file has been removed
+        """
+        stat = os.stat(self.path)
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size) == (
+            self.stat.st_ino,
+            self.stat.st_mtime_ns,
+            self.stat.st_size,
+        )
+
+    def _search(self, digest: bytes) -> bool:
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            offset = self._digests_offset + middle * DIGEST_SIZE
+            current = self._map[offset:offset + DIGEST_SIZE]
+            if current == digest:
+                return True
+            if current < digest:
+                low = middle + 1
+            else:
+                high = middle
+        return False
+
+
+def is_enabled() -> bool:
+    return bool(c.reputation_denylist() or c.reputation_allowlist())
+
+
+def check(content_hash: str) -> Optional[tuple[str, Optional[str]]]:
+    """Look the SHA-256 of a file up in the denylist and the allowlist.
+
+    Returns:
+        FOUND for a denylisted file, OK for an allowlisted one, or None if
+        the file is in neither list and must be scanned by clamd. The
+        denylist wins if the file is in both lists.
+    """
+    digest = bytes.fromhex(content_hash)
+    lists = (
+        (c.reputation_denylist(), (ClamAvStatus.FOUND, DENYLIST_SIGNATURE)),
+        (c.reputation_allowlist(), (ClamAvStatus.OK, None)),
+    )
+
+    for path, verdict in lists:
+        if not path:
+            continue
+
+        hash_list = get_hash_list(path)
+        if hash_list is not None and digest in hash_list:
+            return verdict
+
+    return None
+
+
+def get_hash_list(path: str) -> Optional[HashList]:
+    """Return the mapped hash list, re-mapped once the file is rebuilt.
+
+    Returns:
+        The hash list, or None if it can't be loaded. Files are scanned by
+        clamd then.
+    """
+    with _lists_lock:
+        hash_list = _lists.get(path)
+        try:
+            if hash_list is None or not hash_list.is_current():
+                hash_list = _lists[path] = HashList(path)
+        except (OSError, ValueError, HashListError) as e:
+            _lists.pop(path, None)
+            log.error("Clamd: unable to load the hash list %s. %s", path, e)
+            return None
+
+    return hash_list
+
+
+def read_feed(feed: IO[str]) -> Iterator[bytes]:
+    """Read the SHA-256 digests from a feed.
+
+    A feed has a hex digest per line, optionally followed by other fields
+    separated by whitespace or a colon, as in the `sha256sum` output or the
+    ClamAV `.hsb` signatures. Empty lines, comments and other hashes are
+    skipped.
+    """
+    for line in feed:
+        field = re.split(r"[\s:]", line.strip(), maxsplit=1)[0]
+        if len(field) != DIGEST_SIZE * 2:
+            continue
+
+        try:
+            yield bytes.fromhex(field)
+        except ValueError:
+            continue
+
+
+def build(
+    output: str,
+    digests: Iterable[bytes],
+    error_rate: float = ERROR_RATE,
+) -> int:
+    """Build a hash list file from the SHA-256 digests.
+
+    The digests are partitioned into temporary files by their first byte,
+    so only 1/256 of them is sorted in memory at a time. The list is moved
+    in place once it's complete, and the processes using the previous list
+    never read a partial file.
+
+    Args:
+        output (str): path of the hash list
+        digests (Iterable[bytes]): the digests, duplicates are dropped
+        error_rate (float): the false positive rate of the Bloom filter
+
+    Returns:
+        The number of unique digests in the list.
+    """
+    directory = os.path.dirname(os.path.abspath(output))
+
+    with tempfile.TemporaryDirectory(dir=directory) as tmp_dir:
+        buckets = [
+            open(os.path.join(tmp_dir, f"{number:02x}"), "w+b")  # noqa: SIM115
+            for number in range(256)
+        ]
+        try:
+            total = 0
+            for digest in digests:
+                buckets[digest[0]].write(digest)
+                total += 1
+
+            bit_count = _get_bit_count(total, error_rate)
+            hash_count = _get_hash_count(total, bit_count)
+            bits = bytearray(_get_filter_size(bit_count))
+
+            tmp_output = os.path.join(tmp_dir, "output")
+            size = 0
+            with open(tmp_output, "wb") as f:
+                f.seek(HEADER.size + len(bits))
+                for bucket in buckets:
+                    bucket.seek(0)
+                    data = bucket.read()
+                    unique = sorted(
+                        {
+                            data[offset:offset + DIGEST_SIZE]
+                            for offset in range(0, len(data), DIGEST_SIZE)
+                        },
+                    )
+
+                    for digest in unique:
+                        for position in _get_positions(digest, hash_count, bit_count):
+                            bits[position >> 3] |= 1 << (position & 7)
+
+                    f.write(b"".join(unique))
+                    size += len(unique)
+
+                f.seek(0)
+                f.write(HEADER.pack(MAGIC, FORMAT_VERSION, hash_count, bit_count, size))
+                f.write(bits)
+        finally:
+            for bucket in buckets:
+                bucket.close()
+
+        os.replace(tmp_output, output)
+
+    return size
+
+
+def _get_bit_count(count: int, error_rate: float) -> int:
+    bit_count = math.ceil(-count * math.log(error_rate) / math.log(2) ** 2)
+    return max(64, bit_count)
+
+
+def _get_hash_count(count: int, bit_count: int) -> int:
+    return max(1, round(bit_count / max(count, 1) * math.log(2)))
+
+
+def _get_filter_size(bit_count: int) -> int:
+    return (bit_count + 7) // 8
+
+
+def _get_positions(digest: bytes, hash_count: int, bit_count: int) -> Iterator[int]:
+    # the digest is uniformly distributed already, so its parts are used as
+    # the two hashes of the double hashing instead of hashing it again
+    first = int.from_bytes(digest[:8], "little")
+    second = int.from_bytes(digest[8:16], "little") | 1
+    for number in range(hash_count):
+        yield (first + number * second) % bit_count
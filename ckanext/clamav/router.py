@@ -0,0 +1,353 @@
+from __future__ import annotations
+
+import contextlib
+import logging
+import os
+import socket
+import threading
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple, Union
+from urllib.parse import parse_qs, urlparse
+
+from ckan.exceptions import CkanConfigurationException
+
+from .breaker import CircuitBreaker
+
+log = logging.getLogger(__name__)
+
+Address = Union[str, Tuple[str, int]]
+
+
+class RoutingStrategies:
+    LEAST_OUTSTANDING = "least_outstanding"
+    ROUND_ROBIN = "round_robin"
+
+
+_router: Optional[Router] = None
+_router_lock = threading.Lock()
+
+
+def format_address(family: int, address: Address) -> str:
+    """Get the URL of a clamd address, e.g. `tcp://clamd:3310`."""
+    if family == socket.AF_UNIX:
+        return f"unix://{address}"
+
+    host, port = address
+    return f"tcp://{host}:{port}"
+
+
+class Endpoint:
+    """A single clamd daemon, reachable via unix or TCP socket.
+
+    Args:
+        family (int): socket family, AF_UNIX or AF_INET
+        address (Address): unix socket path or (host, port) pair
+        weight (int): relative share of the scans routed to the endpoint
+    """
+
+    def __init__(self, family: int, address: Address, weight: int = 1):
+        self.family = family
+        self.address = address
+        self.weight = weight
+
+        self.outstanding = 0
+        self.failures = 0
+        self.healthy = True
+        self.current_weight = 0
+        self.breaker: Optional[CircuitBreaker] = None
+
+    @property
+    def name(self) -> str:
+        return format_address(self.family, self.address)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "endpoint": self.name,
+            "weight": self.weight,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "failures": self.failures,
+            "circuit": self.breaker.state if self.breaker else None,
+        }
+
+    def __repr__(self) -> str:
+        return f"<Endpoint {self.name}>"
+
+
+def parse_endpoint(value: str) -> Endpoint:
+    """Parse an endpoint URL.
+
+    Supported forms are `unix:///path/to/clamd.ctl` and `tcp://host:port`.
+    An optional `weight` query parameter sets the endpoint weight, e.g.
+    `tcp://clamd-2:3310?weight=2`.
+
+    Raises:
+        CkanConfigurationException: if the URL can't be parsed
+    """
+    url = urlparse(value)
+
+    try:
+        weight = int(parse_qs(url.query).get("weight", ["1"])[0])
+    except ValueError:
+        raise CkanConfigurationException(f"Clamd: invalid endpoint weight: {value}")
+
+    if url.scheme == "unix" and url.path:
+        return Endpoint(socket.AF_UNIX, url.path, weight)
+
+    if url.scheme == "tcp" and url.hostname and url.port:
+        return Endpoint(socket.AF_INET, (url.hostname, url.port), weight)
+
+    raise CkanConfigurationException(f"Clamd: unsupported endpoint: {value}")
+
+
+class Router:
+    """Distributes scans between clamd endpoints.
+
+    Endpoints are chosen either by the smallest number of outstanding scans
+    relative to their weight, or by smooth weighted round robin. An endpoint
+    is taken out of the rotation after `max_failures` consecutive connection
+    errors and is put back once it replies to the background PING.
+
+    A single endpoint is always used as is, without the health tracking.
+
+    With `breaker_threshold` set, every endpoint also gets a circuit
+    breaker. Unlike the health tracking, an open circuit is never tried
+    until its reset timeout is over, so scans fail immediately when all the
+    daemons are down.
+
+    Args:
+        endpoints (list[Endpoint]): clamd endpoints
+        strategy (str): one of RoutingStrategies
+        max_failures (int): consecutive errors before an endpoint is ejected
+        ping_interval (float): seconds between the background PINGs
+        probe (Callable): checks an endpoint, raises on failure
+        breaker_threshold (Optional[int]): consecutive errors before the
+            circuit of an endpoint opens, None disables the breakers
+        breaker_reset_timeout (float): seconds before an open circuit lets
+            a trial scan through
+    """
+
+    def __init__(
+        self,
+        endpoints: list[Endpoint],
+        strategy: str,
+        max_failures: int,
+        ping_interval: float,
+        probe: Callable[[Endpoint], Any],
+        breaker_threshold: Optional[int] = None,
+        breaker_reset_timeout: float = 30,
+    ):
+        if strategy not in (
+            RoutingStrategies.LEAST_OUTSTANDING,
+            RoutingStrategies.ROUND_ROBIN,
+        ):
+            raise CkanConfigurationException(
+                f"Clamd: unsupported routing strategy: {strategy}",
+            )
+
+        self.endpoints = endpoints
+        self.strategy = strategy
+        self.max_failures = max_failures
+        self.ping_interval = ping_interval
+        self.probe = probe
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset_timeout = breaker_reset_timeout
+        self.pid = os.getpid()
+
+        if breaker_threshold:
+            for endpoint in endpoints:
+                endpoint.breaker = CircuitBreaker(
+                    endpoint.name,
+                    breaker_threshold,
+                    breaker_reset_timeout,
+                )
+
+        self._lock = threading.Lock()
+        self._next = 0
+        self._stopped = threading.Event()
+
+        if (len(endpoints) > 1 or breaker_threshold) and ping_interval > 0:
+            threading.Thread(
+                target=self._ping_forever,
+                name="clamav-router-ping",
+                daemon=True,
+            ).start()
+
+    def pick(self, exclude: Iterable[Endpoint] = ()) -> Optional[Endpoint]:
+        """Choose an endpoint for the next scan.
+
+        Healthy endpoints are preferred. If all of them are ejected, the
+        unhealthy ones are tried anyway, as the health state may be stale.
+        Endpoints with an open circuit are skipped.
+
+        Returns:
+            An endpoint, or None if all of them have been excluded or their
+            circuits are open.
+        """
+        excluded = set(map(id, exclude))
+
+        with self._lock:
+            candidates = [
+                ep
+                for ep in self.endpoints
+                if id(ep) not in excluded and (not ep.breaker or ep.breaker.available())
+            ]
+            healthy = [ep for ep in candidates if ep.healthy]
+
+            if not candidates:
+                return None
+
+            endpoint = self._choose(healthy or candidates)
+            if endpoint.breaker:
+                endpoint.breaker.acquire()
+            return endpoint
+
+    @contextlib.contextmanager
+    def track(self, endpoint: Endpoint) -> Iterator[Endpoint]:
+        """Count the scan as outstanding on the endpoint while in the block."""
+        with self._lock:
+            endpoint.outstanding += 1
+        try:
+            yield endpoint
+        finally:
+            with self._lock:
+                endpoint.outstanding -= 1
+
+    def report_success(self, endpoint: Endpoint) -> None:
+        with self._lock:
+            if endpoint.breaker:
+                endpoint.breaker.record_success()
+
+            endpoint.failures = 0
+            if not endpoint.healthy:
+                log.info("Clamd: endpoint %s is back in rotation", endpoint.name)
+            endpoint.healthy = True
+
+    def release(self, endpoint: Endpoint) -> None:
+        """Forget the pick of an endpoint that hasn't been asked to scan.
+
+        E.g. the verdict has been found in the cache. Neither the health
+        nor the circuit of the endpoint is changed, but a reserved trial
+        scan is given back.
+        """
+        with self._lock:
+            if endpoint.breaker:
+                endpoint.breaker.release()
+
+    def report_failure(self, endpoint: Endpoint) -> None:
+        with self._lock:
+            if endpoint.breaker:
+                endpoint.breaker.record_failure()
+
+            if len(self.endpoints) < 2:
+                return
+
+            endpoint.failures += 1
+            if endpoint.healthy and endpoint.failures >= self.max_failures:
+                endpoint.healthy = False
+                log.warning(
+                    "Clamd: endpoint %s is taken out of rotation after %s errors",
+                    endpoint.name,
+                    endpoint.failures,
+                )
+
+    def stats(self) -> list[dict[str, Any]]:
+        with self._lock:
+            return [ep.stats() for ep in self.endpoints]
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _choose(self, candidates: list[Endpoint]) -> Endpoint:
+        """Must be called under the lock."""
+        if self.strategy == RoutingStrategies.ROUND_ROBIN:
+            total = sum(ep.weight for ep in candidates)
+            for ep in candidates:
+                ep.current_weight += ep.weight
+
+            chosen = max(candidates, key=lambda ep: ep.current_weight)
+            chosen.current_weight -= total
+            return chosen
+
+        # rotate the start, so ties are spread evenly between the endpoints
+        self._next = (self._next + 1) % len(candidates)
+        rotated = candidates[self._next:] + candidates[: self._next]
+        return min(rotated, key=lambda ep: ep.outstanding / max(ep.weight, 1))
+
+    def _ping_forever(self) -> None:
+        while not self._stopped.wait(self.ping_interval):
+            if self.pid != os.getpid():
+                return
+
+            for endpoint in self.endpoints:
+                try:
+                    self.probe(endpoint)
+                except Exception:  # noqa: BLE001
+                    self.report_failure(endpoint)
+                else:
+                    self.report_success(endpoint)
+
+
+def get_router(
+    endpoints: list[Endpoint],
+    strategy: str,
+    max_failures: int,
+    ping_interval: float,
+    probe: Callable[[Endpoint], Any],
+    breaker_threshold: Optional[int] = None,
+    breaker_reset_timeout: float = 30,
+) -> Router:
+    """Return the router of the current process.
+
+    The router is re-created after a fork, as the PING thread doesn't
+    survive it, and when the settings have been changed.
+    """
+    global _router
+
+    settings = (
+        [ep.name for ep in endpoints],
+        [ep.weight for ep in endpoints],
+        strategy,
+        max_failures,
+        ping_interval,
+        breaker_threshold,
+        breaker_reset_timeout,
+    )
+
+    with _router_lock:
+        if _router is not None and (
+            _router.pid != os.getpid() or _get_settings(_router) != settings
+        ):
+            _router.stop()
+            _router = None
+
+        if _router is None:
+            _router = Router(
+                endpoints,
+                strategy,
+                max_failures,
+                ping_interval,
+                probe,
+                breaker_threshold,
+                breaker_reset_timeout,
+            )
+
+    return _router
+
+
+def get_stats() -> Optional[list[dict[str, Any]]]:
+    """Return the endpoint stats of the current process router, if any."""
+    if _router is None or _router.pid != os.getpid():
+        return None
+    return _router.stats()
+
+
+def _get_settings(router: Router) -> tuple[Any, ...]:
+    return (
+        [ep.name for ep in router.endpoints],
+        [ep.weight for ep in router.endpoints],
+        router.strategy,
+        router.max_failures,
+        router.ping_interval,
+        router.breaker_threshold,
+        router.breaker_reset_timeout,
+    )
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import contextvars
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import IO, Callable, Iterator, Optional
+
+from .config import ClamAvStatus
+
+log = logging.getLogger(__name__)
+
+PARTIAL_MESSAGE = (
+    "The file exceeds the filesize limit and was only scanned in windows. "
+    "Archives and compressed content can't be checked this way"
+)
+
+
+def iter_windows(stream: IO[bytes], window_size: int, overlap: int) -> Iterator[bytes]:
+    """Split the stream into windows of `window_size` bytes.
+
+    Every window but the first one starts with the last `overlap` bytes of
+    the previous window, so a signature crossing the boundary is still
+    found, as long as it's not longer than the overlap. The stream is read
+    sequentially, each byte once.
+    """
+    step = window_size - overlap
+    window = _read_full(stream, window_size)
+
+    while window:
+        yield window
+
+        if len(window) < window_size:
+            return
+
+        tail = window[step:]
+        chunk = _read_full(stream, step)
+        if not chunk:
+            return
+        window = tail + chunk
+
+
+def _read_full(stream: IO[bytes], size: int) -> bytes:
+    """Read `size` bytes, unless the stream ends earlier."""
+    chunks = []
+    while size > 0:
+        chunk = stream.read(size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def scan_windows(
+    stream: IO[bytes],
+    scan: Callable[[bytes], tuple[str, Optional[str]]],
+    window_size: int,
+    overlap: int,
+    concurrency: int,
+) -> tuple[str, Optional[str]]:
+    """Scan the stream window by window and combine the verdicts.
+
+    Up to `concurrency` windows are scanned at the same time, so at most
+    that many windows are kept in memory. Scanning stops as soon as malware
+    is found in any window.
+
+    Args:
+        stream (IO[bytes]): the stream to scan
+        scan (Callable): scans a single window and returns its verdict
+        window_size (int): window size in bytes, must be below StreamMaxLength
+        overlap (int): number of bytes shared by adjacent windows
+        concurrency (int): number of windows scanned in parallel
+
+    Returns:
+        FOUND verdict of the first infected window, otherwise an ERROR
+        verdict, if any window failed, otherwise ERR_PARTIAL. Windows are
+        never unpacked, so a file without a match is not known to be clean.
+
+    Raises:
+        Any exception raised by `scan`, e.g. clamd connection errors.
+    """
+    found: Optional[tuple[str, Optional[str]]] = None
+    error: Optional[tuple[str, Optional[str]]] = None
+    stop = threading.Event()
+    in_flight: set[Future[tuple[str, Optional[str]]]] = set()
+
+    def collect(done: set[Future[tuple[str, Optional[str]]]]) -> None:
+        nonlocal found, error
+
+        for future in done:
+            status, signature = future.result()
+            if status == ClamAvStatus.FOUND and found is None:
+                found = (status, signature)
+                stop.set()
+            elif status == ClamAvStatus.ERROR and error is None:
+                error = (status, signature)
+
+    with ThreadPoolExecutor(
+        max_workers=concurrency,
+        thread_name_prefix="clamav-segment",
+    ) as executor:
+        try:
+            for number, window in enumerate(iter_windows(stream, window_size, overlap)):
+                if stop.is_set():
+                    break
+
+                log.debug("Clamd: scanning window %s, %s bytes", number, len(window))
+                # the context carries the current tracing span to the thread
+                in_flight.add(
+                    executor.submit(contextvars.copy_context().run, scan, window),
+                )
+
+                if len(in_flight) >= concurrency:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+
+            done, in_flight = wait(in_flight)
+            collect(done)
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+    return found or error or (ClamAvStatus.ERR_PARTIAL, PARTIAL_MESSAGE)
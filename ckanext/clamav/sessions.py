@@ -0,0 +1,331 @@
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from typing import IO, Callable, Optional
+
+from clamd import BufferTooLongError
+from clamd import ConnectionError as ClamConnectionError
+
+from ckan.lib.redis import connect_to_redis
+
+from .adapters import InstreamWriter
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE: int = 1024 * 1024
+CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+REDIS_KEY_PREFIX: str = "ckanext:clamav:chunked:"
+SPOOL_PREFIX: str = "ckanext-clamav-chunked-"
+# how often the spool directory is swept for abandoned uploads, in seconds
+SWEEP_INTERVAL: float = 60
+
+_sessions: dict[str, ScanSession] = {}
+_sessions_lock = threading.Lock()
+_swept_at: float = 0.0
+
+
+class ChunkedUpload:
+    """A file uploaded in chunks, which may reach any worker process.
+
+    Every chunk is written at its offset into a spool file named after the
+    upload, and its range is added to a Redis set, so all the processes see
+    the same upload. For several hosts the spool directory must be shared
+    by them too. Nothing is passed to the uploader until the file is
+    complete.
+
+    Args:
+        upload_id (str): the identifier of the upload
+        total (int): the size of the complete file
+        directory (Optional[str]): the directory of the spool file, the
+            system temporary directory by default
+        timeout (float): seconds an unfinished upload is kept for
+    """
+
+    def __init__(
+        self,
+        upload_id: str,
+        total: int,
+        directory: Optional[str],
+        timeout: float,
+    ):
+        digest = hashlib.sha256(f"{upload_id}/{total}".encode()).hexdigest()
+        self.total = total
+        self.timeout = timeout
+        self.key = REDIS_KEY_PREFIX + digest
+        self.path = os.path.join(directory or tempfile.gettempdir(), SPOOL_PREFIX + digest)
+
+    def write(
+        self,
+        offset: int,
+        stream: IO[bytes],
+        on_data: Optional[Callable[[bytes], None]] = None,
+    ) -> int:
+        """Write the chunk that starts at the offset into the spool file.
+
+        Anything past the end of the file is ignored.
+
+        Args:
+            offset (int): the position of the chunk in the file
+            stream (IO[bytes]): the content of the chunk
+            on_data (Optional[Callable]): gets every block that is written
+
+        Returns:
+            The position of the end of the chunk.
+        """
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o600)
+        try:
+            position = offset
+            while position < self.total:
+                data = stream.read(min(CHUNK_SIZE, self.total - position))
+                if not data:
+                    break
+
+                view = memoryview(data)
+                while view:
+                    written = os.pwrite(fd, view, position)
+                    view, position = view[written:], position + written
+                if on_data is not None:
+                    on_data(data)
+        finally:
+            os.close(fd)
+
+        return position
+
+    def add_range(self, start: int, end: int) -> bool:
+        """Record the received chunk.
+
+        Returns:
+            True if the file is complete and the caller has claimed it. Of
+            the processes that complete the file at the same time, only one
+            claims it.
+        """
+        if start == end:
+            return False
+
+        redis = connect_to_redis()
+        pipeline = redis.pipeline()
+        pipeline.sadd(self.key, f"{start}-{end}")
+        pipeline.expire(self.key, max(1, int(self.timeout)))
+        pipeline.smembers(self.key)
+        _added, _expired, members = pipeline.execute()
+
+        ranges = []
+        for member in members:
+            if isinstance(member, bytes):
+                member = member.decode()
+            range_start, range_end = member.split("-")
+            ranges.append((int(range_start), int(range_end)))
+
+        if _merge_ranges(ranges) != [(0, self.total)]:
+            return False
+        return bool(redis.delete(self.key))
+
+    def open(self) -> IO[bytes]:
+        """Open the complete file and remove it from the spool directory.
+
+        The content is kept until the returned file is closed.
+        """
+        spool = open(self.path, "rb")  # noqa: SIM115
+        os.unlink(self.path)
+        return spool
+
+
+class ScanSession:
+    """Scans the chunks of an upload while they arrive at this process.
+
+    An INSTREAM command is opened with the first chunk, and every chunk
+    that continues the content sent so far is forwarded to clamd at once,
+    so the verdict is ready as soon as the last chunk is sent. A chunk out
+    of order, a chunk that has reached another process, or a connection
+    error ends the streaming, and the complete file is scanned with a
+    separate INSTREAM pass then.
+
+    Args:
+        total (int): the size of the complete file
+        writer (Optional[InstreamWriter]): the open INSTREAM command, None
+            if the file is only spooled
+    """
+
+    def __init__(self, total: int, writer: Optional[InstreamWriter]):
+        self.total = total
+        self.writer = writer
+        self.streamed = 0
+        self.updated_at = time.monotonic()
+
+        self._lock = threading.Lock()
+
+    def feed(self, offset: int, stream: IO[bytes], upload: ChunkedUpload) -> int:
+        """Spool the chunk that starts at the offset, and stream it if it's next.
+
+        Returns:
+            The position of the end of the chunk.
+        """
+        with self._lock:
+            self.updated_at = time.monotonic()
+            if self.writer is not None and offset != self.streamed:
+                self._stop_streaming("the chunks arrive out of order")
+
+            return upload.write(offset, stream, self._stream)
+
+    def finish(self) -> Optional[tuple[str, Optional[str]]]:
+        """Get the verdict of the streamed content.
+
+        Returns:
+            The verdict, or None if the streaming has ended early and the
+            spool must be scanned instead.
+        """
+        with self._lock:
+            writer, self.writer = self.writer, None
+            if writer is None or self.streamed != self.total:
+                if writer is not None:
+                    writer.close()
+                return None
+
+            try:
+                scan_result = writer.finish()
+            except (BufferTooLongError, ClamConnectionError) as e:
+                log.debug("Clamd: the streamed scan has failed. %s", e)
+                return None
+
+            return next(iter(scan_result.values())) if scan_result else None
+
+    def close(self) -> None:
+        with self._lock:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+
+    def _stream(self, data: bytes) -> None:
+        if self.writer is None:
+            return
+
+        try:
+            self.writer.write(data)
+        except (BufferTooLongError, ClamConnectionError) as e:
+            self._stop_streaming(str(e))
+            return
+        self.streamed += len(data)
+
+    def _stop_streaming(self, reason: str) -> None:
+        log.debug("Clamd: the upload is not streamed anymore, %s", reason)
+        self.writer.close()
+        self.writer = None
+
+
+def parse_content_range(value: Optional[str]) -> Optional[tuple[int, int, int]]:
+    """Parse a `Content-Range: bytes <start>-<end>/<total>` header.
+
+    Returns:
+        The first byte, the byte after the last one and the file size, or
+        None if the value is not a valid range.
+    """
+    match = CONTENT_RANGE_RE.match((value or "").strip())
+    if not match:
+        return None
+
+    start, last, total = map(int, match.groups())
+    if start > last or last >= total:
+        return None
+    return start, last + 1, total
+
+
+def get_session(
+    upload_id: str,
+    offset: int,
+    total: int,
+    open_writer: Callable[[], Optional[InstreamWriter]],
+    max_streaming: int,
+    timeout: float,
+) -> ScanSession:
+    """Return the scan session of the upload in this process, starting it if needed.
+
+    Sessions that haven't got a chunk for `timeout` seconds are dropped.
+    Only `max_streaming` sessions keep an INSTREAM command open, as every
+    one of them occupies a clamd thread. The rest are only spooled, as well
+    as the sessions that don't start with the first chunk, e.g. when the
+    earlier chunks have reached other processes.
+
+    Args:
+        upload_id (str): the identifier of the upload
+        offset (int): the position of the chunk the session is needed for
+        total (int): the size of the complete file
+        open_writer (Callable): opens an INSTREAM command, returns None if
+            clamd is not accessible
+        max_streaming (int): the number of sessions streamed at once
+        timeout (float): seconds an idle session is kept for
+    """
+    with _sessions_lock:
+        _drop_idle_sessions(timeout)
+
+        session = _sessions.get(upload_id)
+        if session is not None and session.total == total:
+            return session
+        if session is not None:
+            session.close()
+
+        streaming = sum(1 for s in _sessions.values() if s.writer is not None)
+        writer = open_writer() if offset == 0 and streaming < max_streaming else None
+        session = _sessions[upload_id] = ScanSession(total, writer)
+
+    return session
+
+
+def pop_session(upload_id: str) -> Optional[ScanSession]:
+    """Remove the session of the upload, e.g. once the file is complete."""
+    with _sessions_lock:
+        return _sessions.pop(upload_id, None)
+
+
+def drop_abandoned_uploads(directory: Optional[str], timeout: float) -> None:
+    """Remove the spool files of the uploads without a chunk for `timeout` seconds.
+
+    The directory is swept at most once in SWEEP_INTERVAL by every process.
+    """
+    global _swept_at
+
+    now = time.time()
+    with _sessions_lock:
+        if now - _swept_at < SWEEP_INTERVAL:
+            return
+        _swept_at = now
+
+    directory = directory or tempfile.gettempdir()
+    try:
+        names = [name for name in os.listdir(directory) if name.startswith(SPOOL_PREFIX)]
+    except OSError as e:
+        log.warning("Clamd: unable to sweep the chunked uploads. %s", e)
+        return
+
+    for name in names:
+        path = os.path.join(directory, name)
+        with contextlib.suppress(OSError):
+            if now - os.path.getmtime(path) >= timeout:
+                log.debug("Clamd: dropping the abandoned chunked upload %s", name)
+                os.unlink(path)
+
+
+def _drop_idle_sessions(timeout: float) -> None:
+    """Must be called under the lock."""
+    now = time.monotonic()
+    for upload_id, session in list(_sessions.items()):
+        if now - session.updated_at >= timeout:
+            log.debug("Clamd: dropping the idle scan session of %s", upload_id)
+            session.close()
+            del _sessions[upload_id]
+
+
+def _merge_ranges(ranges: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    merged: list[tuple[int, int]] = []
+    for range_start, range_end in sorted(ranges):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], range_end))
+        else:
+            merged.append((range_start, range_end))
+    return merged
@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import logging
+import tempfile
+from io import BytesIO
+from typing import IO, Optional
+
+from werkzeug.datastructures import FileStorage
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE: int = 1024 * 1024
+
+
+def spool_upload(file: FileStorage, threshold: int, directory: Optional[str]) -> bool:
+    """Move a large in-memory upload stream to a temporary file.
+
+    Uploads built in code, e.g. by API clients or harvesters, may wrap the
+    whole content in a `BytesIO`. A stream over the threshold is copied to
+    the spool file chunk by chunk, straight from its buffer, and replaces
+    the upload stream at the same position, so both the scan and the
+    uploader read it from disk. The in-memory stream is closed, which frees
+    its buffer. The spool file is removed once it's closed.
+
+    Args:
+        file (FileStorage): the upload
+        threshold (int): the size of the largest stream kept in memory
+        directory (Optional[str]): the directory of the spool file, the
+            system temporary directory by default
+
+    Returns:
+        True if the stream has been spooled, False otherwise.
+    """
+    stream = file.stream
+    if not isinstance(stream, BytesIO) or stream.closed:
+        return False
+
+    with stream.getbuffer() as buffer:
+        if buffer.nbytes <= threshold:
+            return False
+
+        spool = _write_spool(buffer, directory)
+
+    spool.seek(stream.tell())
+    file.stream = spool
+    stream.close()
+
+    log.debug("Clamd: %s is spooled to %s", file.filename, spool.name)
+    return True
+
+
+def _write_spool(buffer: memoryview, directory: Optional[str]) -> IO[bytes]:
+    spool = tempfile.NamedTemporaryFile(  # noqa: SIM115
+        dir=directory,
+        prefix="ckanext-clamav-",
+    )
+    try:
+        for offset in range(0, buffer.nbytes, CHUNK_SIZE):
+            spool.write(buffer[offset:offset + CHUNK_SIZE])
+        spool.flush()
+    except BaseException:
+        spool.close()
+        raise
+
+    return spool
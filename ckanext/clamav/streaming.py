@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import logging
+import threading
+from typing import IO, Any, Optional
+
+from clamd import BufferTooLongError
+from clamd import ConnectionError as ClamConnectionError
+from clamd import ResponseError as ClamResponseError
+
+from .adapters import InstreamWriter
+from .config import ClamAvStatus
+
+log = logging.getLogger(__name__)
+
+_streaming = 0
+_streaming_lock = threading.Lock()
+
+
+class ScanningSpool:
+    """The container of a file part, streamed to clamd as it's received.
+
+    werkzeug writes the file part of a multipart body into the container
+    while the body is being received. Every write goes to the spool and to
+    the open INSTREAM command, so clamd scans the file at the same time,
+    and the verdict is ready soon after the body is over. Once written,
+    the container is read like the spool.
+
+    If the streaming fails, e.g. the file exceeds the clamd stream limit,
+    only the spool is written, and the file is scanned as usual.
+
+    Args:
+        spool (IO[bytes]): the file the part is kept in
+        writer (Optional[InstreamWriter]): the open INSTREAM command
+    """
+
+    def __init__(self, spool: IO[bytes], writer: Optional[InstreamWriter]):
+        self.spool = spool
+        self.writer = writer
+
+    def write(self, data: bytes) -> int:
+        written = self.spool.write(data)
+
+        if self.writer is not None:
+            try:
+                self.writer.write(data)
+            except ClamConnectionError as e:
+                log.debug("Clamd: the received file is not streamed anymore. %s", e)
+                self._release_writer().close()
+
+        return written
+
+    def verdict(self) -> Optional[tuple[str, Optional[str]]]:
+        """Read the verdict of the streamed content.
+
+        Returns:
+            The verdict, or None if the content has not been streamed in
+            full, or clamd has failed to scan it.
+        """
+        if self.writer is None:
+            return None
+
+        writer = self._release_writer()
+        try:
+            scan_result = writer.finish()
+        except (BufferTooLongError, ClamConnectionError, ClamResponseError) as e:
+            log.debug("Clamd: the streamed scan has failed. %s", e)
+            return None
+
+        verdict = next(iter(scan_result.values()))
+        if verdict[0] not in (ClamAvStatus.OK, ClamAvStatus.FOUND):
+            return None
+        return verdict
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self._release_writer().close()
+        self.spool.close()
+
+    def __getattr__(self, name: str) -> Any:
+        if name in ("spool", "writer"):
+            raise AttributeError(name)
+        return getattr(self.spool, name)
+
+    def __iter__(self):
+        return iter(self.spool)
+
+    def _release_writer(self) -> InstreamWriter:
+        global _streaming
+
+        writer, self.writer = self.writer, None
+        with _streaming_lock:
+            _streaming -= 1
+        return writer
+
+
+def reserve(limit: int) -> bool:
+    """Take one of the `limit` streams of the process.
+
+    Every stream holds a clamd thread for as long as the body is being
+    received, which may take long on a slow link.
+
+    Returns:
+        True if the stream is taken. It's released by the `ScanningSpool`
+        it's passed to.
+    """
+    global _streaming
+
+    with _streaming_lock:
+        if _streaming >= limit:
+            return False
+        _streaming += 1
+        return True
+
+
+def cancel() -> None:
+    """Release a stream taken with `reserve`, that has not been opened."""
+    global _streaming
+
+    with _streaming_lock:
+        _streaming -= 1
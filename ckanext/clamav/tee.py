@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import hashlib
+import tempfile
+from typing import IO, Optional
+
+SPOOL_MAX_MEMORY: int = 5 * 1024 * 1024
+DRAIN_CHUNK_SIZE: int = 1024 * 1024
+
+
+class TeeReader:
+    """A read-only stream forwarding every chunk it reads to the sinks.
+
+    clamd reads the upload through this wrapper, so hashing the content and
+    keeping a copy of a stream that can't be rewound happen in the same
+    pass. Nothing is read from the source twice.
+
+    Args:
+        source (IO[bytes]): the upload stream
+        algorithms (list[str]): names of the hashlib algorithms to compute
+        spool (bool): whether to keep a copy of the content in a spool file
+    """
+
+    def __init__(self, source: IO[bytes], algorithms: list[str], spool: bool):
+        self.source = source
+        self.bytes_read = 0
+        self.complete = False
+
+        self._hashers = {name: hashlib.new(name) for name in algorithms}
+        self._spool: Optional[IO[bytes]] = (
+            tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY) if spool else None
+        )
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self.source.read(size)
+
+        if not chunk:
+            if size != 0:
+                self.complete = True
+            return chunk
+
+        self.bytes_read += len(chunk)
+        for hasher in self._hashers.values():
+            hasher.update(chunk)
+        if self._spool is not None:
+            self._spool.write(chunk)
+
+        return chunk
+
+    @property
+    def spooling(self) -> bool:
+        return self._spool is not None
+
+    def drain(self) -> None:
+        """Read the rest of the source, e.g. after clamd stopped reading it."""
+        while self.read(DRAIN_CHUNK_SIZE):
+            pass
+
+    def hexdigests(self) -> dict[str, str]:
+        """Return the digests of the content, once it has been read in full."""
+        if not self.complete:
+            return {}
+        return {name: hasher.hexdigest() for name, hasher in self._hashers.items()}
+
+    def detach_spool(self) -> IO[bytes]:
+        """Hand over the rewound spool with the content read so far."""
+        spool, self._spool = self._spool, None
+        if spool is None:
+            raise ValueError("The content is not spooled")
+
+        spool.seek(0)
+        return spool
+
+    def close(self) -> None:
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
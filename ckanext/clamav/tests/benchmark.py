@@ -0,0 +1,245 @@
+"""Benchmark of the scan path against the fake clamd.
+
+Drives `scan_file_for_viruses` with files of the given sizes at the given
+concurrency, over unix and TCP sockets, and reports latency percentiles,
+throughput and memory. No real clamd is needed, so regressions of the scan
+path are caught offline:
+
+    python -m ckanext.clamav.tests.benchmark --sizes 4KiB 1MiB 16MiB \\
+        --concurrency 1 8 32 --byte-latency 1e-9 --jitter 0.002
+
+Any extension option can be set with `--config key=value`, e.g.
+`--config ckanext.clamav.pool.enabled=true`.
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import itertools
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Any, Iterator, NamedTuple, Optional
+
+from werkzeug.datastructures import FileStorage
+
+import ckan.plugins.toolkit as tk
+from ckan import logic
+
+from ckanext.clamav import config as c
+from ckanext.clamav import utils
+from ckanext.clamav.tests.fake_clamd import FakeClamd
+
+SIZE_UNITS: dict[str, int] = {"KiB": 1024, "MiB": 1024**2, "GiB": 1024**3}
+TRANSPORTS: tuple[str, ...] = ("unix", "tcp")
+
+
+class BenchmarkResult(NamedTuple):
+    transport: str
+    size: int
+    concurrency: int
+    scans: int
+    p50: float
+    p99: float
+    throughput: float
+    peak_memory: int
+    outcomes: dict[str, int]
+
+    def format(self) -> str:
+        outcomes = " ".join(f"{k}={v}" for k, v in sorted(self.outcomes.items()))
+        return (
+            f"{self.transport:<5} {format_size(self.size):>9} {self.concurrency:>5} "
+            f"{self.scans:>6} {self.p50 * 1000:>9.2f} {self.p99 * 1000:>9.2f} "
+            f"{self.throughput / SIZE_UNITS['MiB']:>10.1f} "
+            f"{self.peak_memory / SIZE_UNITS['MiB']:>9.1f}  {outcomes}"
+        )
+
+
+HEADER: str = (
+    f"{'via':<5} {'size':>9} {'conc':>5} {'scans':>6} {'p50, ms':>9} "
+    f"{'p99, ms':>9} {'MiB/s':>10} {'peak MiB':>9}  outcomes"
+)
+
+
+def run_benchmark(
+    clamd: FakeClamd,
+    size: int,
+    concurrency: int,
+    scans: int,
+    settings: Optional[dict[str, Any]] = None,
+) -> BenchmarkResult:
+    """Scan `scans` files of `size` bytes with `concurrency` threads.
+
+    Args:
+        clamd (FakeClamd): the server to scan on
+        size (int): file size in bytes
+        concurrency (int): number of scanning threads
+        scans (int): number of files to scan
+        settings (Optional[dict[str, Any]]): extra extension options
+
+    Returns:
+        The latency percentiles in seconds, throughput in bytes per second,
+        peak memory allocated by Python during the run in bytes, and the
+        number of scans by outcome.
+    """
+    content = os.urandom(size)
+    transport = "tcp" if clamd.path is None else "unix"
+
+    def scan(_number: int) -> tuple[float, str]:
+        file = FileStorage(BytesIO(content), "benchmark.bin")
+        started_at = time.perf_counter()
+        try:
+            utils.scan_file_for_viruses({"upload": file})
+        except logic.ValidationError:
+            pass
+        latency = time.perf_counter() - started_at
+
+        report = utils.get_attached_report(file)
+        return latency, report.status if report else "UNKNOWN"
+
+    with configured(_connection_settings(clamd), settings or {}):
+        # the first scan opens pools, probes limits and starts threads
+        scan(0)
+
+        tracemalloc.start()
+        started_at = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            results = list(executor.map(scan, range(scans)))
+        elapsed = time.perf_counter() - started_at
+        _current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    latencies = sorted(latency for latency, _status in results)
+    return BenchmarkResult(
+        transport,
+        size,
+        concurrency,
+        scans,
+        percentile(latencies, 50),
+        percentile(latencies, 99),
+        size * scans / elapsed,
+        peak,
+        dict(Counter(status for _latency, status in results)),
+    )
+
+
+@contextlib.contextmanager
+def configured(*settings: dict[str, Any]) -> Iterator[None]:
+    """Apply the extension options for the duration of the block."""
+    missing = object()
+    overrides: dict[str, Any] = {}
+    for options in settings:
+        overrides.update(options)
+
+    previous = {key: tk.config.get(key, missing) for key in overrides}
+    tk.config.update(overrides)
+    c.reset()
+    try:
+        yield
+    finally:
+        for key, value in previous.items():
+            if value is missing:
+                tk.config.pop(key, None)
+            else:
+                tk.config[key] = value
+        c.reset()
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Get the percentile of sorted values, by the nearest rank."""
+    if not values:
+        return 0.0
+
+    rank = max(0, min(len(values) - 1, round(percent / 100 * len(values)) - 1))
+    return values[rank]
+
+
+def parse_size(value: str) -> int:
+    for unit, multiplier in SIZE_UNITS.items():
+        if value.endswith(unit):
+            return int(float(value[: -len(unit)]) * multiplier)
+    return int(value)
+
+
+def format_size(size: int) -> str:
+    for unit, multiplier in reversed(SIZE_UNITS.items()):
+        if size >= multiplier and size % multiplier == 0:
+            return f"{size // multiplier}{unit}"
+    return f"{size}B"
+
+
+def _connection_settings(clamd: FakeClamd) -> dict[str, Any]:
+    if clamd.path:
+        return {
+            "ckanext.clamav.socket_type": "unix",
+            "ckanext.clamav.socket_path": clamd.path,
+            "ckanext.clamav.upload_unscanned": "true",
+        }
+
+    host, port = clamd.address
+    return {
+        "ckanext.clamav.socket_type": "tcp",
+        "ckanext.clamav.tcp.host": host,
+        "ckanext.clamav.tcp.port": str(port),
+        "ckanext.clamav.upload_unscanned": "true",
+    }
+
+
+@contextlib.contextmanager
+def _start_clamd(transport: str, **options: Any) -> Iterator[FakeClamd]:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "clamd.sock") if transport == "unix" else None
+        clamd = FakeClamd(path, **options)
+        try:
+            yield clamd
+        finally:
+            clamd.close()
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", nargs="+", type=parse_size, default=[4096])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8])
+    parser.add_argument("--scans", type=int, default=200)
+    parser.add_argument(
+        "--transports",
+        nargs="+",
+        choices=TRANSPORTS,
+        default=TRANSPORTS,
+    )
+    parser.add_argument("--stream-max-length", type=parse_size, default="64MiB")
+    parser.add_argument("--byte-latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--config", nargs="*", default=[], metavar="KEY=VALUE")
+    args = parser.parse_args(argv)
+
+    settings = dict(option.split("=", 1) for option in args.config)
+
+    print(HEADER)
+    for transport in args.transports:
+        with _start_clamd(
+            transport,
+            stream_max_length=args.stream_max_length,
+            byte_latency=args.byte_latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            seed=args.seed,
+        ) as clamd:
+            for size, concurrency in itertools.product(args.sizes, args.concurrency):
+                result = run_benchmark(clamd, size, concurrency, args.scans, settings)
+                print(result.format(), flush=True)
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"max RSS: {max_rss / 1024:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+from pathlib import Path
+
+import pytest
+
+import ckanext.clamav.config as c
+from ckanext.clamav.tests.fake_clamd import FakeClamd
+
+
+@pytest.fixture(autouse=True)
+def reset_config():
+    """Parse the options of every test from its own config."""
+    c.reset()
+    yield
+    c.reset()
+
+
+@pytest.fixture()
+def fake_clamd(tmp_path: Path):
+    clamd = FakeClamd(str(tmp_path / "clamd.sock"))
+    yield clamd
+    clamd.close()
+
+
+@pytest.fixture()
+def clamd_socket(fake_clamd: FakeClamd) -> str:
+    return fake_clamd.path
+
+
+@pytest.fixture()
+def clean_db(reset_db, migrate_db_for, with_plugins):
+    """Reset the database, including the tables of the plugin.
+
+    The migrations of the plugin can't be applied until it's loaded.
+    """
+    reset_db()
+    migrate_db_for("clamav")
+
+
+@pytest.fixture()
+def clamd_storage(fake_clamd: FakeClamd, tmp_path: Path, ckan_config, monkeypatch):
+    """Keep the uploads in a temporary directory and scan them with the fake clamd."""
+    monkeypatch.setitem(ckan_config, "ckan.storage_path", str(tmp_path))
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_type", "unix")
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_path", fake_clamd.path)
+    # the plugin may have parsed the options already
+    c.reset()
+    return fake_clamd
@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import array
+import contextlib
+import os
+import random
+import socket
+import struct
+import threading
+import time
+from typing import Optional, Union
+
+from clamd import EICAR
+
+CLAMD_VERSION = "ClamAV 1.0.0/27000/Mon Jan 1 00:00:00 2024"
+STREAM_MAX_LENGTH = 1024
+
+
+class FakeClamd:
+    """A minimal clamd, listening on a unix or TCP socket.
+
+    Understands both `n` and `z` prefixed commands, IDSESSION, INSTREAM,
+    FILDES and SCAN. Content containing the EICAR test string is reported
+    as infected.
+
+    Args:
+        path (Optional[str]): unix socket path. A TCP socket on a random
+            localhost port is opened without it
+        stream_max_length (int): the StreamMaxLength, in bytes
+        byte_latency (float): seconds spent on every received stream byte
+        jitter (float): up to this number of seconds is added to every reply
+        error_rate (float): share of commands answered by dropping the
+            connection
+        seed (Optional[int]): seed of the jitter and the errors
+        hang_up_on_limit (bool): drop the connection right after refusing a
+            stream over the limit, like clamd does
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        stream_max_length: int = STREAM_MAX_LENGTH,
+        byte_latency: float = 0,
+        jitter: float = 0,
+        error_rate: float = 0,
+        seed: Optional[int] = None,
+        hang_up_on_limit: bool = False,
+    ):
+        self.path = path
+        self.stream_max_length = stream_max_length
+        self.byte_latency = byte_latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.hang_up_on_limit = hang_up_on_limit
+        self.commands: list[str] = []
+
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+        if path:
+            self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._server.bind(path)
+        else:
+            self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._server.bind(("127.0.0.1", 0))
+        self._server.listen(128)
+
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    @property
+    def address(self) -> Union[str, tuple[str, int]]:
+        """The unix socket path or the (host, port) pair."""
+        return self.path or self._server.getsockname()
+
+    def close(self):
+        self._server.close()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn: socket.socket):
+        with conn, contextlib.suppress(OSError, ConnectionError):
+            command, terminator = self._recv_command(conn)
+            if command != "IDSESSION":
+                reply = self._execute(conn, command)
+                self._delay_reply()
+                conn.sendall(reply.encode() + terminator)
+                # unlike clamd, read the rest of the stream before hanging up,
+                # so the client gets the reply instead of a broken pipe
+                if reply.endswith("size limit exceeded. ERROR") and (
+                    not self.hang_up_on_limit
+                ):
+                    while conn.recv(65536):
+                        pass
+                return
+
+            request_id = 0
+            while True:
+                command, terminator = self._recv_command(conn)
+                if command == "END":
+                    return
+
+                request_id += 1
+                reply = self._execute(conn, command)
+                self._delay_reply()
+                conn.sendall(f"{request_id}: {reply}".encode() + terminator)
+                if reply.endswith("size limit exceeded. ERROR"):
+                    return
+
+    def _execute(self, conn: socket.socket, command: str) -> str:
+        self.commands.append(command.split(" ", 1)[0])
+
+        if self.error_rate and self._chance(self.error_rate):
+            raise ConnectionError("Injected error")
+
+        if command == "PING":
+            return "PONG"
+        if command == "VERSION":
+            return CLAMD_VERSION
+        if command == "INSTREAM":
+            return self._instream(conn)
+        if command == "FILDES":
+            return self._fildes(conn)
+        if command.startswith("SCAN "):
+            return self._scan(command[5:])
+        return "UNKNOWN COMMAND"
+
+    def _instream(self, conn: socket.socket) -> str:
+        content = bytearray()
+        while True:
+            (size,) = struct.unpack("!L", self._recv_exact(conn, 4))
+            if not size:
+                return self._verdict("stream", bytes(content))
+
+            # clamd refuses a chunk over the limit before reading its data
+            if size > self.stream_max_length:
+                return "INSTREAM size limit exceeded. ERROR"
+
+            content += self._recv_exact(conn, size)
+            if self.byte_latency:
+                time.sleep(size * self.byte_latency)
+            if len(content) > self.stream_max_length:
+                return "INSTREAM size limit exceeded. ERROR"
+
+    def _fildes(self, conn: socket.socket) -> str:
+        fds = array.array("i")
+        _data, ancdata, _flags, _addr = conn.recvmsg(1, socket.CMSG_LEN(fds.itemsize))
+        fds.frombytes(ancdata[0][2])
+
+        with os.fdopen(fds[0], "rb") as f:
+            f.seek(0)
+            return self._verdict(f"fd[{fds[0]}]", f.read())
+
+    def _scan(self, path: str) -> str:
+        try:
+            with open(path, "rb") as f:
+                return self._verdict(path, f.read())
+        except OSError:
+            return f"{path}: lstat() failed: No such file or directory. ERROR"
+
+    def _verdict(self, name: str, content: bytes) -> str:
+        if EICAR in content:
+            return f"{name}: Win.Test.EICAR_HDB-1 FOUND"
+        return f"{name}: OK"
+
+    def _delay_reply(self):
+        if self.jitter:
+            with self._random_lock:
+                delay = self._random.uniform(0, self.jitter)
+            time.sleep(delay)
+
+    def _chance(self, rate: float) -> bool:
+        with self._random_lock:
+            return self._random.random() < rate
+
+    def _recv_command(self, conn: socket.socket) -> tuple[str, bytes]:
+        prefix = self._recv_exact(conn, 1)
+        terminator = b"\0" if prefix == b"z" else b"\n"
+
+        data = b""
+        while not data.endswith(terminator):
+            data += self._recv_exact(conn, 1)
+        return data[:-1].decode(), terminator
+
+    def _recv_exact(self, conn: socket.socket, size: int) -> bytes:
+        data = bytearray()
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError
+            data += chunk
+        return bytes(data)
@@ -0,0 +1,131 @@
+import threading
+import time
+from io import BytesIO
+
+import pytest
+from werkzeug.datastructures import FileStorage as FlaskFileStorage
+
+from ckanext.clamav import admission, utils
+
+clean_string = b"safe file content"
+
+
+def admit_in_order(controller, sizes):
+    """Queue the scans behind a held slot and return the order of admission."""
+    admitted = []
+
+    def scan(size):
+        with controller.admit(size):
+            admitted.append(size)
+
+    with controller.admit(0):
+        threads = []
+        for size in sizes:
+            thread = threading.Thread(target=scan, args=(size,))
+            thread.start()
+            threads.append(thread)
+            while controller.queued < len(threads):
+                time.sleep(0.001)
+            time.sleep(0.01)
+
+    for thread in threads:
+        thread.join()
+
+    return admitted
+
+
+class TestAdmissionController:
+    def test_smallest_files_go_first(self):
+        controller = admission.AdmissionController(1, 5, 0)
+
+        assert admit_in_order(controller, [300, 100, None, 200]) == [
+            100,
+            200,
+            300,
+            None,
+        ]
+
+    def test_waiting_files_age(self):
+        # a second of waiting is worth a gigabyte
+        controller = admission.AdmissionController(1, 5, 1024**3)
+
+        assert admit_in_order(controller, [1024**2, 1]) == [1024**2, 1]
+
+    def test_scans_up_to_the_limit_are_not_queued(self):
+        controller = admission.AdmissionController(2, 0, 0)
+
+        with controller.admit(1), controller.admit(2):
+            assert controller.in_flight == 2
+        assert controller.in_flight == 0
+
+    def test_queue_timeout(self):
+        controller = admission.AdmissionController(1, 0.05, 0)
+
+        with controller.admit(1), pytest.raises(admission.AdmissionTimeout):
+            with controller.admit(1):
+                pass
+
+        assert controller.queued == 0
+        assert controller.in_flight == 0
+
+    def test_shared_slots(self, tmp_path):
+        semaphore = admission.FileSemaphore(str(tmp_path), 1)
+        first = admission.AdmissionController(2, 0.05, 0, semaphore)
+        second = admission.AdmissionController(2, 0.05, 0, semaphore)
+
+        with first.admit(1), pytest.raises(admission.AdmissionTimeout):
+            with second.admit(1):
+                pass
+
+        with second.admit(1):
+            assert second.in_flight == 1
+
+
+def test_file_semaphore(tmp_path):
+    semaphore = admission.FileSemaphore(str(tmp_path), 2)
+
+    tokens = [semaphore.try_acquire(), semaphore.try_acquire()]
+    assert None not in tokens
+    assert semaphore.try_acquire() is None
+
+    semaphore.release(tokens.pop())
+    assert semaphore.try_acquire() is not None
+
+
+@pytest.mark.ckan_config("ckanext.clamav.admission.enabled", "true")
+@pytest.mark.ckan_config("ckanext.clamav.admission.max_in_flight", "1")
+@pytest.mark.ckan_config("ckanext.clamav.admission.queue_timeout", "0")
+class TestScan:
+    @pytest.fixture()
+    def clamd_config(self, fake_clamd, ckan_config, monkeypatch):
+        monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_type", "unix")
+        monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_path", fake_clamd.path)
+        return fake_clamd
+
+    def test_admitted_scan(self, clamd_config):
+        utils.scan_file_for_viruses(
+            {"upload": FlaskFileStorage(BytesIO(clean_string), "file.txt")},
+        )
+
+        assert "INSTREAM" in clamd_config.commands
+
+    @pytest.mark.ckan_config("ckanext.clamav.upload_unscanned", "false")
+    def test_busy_scanner_rejects_upload(self, clamd_config):
+        with admission.get_controller().admit(0), pytest.raises(
+            utils.logic.ValidationError,
+            match="busy",
+        ):
+            utils.scan_file_for_viruses(
+                {"upload": FlaskFileStorage(BytesIO(clean_string), "file.txt")},
+            )
+
+        assert not clamd_config.commands
+
+    def test_busy_scanner_lets_unscanned_upload_through(self, clamd_config):
+        file = FlaskFileStorage(BytesIO(clean_string), "file.txt")
+
+        with admission.get_controller().admit(0):
+            utils.scan_file_for_viruses({"upload": file})
+
+        assert utils.get_attached_report(file).status == "ERR_BUSY"
+        assert not clamd_config.commands
@@ -0,0 +1,81 @@
+import asyncio
+import socket
+from io import BytesIO
+
+import pytest
+from clamd import EICAR, BufferTooLongError, ConnectionError
+from werkzeug.datastructures import FileStorage as FlaskFileStorage
+
+from ckanext.clamav import aio, utils
+
+clean_string = b"safe file content"
+
+
+class AsyncStream:
+    def __init__(self, content: bytes):
+        self._content = BytesIO(content)
+
+    async def read(self, size=-1):
+        return self._content.read(size)
+
+
+@pytest.fixture()
+def client(fake_clamd):
+    return aio.AsyncClamd(socket.AF_UNIX, fake_clamd.path, 5)
+
+
+class TestAsyncClamd:
+
+    def test_ping_and_version(self, client):
+        assert asyncio.run(client.ping()) == "PONG"
+        assert asyncio.run(client.version()).startswith("ClamAV")
+
+    def test_instream(self, client):
+        assert asyncio.run(client.instream(BytesIO(clean_string))) == {
+            "stream": ("OK", None),
+        }
+        assert asyncio.run(client.instream(AsyncStream(EICAR))) == {
+            "stream": ("FOUND", "Win.Test.EICAR_HDB-1"),
+        }
+
+    def test_concurrent_scans(self, client):
+        async def scan_all():
+            return await asyncio.gather(
+                *(client.instream(BytesIO(clean_string)) for _ in range(50)),
+            )
+
+        assert all(r == {"stream": ("OK", None)} for r in asyncio.run(scan_all()))
+
+    def test_stream_over_the_limit(self, client):
+        with pytest.raises(BufferTooLongError):
+            asyncio.run(client.instream(BytesIO(b"x" * 4096)))
+
+    def test_deadline(self, tmp_path):
+        path = str(tmp_path / "silent.ctl")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as silent:
+            silent.bind(path)
+            silent.listen()
+
+            client = aio.AsyncClamd(socket.AF_UNIX, path, 0.1)
+            with pytest.raises(ConnectionError):
+                asyncio.run(client.ping())
+
+
+class TestSyncClamd:
+
+    def test_works_inside_a_running_loop(self, fake_clamd):
+        sync_client = aio.SyncClamd(socket.AF_UNIX, fake_clamd.path, 5)
+
+        async def ping():
+            return sync_client.ping()
+
+        assert asyncio.run(ping()) == "PONG"
+
+    @pytest.mark.ckan_config("ckanext.clamav.asyncio.enabled", "True")
+    def test_scan_with_asyncio_client(self, fake_clamd, ckan_config, monkeypatch):
+        monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_type", "unix")
+        monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_path", fake_clamd.path)
+
+        file = FlaskFileStorage(BytesIO(clean_string), "safe.txt")
+
+        assert utils._scan_filestream(file) == ("OK", None)
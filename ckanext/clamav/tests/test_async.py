@@ -0,0 +1,220 @@
+import os
+import uuid
+from io import BytesIO
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import pytest
+from clamd import ConnectionError as ClamConnectionError
+from werkzeug.datastructures import FileStorage as FlaskFileStorage
+
+from ckan.tests import factories, helpers
+
+from ckanext.clamav import jobs
+
+clean_string = b"safe file content"
+
+
+@pytest.fixture()
+def quarantine(tmp_path: Path, ckan_config, monkeypatch):
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.quarantine_path", str(tmp_path))
+    return tmp_path
+
+
+def create_pending_resource():
+    user = factories.Sysadmin()
+    dataset = factories.Dataset(user=user)
+
+    with patch("ckanext.clamav.jobs.tk.enqueue_job") as mock_enqueue:
+        resource = helpers.call_action(
+            "resource_create",
+            context={"user": user["name"], "ignore_auth": False},
+            package_id=dataset["id"],
+            url="",
+            upload=FlaskFileStorage(BytesIO(clean_string), "safe.txt"),
+            name="Pending File",
+        )
+
+    return resource, mock_enqueue
+
+
+@pytest.mark.usefixtures("clean_db", "clean_index", "with_plugins", "quarantine")
+@pytest.mark.ckan_config("ckan.plugins", "clamav")
+@pytest.mark.ckan_config("ckanext.clamav.async.enabled", "True")
+@pytest.mark.ckan_config("ckanext.clamav.socket_type", "unix")
+@pytest.mark.ckan_config("ckanext.clamav.socket_path", "/this/is/mocked")
+class TestAsyncScan:
+
+    def test_upload_is_quarantined(self, quarantine: Path):
+        with patch("ckanext.clamav.utils.CustomClamdUnixSocket") as mock_unix_socket:
+            resource, mock_enqueue = create_pending_resource()
+
+            mock_unix_socket.assert_not_called()
+
+        assert resource["scan_status"] == "pending"
+        assert (quarantine / resource["clamav_quarantine_id"]).exists()
+
+        mock_enqueue.assert_called_once()
+        assert mock_enqueue.call_args[0][1] == [
+            resource["id"],
+            resource["clamav_quarantine_id"],
+        ]
+
+    def test_clean_file_is_promoted(self, quarantine: Path):
+        resource, _ = create_pending_resource()
+
+        with patch("ckanext.clamav.utils.CustomClamdUnixSocket") as mock_unix_socket:
+            mock_clamd = MagicMock()
+            mock_unix_socket.return_value = mock_clamd
+            mock_clamd.instream.return_value = {"stream": ("OK", None)}
+
+            jobs.scan_quarantined_resource(
+                resource["id"],
+                resource["clamav_quarantine_id"],
+            )
+
+            assert mock_clamd.instream.call_count == 1
+
+        result = helpers.call_action("resource_show", id=resource["id"])
+        assert result["scan_status"] == "clean"
+        assert "clamav_quarantine_id" not in result
+        assert result["url"].endswith("safe.txt")
+        assert not os.listdir(quarantine)
+
+    def test_infected_file_is_deleted(self, quarantine: Path):
+        resource, _ = create_pending_resource()
+
+        with patch("ckanext.clamav.utils.CustomClamdUnixSocket") as mock_unix_socket:
+            mock_clamd = MagicMock()
+            mock_unix_socket.return_value = mock_clamd
+            mock_clamd.instream.return_value = {
+                "stream": ("FOUND", "Win.Test.EICAR_HDB-1"),
+            }
+
+            jobs.scan_quarantined_resource(
+                resource["id"],
+                resource["clamav_quarantine_id"],
+            )
+
+        result = helpers.call_action("resource_show", id=resource["id"])
+        assert result["scan_status"] == "infected"
+        assert result["url"] == ""
+        assert not os.listdir(quarantine)
+
+    def test_quarantined_file_is_processed_once(self):
+        resource, _ = create_pending_resource()
+
+        with patch("ckanext.clamav.utils.CustomClamdUnixSocket") as mock_unix_socket:
+            mock_clamd = MagicMock()
+            mock_unix_socket.return_value = mock_clamd
+            mock_clamd.instream.return_value = {"stream": ("OK", None)}
+
+            for _ in range(2):
+                jobs.scan_quarantined_resource(
+                    resource["id"],
+                    resource["clamav_quarantine_id"],
+                )
+
+            assert mock_clamd.instream.call_count == 1
+
+    @pytest.mark.ckan_config("ckanext.clamav.upload_unscanned", "False")
+    def test_scan_is_retried_while_clamd_is_unavailable(self, quarantine: Path):
+        resource, _ = create_pending_resource()
+
+        with patch("ckanext.clamav.utils.CustomClamdUnixSocket") as mock_unix_socket:
+            mock_clamd = MagicMock()
+            mock_unix_socket.return_value = mock_clamd
+            mock_clamd.instream.side_effect = ClamConnectionError("down")
+
+            with patch("ckanext.clamav.jobs.bg_jobs.get_queue") as mock_get_queue:
+                jobs.scan_quarantined_resource(
+                    resource["id"],
+                    resource["clamav_quarantine_id"],
+                )
+
+        # the worker is not held for the delay
+        mock_enqueue = mock_get_queue.return_value.enqueue_in
+        mock_enqueue.assert_called_once()
+        assert mock_enqueue.call_args[0][0].total_seconds() == 30
+        assert mock_enqueue.call_args[1]["kwargs"] == {"attempt": 1}
+
+        result = helpers.call_action("resource_show", id=resource["id"])
+        assert result["scan_status"] == "pending"
+        assert (quarantine / resource["clamav_quarantine_id"]).exists()
+
+    @pytest.mark.ckan_config("ckanext.clamav.upload_unscanned", "False")
+    def test_scan_error_is_not_promoted(self, quarantine: Path):
+        resource, _ = create_pending_resource()
+
+        with patch("ckanext.clamav.utils.CustomClamdUnixSocket") as mock_unix_socket:
+            mock_clamd = MagicMock()
+            mock_unix_socket.return_value = mock_clamd
+            mock_clamd.instream.return_value = {"stream": ("ERROR", "Can't read")}
+
+            jobs.scan_quarantined_resource(
+                resource["id"],
+                resource["clamav_quarantine_id"],
+            )
+
+        result = helpers.call_action("resource_show", id=resource["id"])
+        assert result["scan_status"] == "error"
+        assert result["url"] == ""
+        assert not os.listdir(quarantine)
+
+    def test_file_is_kept_if_the_job_fails(self, quarantine: Path):
+        resource, _ = create_pending_resource()
+
+        with patch("ckanext.clamav.utils.CustomClamdUnixSocket") as mock_unix_socket:
+            mock_clamd = MagicMock()
+            mock_unix_socket.return_value = mock_clamd
+            mock_clamd.instream.return_value = {"stream": ("OK", None)}
+
+            with patch(
+                "ckanext.clamav.jobs._update_status",
+                side_effect=RuntimeError("database is down"),
+            ), patch(
+                "ckanext.clamav.jobs.bg_jobs.get_queue",
+            ) as mock_get_queue, pytest.raises(RuntimeError):
+                jobs.scan_quarantined_resource(
+                    resource["id"],
+                    resource["clamav_quarantine_id"],
+                )
+
+        mock_get_queue.return_value.enqueue_in.assert_called_once()
+        assert os.listdir(quarantine) == [resource["clamav_quarantine_id"]]
+
+    def test_scan_fields_are_kept_from_the_editors(self):
+        resource, _ = create_pending_resource()
+        user = factories.Sysadmin()
+
+        with patch("ckanext.clamav.jobs.tk.enqueue_job"):
+            result = helpers.call_action(
+                "resource_patch",
+                context={"user": user["name"], "ignore_auth": False},
+                id=resource["id"],
+                name="Renamed File",
+                scan_status="clean",
+                clamav_quarantine_id=str(uuid.uuid4()),
+            )
+
+        assert result["name"] == "Renamed File"
+        assert result["scan_status"] == "pending"
+        assert result["clamav_quarantine_id"] == resource["clamav_quarantine_id"]
+
+    def test_new_resource_cannot_claim_a_quarantined_file(self):
+        resource, _ = create_pending_resource()
+        user = factories.Sysadmin()
+
+        with patch("ckanext.clamav.jobs.tk.enqueue_job") as mock_enqueue:
+            result = helpers.call_action(
+                "resource_create",
+                context={"user": user["name"], "ignore_auth": False},
+                package_id=resource["package_id"],
+                url="https://example.com/data.csv",
+                scan_status="pending",
+                clamav_quarantine_id=resource["clamav_quarantine_id"],
+            )
+
+        mock_enqueue.assert_not_called()
+        assert "scan_status" not in result
+        assert "clamav_quarantine_id" not in result
@@ -0,0 +1,64 @@
+import time
+from io import BytesIO
+
+import pytest
+from clamd import EICAR
+from werkzeug.datastructures import FileStorage as FlaskFileStorage
+
+from ckanext.clamav import utils
+
+clean_string = b"safe file content"
+
+
+@pytest.fixture()
+def clamd_config(fake_clamd, ckan_config, monkeypatch):
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_type", "unix")
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_path", fake_clamd.path)
+    return fake_clamd
+
+
+def make_files(*contents: bytes):
+    return [
+        FlaskFileStorage(BytesIO(content), f"file-{number}.txt")
+        for number, content in enumerate(contents)
+    ]
+
+
+def test_verdicts_are_in_the_order_of_files(clamd_config):
+    files = make_files(clean_string, EICAR, clean_string)
+
+    reports = utils.scan_files_for_viruses(files)
+
+    assert [report.status for report in reports] == ["OK", "FOUND", "OK"]
+    assert reports[1].signature == "Win.Test.EICAR_HDB-1"
+
+
+def test_files_are_scanned_concurrently(clamd_config):
+    # every scan takes about 0.2 seconds
+    clamd_config.byte_latency = 0.2 / len(clean_string)
+    files = make_files(*[clean_string] * 4)
+
+    started_at = time.monotonic()
+    utils.scan_files_for_viruses(files, concurrency=4)
+
+    assert time.monotonic() - started_at < 0.6
+
+
+def test_prescanned_uploads_are_not_scanned_again(clamd_config):
+    resources = [{"upload": file} for file in make_files(clean_string, EICAR)]
+    resources.append({"url": "https://example.com/data.csv"})
+
+    utils.prescan_uploads(resources)
+    assert clamd_config.commands.count("INSTREAM") == 2
+
+    utils.scan_file_for_viruses(resources[0])
+    with pytest.raises(utils.logic.ValidationError):
+        utils.scan_file_for_viruses(resources[1])
+    assert clamd_config.commands.count("INSTREAM") == 2
+
+
+@pytest.mark.ckan_config("ckanext.clamav.batch.concurrency", "1")
+def test_prescan_can_be_disabled(clamd_config):
+    utils.prescan_uploads([{"upload": file} for file in make_files(b"a", b"b")])
+
+    assert "INSTREAM" not in clamd_config.commands
@@ -0,0 +1,48 @@
+import pytest
+
+from ckanext.clamav.tests import benchmark
+from ckanext.clamav.tests.fake_clamd import FakeClamd
+
+
+@pytest.fixture()
+def tcp_clamd():
+    clamd = FakeClamd(stream_max_length=1024 * 1024)
+    yield clamd
+    clamd.close()
+
+
+def test_benchmark_over_unix_socket(fake_clamd):
+    fake_clamd.stream_max_length = 1024 * 1024
+
+    result = benchmark.run_benchmark(fake_clamd, 64 * 1024, 4, 20)
+
+    assert result.transport == "unix"
+    assert result.outcomes == {"OK": 20}
+    assert 0 < result.p50 <= result.p99
+    assert result.throughput > 0
+    assert result.peak_memory > 0
+
+
+def test_benchmark_with_errors_over_tcp(tcp_clamd):
+    tcp_clamd.error_rate = 1
+
+    result = benchmark.run_benchmark(tcp_clamd, 1024, 2, 10)
+
+    assert result.transport == "tcp"
+    assert result.outcomes == {"ERR_DISABLED": 10}
+
+
+def test_percentile():
+    values = [float(value) for value in range(1, 101)]
+
+    assert benchmark.percentile(values, 50) == 50
+    assert benchmark.percentile(values, 99) == 99
+    assert benchmark.percentile([], 99) == 0
+
+
+@pytest.mark.parametrize(
+    ("value", "size"),
+    [("512", 512), ("4KiB", 4096), ("1.5MiB", 1536 * 1024)],
+)
+def test_parse_size(value, size):
+    assert benchmark.parse_size(value) == size
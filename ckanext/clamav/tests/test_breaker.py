@@ -0,0 +1,104 @@
+from io import BytesIO
+from unittest.mock import patch
+
+import pytest
+from clamd import ConnectionError
+from werkzeug.datastructures import FileStorage as FlaskFileStorage
+
+from ckanext.clamav import router, utils
+from ckanext.clamav.breaker import BreakerStates
+
+clean_string = b"safe file content"
+
+
+def make_router(endpoint: router.Endpoint):
+    return router.Router(
+        [endpoint],
+        "least_outstanding",
+        max_failures=2,
+        ping_interval=0,
+        probe=lambda ep: None,
+        breaker_threshold=2,
+        breaker_reset_timeout=30,
+    )
+
+
+class TestCircuitBreaker:
+
+    def test_circuit_opens_after_consecutive_errors(self):
+        endpoint = router.parse_endpoint("tcp://clamd:3310")
+        clamd_router = make_router(endpoint)
+
+        clamd_router.report_failure(endpoint)
+        assert clamd_router.pick() is endpoint
+
+        clamd_router.report_failure(endpoint)
+        assert endpoint.breaker.state == BreakerStates.OPEN
+        assert clamd_router.pick() is None
+
+    def test_single_trial_is_let_through_after_timeout(self):
+        endpoint = router.parse_endpoint("tcp://clamd:3310")
+        clamd_router = make_router(endpoint)
+
+        with patch("ckanext.clamav.breaker.time.monotonic", return_value=0):
+            clamd_router.report_failure(endpoint)
+            clamd_router.report_failure(endpoint)
+
+        with patch("ckanext.clamav.breaker.time.monotonic", return_value=31):
+            assert clamd_router.pick() is endpoint
+            assert endpoint.breaker.state == BreakerStates.HALF_OPEN
+            assert clamd_router.pick() is None
+
+            clamd_router.report_success(endpoint)
+
+        assert endpoint.breaker.state == BreakerStates.CLOSED
+        assert clamd_router.pick() is endpoint
+
+    def test_failed_trial_opens_the_circuit_again(self):
+        endpoint = router.parse_endpoint("tcp://clamd:3310")
+        clamd_router = make_router(endpoint)
+
+        with patch("ckanext.clamav.breaker.time.monotonic", return_value=0):
+            clamd_router.report_failure(endpoint)
+            clamd_router.report_failure(endpoint)
+
+        with patch("ckanext.clamav.breaker.time.monotonic", return_value=31):
+            clamd_router.pick()
+            clamd_router.report_failure(endpoint)
+
+            assert endpoint.breaker.state == BreakerStates.OPEN
+            assert clamd_router.pick() is None
+
+    def test_unused_trial_is_given_back(self):
+        endpoint = router.parse_endpoint("tcp://clamd:3310")
+        clamd_router = make_router(endpoint)
+
+        with patch("ckanext.clamav.breaker.time.monotonic", return_value=0):
+            clamd_router.report_failure(endpoint)
+            clamd_router.report_failure(endpoint)
+
+        with patch("ckanext.clamav.breaker.time.monotonic", return_value=31):
+            clamd_router.pick()
+            clamd_router.release(endpoint)
+
+            assert endpoint.breaker.state == BreakerStates.HALF_OPEN
+            assert clamd_router.pick() is endpoint
+
+
+@pytest.mark.ckan_config("ckanext.clamav.socket_type", "unix")
+@pytest.mark.ckan_config("ckanext.clamav.socket_path", "/this/is/mocked")
+@pytest.mark.ckan_config("ckanext.clamav.router.ping_interval", "0")
+@pytest.mark.ckan_config("ckanext.clamav.breaker.enabled", "True")
+@pytest.mark.ckan_config("ckanext.clamav.breaker.failure_threshold", "2")
+class TestScanWithBreaker:
+
+    def test_open_circuit_skips_clamd(self):
+        with patch("ckanext.clamav.utils.CustomClamdUnixSocket") as mock_unix_socket:
+            mock_unix_socket.return_value.instream.side_effect = ConnectionError()
+
+            for _ in range(4):
+                file = FlaskFileStorage(BytesIO(clean_string), "safe.txt")
+                status, _ = utils._scan_filestream(file)
+                assert status == "ERR_DISABLED"
+
+        assert mock_unix_socket.return_value.instream.call_count == 2
@@ -0,0 +1,160 @@
+import socket
+import threading
+from io import BytesIO
+from unittest.mock import MagicMock, patch
+
+import pytest
+from clamd import ConnectionError
+from werkzeug.datastructures import FileStorage as FlaskFileStorage
+
+from ckanext.clamav import cache, router, utils
+
+clean_string = b"safe file content"
+
+
+@pytest.fixture()
+def reset_signature_version():
+    utils._signature_versions.clear()
+    yield
+    utils._signature_versions.clear()
+
+
+class TestVerdictCache:
+
+    def test_get_returns_stored_verdict(self):
+        verdict_cache = cache.VerdictCache(max_size=2, ttl=60)
+        verdict_cache.set("key", ("OK", None))
+
+        assert verdict_cache.get("key") == ("OK", None)
+        assert verdict_cache.get("missing") is None
+
+    def test_least_recently_used_entry_is_evicted(self):
+        verdict_cache = cache.VerdictCache(max_size=2, ttl=60)
+        verdict_cache.set("first", ("OK", None))
+        verdict_cache.set("second", ("OK", None))
+        verdict_cache.get("first")
+        verdict_cache.set("third", ("OK", None))
+
+        assert len(verdict_cache) == 2
+        assert verdict_cache.get("second") is None
+        assert verdict_cache.get("first") == ("OK", None)
+
+    def test_expired_entry_is_dropped(self):
+        verdict_cache = cache.VerdictCache(max_size=2, ttl=60)
+
+        with patch("ckanext.clamav.cache.time.monotonic", return_value=0):
+            verdict_cache.set("key", ("OK", None))
+
+        with patch("ckanext.clamav.cache.time.monotonic", return_value=61):
+            assert verdict_cache.get("key") is None
+
+        assert len(verdict_cache) == 0
+
+    def test_key_depends_on_signature_version(self):
+        assert cache.make_key("abc", "27000") != cache.make_key("abc", "27001")
+
+    def test_hash_stream_rewinds_the_stream(self):
+        stream = BytesIO(clean_string)
+
+        assert cache.hash_stream(stream)
+        assert stream.read() == clean_string
+
+
+@pytest.mark.usefixtures("reset_signature_version")
+@pytest.mark.ckan_config("ckanext.clamav.socket_type", "unix")
+@pytest.mark.ckan_config("ckanext.clamav.socket_path", "/this/is/mocked")
+@pytest.mark.ckan_config("ckanext.clamav.cache.enabled", "True")
+class TestScanWithVerdictCache:
+
+    def test_clean_cache_hit_skips_clamd(self):
+        with patch("ckanext.clamav.utils.CustomClamdUnixSocket") as mock_unix_socket:
+            mock_clamd = MagicMock()
+            mock_unix_socket.return_value = mock_clamd
+            mock_clamd.version.return_value = "ClamAV 1.0.0/27000/Mon Jan 1 2024"
+            mock_clamd.instream.return_value = {"stream": ("OK", None)}
+
+            cache.get_cache().clear()
+
+            for _ in range(2):
+                file = FlaskFileStorage(BytesIO(clean_string), "safe.txt")
+                assert utils._scan_filestream(file) == ("OK", None)
+
+            assert mock_clamd.instream.call_count == 1
+
+    def test_cache_hit_needs_no_connection(self):
+        with patch("ckanext.clamav.utils.CustomClamdUnixSocket") as mock_unix_socket:
+            mock_clamd = MagicMock()
+            mock_unix_socket.return_value = mock_clamd
+            mock_clamd.version.return_value = "ClamAV 1.0.0/27000/Mon Jan 1 2024"
+            mock_clamd.instream.return_value = {"stream": ("OK", None)}
+
+            cache.get_cache().clear()
+
+            file = FlaskFileStorage(BytesIO(clean_string), "safe.txt")
+            utils._scan_filestream(file)
+
+            # clamd is down, but the file is known
+            mock_unix_socket.reset_mock()
+            mock_unix_socket.side_effect = ConnectionError()
+
+            file = FlaskFileStorage(BytesIO(clean_string), "safe.txt")
+            assert utils._scan_filestream(file) == ("OK", None)
+            mock_unix_socket.assert_not_called()
+
+    def test_signature_update_invalidates_cached_verdict(self):
+        with patch("ckanext.clamav.utils.CustomClamdUnixSocket") as mock_unix_socket:
+            mock_clamd = MagicMock()
+            mock_unix_socket.return_value = mock_clamd
+            mock_clamd.version.return_value = "ClamAV 1.0.0/27000/Mon Jan 1 2024"
+            mock_clamd.instream.return_value = {"stream": ("OK", None)}
+
+            cache.get_cache().clear()
+
+            file = FlaskFileStorage(BytesIO(clean_string), "safe.txt")
+            utils._scan_filestream(file)
+
+            utils._signature_versions.clear()
+            mock_clamd.version.return_value = "ClamAV 1.0.0/27001/Tue Jan 2 2024"
+
+            file = FlaskFileStorage(BytesIO(clean_string), "safe.txt")
+            utils._scan_filestream(file)
+
+            assert mock_clamd.instream.call_count == 2
+
+
+@pytest.mark.usefixtures("reset_signature_version")
+def test_slow_endpoint_does_not_block_others():
+    slow = router.Endpoint(socket.AF_UNIX, "/slow.sock")
+    fast = router.Endpoint(socket.AF_UNIX, "/fast.sock")
+    entered, released = threading.Event(), threading.Event()
+
+    def slow_version():
+        entered.set()
+        released.wait(5)
+        return "ClamAV 1.0.0/26000/Mon Jan 1 2024"
+
+    slow_clamd = MagicMock()
+    slow_clamd.version.side_effect = slow_version
+    fast_clamd = MagicMock()
+    fast_clamd.version.return_value = "ClamAV 1.0.0/27000/Mon Jan 1 2024"
+
+    slow_thread = threading.Thread(
+        target=utils._get_clamd_version,
+        args=(slow, slow_clamd),
+    )
+    fast_thread = threading.Thread(
+        target=utils._get_clamd_version,
+        args=(fast, fast_clamd),
+    )
+    try:
+        slow_thread.start()
+        assert entered.wait(5)
+
+        fast_thread.start()
+        fast_thread.join(1)
+        assert not fast_thread.is_alive()
+        assert utils._signature_versions[fast.name][1].startswith("ClamAV 1.0.0/27000")
+    finally:
+        released.set()
+        slow_thread.join()
+        fast_thread.join()
@@ -0,0 +1,83 @@
+import hashlib
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+from clamd import EICAR
+from werkzeug.datastructures import FileStorage as FlaskFileStorage
+
+from ckan.cli.cli import ckan
+from ckan.lib import uploader
+from ckan.tests import factories, helpers
+
+from ckanext.clamav import reputation
+from ckanext.clamav.cli import rescan
+
+clean_string = b"safe file content"
+
+
+def create_uploaded_resource(content: bytes):
+    user = factories.Sysadmin()
+    dataset = factories.Dataset(user=user)
+
+    resource = helpers.call_action(
+        "resource_create",
+        context={"user": user["name"], "ignore_auth": False},
+        package_id=dataset["id"],
+        url="",
+        upload=FlaskFileStorage(BytesIO(clean_string), "file.txt"),
+    )
+
+    # the file got infected after it had been scanned on upload
+    path = uploader.get_resource_uploader(resource).get_path(resource["id"])
+    with open(path, "wb") as f:
+        f.write(content)
+
+    return resource
+
+
+@pytest.mark.usefixtures("clean_db", "with_plugins", "clamd_storage")
+@pytest.mark.ckan_config("ckan.plugins", "clamav")
+class TestRescan:
+
+    def test_infected_resources_are_reported(self, cli):
+        create_uploaded_resource(clean_string)
+        infected = create_uploaded_resource(EICAR)
+
+        # `ckan clamav rescan` would reload the config without the fixtures
+        result = cli.invoke(rescan, ["--workers", "2"])
+
+        assert not result.exit_code, result.output
+        assert f"Resource {infected['id']} is infected" in result.output
+        assert "Clean: 1, infected: 1" in result.output
+
+    def test_rescan_resumes_from_checkpoint(self, cli, tmp_path: Path):
+        resources = sorted(
+            (create_uploaded_resource(clean_string) for _ in range(3)),
+            key=lambda resource: resource["id"],
+        )
+        checkpoint = tmp_path / "rescan.checkpoint"
+        checkpoint.write_text(resources[0]["id"])
+
+        result = cli.invoke(rescan, ["-c", str(checkpoint)])
+
+        assert not result.exit_code, result.output
+        assert "Clean: 2" in result.output
+        assert not checkpoint.exists()
+
+
+class TestBuildHashList:
+    def test_list_is_built_from_feeds(self, cli, tmp_path: Path):
+        digest = hashlib.sha256(EICAR).hexdigest()
+        feed = tmp_path / "feed.txt"
+        feed.write_text(f"# known samples\n{digest}  eicar.com\n")
+        output = tmp_path / "denylist"
+
+        result = cli.invoke(
+            ckan,
+            ["clamav", "build-hash-list", str(output), str(feed)],
+        )
+
+        assert not result.exit_code, result.output
+        assert "1 digests" in result.output
+        assert bytes.fromhex(digest) in reputation.HashList(str(output))
@@ -1,3 +1,6 @@
+import socket
+from unittest.mock import MagicMock
+
 import pytest
 
 from ckan.exceptions import CkanConfigurationException
@@ -51,3 +54,111 @@ class TestClamAVConfig:
         assert "Clamd: unsupported connection type" in str(excinfo.value), str(
             excinfo.value,
         )
+
+
+class TestSettings:
+
+    def test_settings_defaults(self):
+        settings = c.get_settings()
+
+        assert settings.endpoints == (
+            c.EndpointSettings(socket.AF_UNIX, "/var/run/clamav/clamd.ctl", 1),
+        )
+        assert settings.timeout == 60
+        assert settings.connect_timeout == 60
+        assert settings.idle_timeout == 60
+        assert settings.upload_unscanned
+
+    def test_settings_are_parsed_once(self):
+        assert c.get_settings() is c.get_settings()
+
+    def test_settings_are_immutable(self):
+        settings = c.get_settings()
+
+        with pytest.raises(AttributeError):
+            settings.timeout = 10  # type: ignore
+
+    def test_settings_are_built_on_configure(self, ckan_config, monkeypatch):
+        settings = c.get_settings()
+        monkeypatch.setitem(ckan_config, "ckanext.clamav.timeout.idle", "5")
+        assert c.get_settings() is settings
+
+        c.configure()
+
+        assert c.get_settings() is not settings
+        assert c.get_settings().idle_timeout == 5
+
+    def test_options_are_parsed_once(self, ckan_config, monkeypatch):
+        assert not c.tee_enabled()
+        monkeypatch.setitem(ckan_config, "ckanext.clamav.tee.enabled", "true")
+        assert not c.tee_enabled()
+
+        c.reset()
+
+        assert c.tee_enabled()
+
+    @pytest.mark.ckan_config("ckanext.clamav.cache.size", "many")
+    def test_configure_invalid_option(self):
+        with pytest.raises(CkanConfigurationException, match="many"):
+            c.configure()
+
+    @pytest.mark.ckan_config("ckanext.clamav.segmented.overlap", "0")
+    @pytest.mark.ckan_config("ckanext.clamav.segmented.window_size", "0")
+    def test_configure_invalid_segments(self):
+        with pytest.raises(CkanConfigurationException, match="overlap"):
+            c.configure()
+
+    @pytest.mark.ckan_config(
+        "ckanext.clamav.endpoints",
+        "unix:///tmp/clamd.ctl tcp://clamd:3310?weight=2",
+    )
+    def test_settings_endpoints(self):
+        assert c.get_settings().endpoints == (
+            c.EndpointSettings(socket.AF_UNIX, "/tmp/clamd.ctl", 1),
+            c.EndpointSettings(socket.AF_INET, ("clamd", 3310), 2),
+        )
+
+    @pytest.mark.ckan_config("ckanext.clamav.socket_type", "tcp")
+    @pytest.mark.ckan_config("ckanext.clamav.tcp.host", "clamd")
+    @pytest.mark.ckan_config("ckanext.clamav.tcp.port", "3310")
+    def test_settings_tcp_endpoint(self):
+        assert c.get_settings().endpoints == (
+            c.EndpointSettings(socket.AF_INET, ("clamd", 3310), 1),
+        )
+
+    @pytest.mark.ckan_config("ckanext.clamav.socket_type", "tcp")
+    def test_settings_tcp_endpoint_without_address(self):
+        with pytest.raises(CkanConfigurationException, match="host:port"):
+            c.get_settings()
+
+    @pytest.mark.ckan_config("ckanext.clamav.endpoints", "http://clamd")
+    def test_settings_invalid_endpoint(self):
+        with pytest.raises(CkanConfigurationException, match="unsupported endpoint"):
+            c.get_settings()
+
+    def test_declare_config_options(self):
+        declaration = MagicMock()
+        key = MagicMock()
+        key.from_string.side_effect = lambda value: value
+
+        c.declare_config_options(declaration, key)
+
+        declaration.declare_int.assert_any_call("ckanext.clamav.timeout", 60)
+        declaration.declare_bool.assert_any_call("ckanext.clamav.warm_up", False)
+        declaration.declare.assert_any_call("ckanext.clamav.timeout.floor", 10.0)
+        declaration.declare.assert_any_call("ckanext.clamav.tcp.host", None)
+        declaration.declare.assert_any_call("ckanext.clamav.tcp.port", None)
+        declaration.declare.return_value.set_validators.assert_any_call(
+            "ignore_empty int_validator",
+        )
+        declared = {
+            call.args[0]
+            for method in (
+                declaration.declare,
+                declaration.declare_bool,
+                declaration.declare_int,
+            )
+            for call in method.call_args_list
+        }
+        assert c.CLAMAV_CONF_SOCKET_TYPE_DF not in declared
+        assert c.CLAMAV_CONF_WARM_UP in declared
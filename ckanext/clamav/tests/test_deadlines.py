@@ -0,0 +1,102 @@
+import socket
+import time
+from io import BytesIO
+
+import pytest
+from werkzeug.datastructures import FileStorage as FlaskFileStorage
+
+from ckanext.clamav import deadlines, router, utils
+
+MiB = 1024 * 1024
+
+
+class TestThroughputModel:
+    def test_moving_average(self):
+        model = deadlines.ThroughputModel(10 * MiB, 0.5)
+        assert model.estimate("clamd") == 10 * MiB
+
+        model.observe("clamd", 100 * MiB, 1)
+        assert model.estimate("clamd") == 100 * MiB
+
+        model.observe("clamd", 50 * MiB, 1)
+        assert model.estimate("clamd") == 75 * MiB
+        assert model.estimate("another") == 10 * MiB
+
+    def test_small_files_are_not_observed(self):
+        model = deadlines.ThroughputModel(10 * MiB, 0.5)
+
+        model.observe("clamd", 1024, 0.001)
+
+        assert model.estimate("clamd") == 10 * MiB
+
+
+@pytest.mark.ckan_config("ckanext.clamav.timeout.floor", "5")
+@pytest.mark.ckan_config("ckanext.clamav.timeout.ceiling", "600")
+def test_total_timeout_depends_on_size():
+    endpoint = "unix:///learned.ctl"
+    deadlines.get_model().observe(endpoint, 100 * MiB, 1)
+
+    assert deadlines.get_total_timeout(endpoint, 1024) == 5
+    assert deadlines.get_total_timeout(endpoint, 1024 * MiB) == pytest.approx(
+        1024 / 100 * deadlines.SAFETY_FACTOR,
+    )
+    assert deadlines.get_total_timeout(endpoint, 100 * 1024 * MiB) == 600
+    assert deadlines.get_total_timeout(endpoint, None) == 600
+
+
+def test_timeouts_default_to_the_connection_timeout():
+    conn = utils._get_conn(router.Endpoint(socket.AF_UNIX, "/clamd.ctl"))
+
+    assert conn.timeout == 60
+    assert conn.connect_timeout == 60
+
+
+@pytest.mark.ckan_config("ckanext.clamav.timeout.connect", "2")
+@pytest.mark.ckan_config("ckanext.clamav.timeout.idle", "15")
+def test_separate_timeouts():
+    conn = utils._get_conn(router.Endpoint(socket.AF_UNIX, "/clamd.ctl"))
+
+    assert conn.timeout == 15
+    assert conn.connect_timeout == 2
+
+
+@pytest.mark.ckan_config("ckanext.clamav.timeout.adaptive", "true")
+@pytest.mark.ckan_config("ckanext.clamav.timeout.floor", "0.3")
+@pytest.mark.ckan_config("ckanext.clamav.timeout.ceiling", "0.5")
+class TestAdaptiveDeadline:
+    @pytest.fixture()
+    def clamd_config(self, fake_clamd, ckan_config, monkeypatch):
+        fake_clamd.stream_max_length = MiB
+        monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_type", "unix")
+        monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_path", fake_clamd.path)
+        return fake_clamd
+
+    def test_scan_within_deadline(self, clamd_config):
+        file = FlaskFileStorage(BytesIO(b"safe file content"), "file.txt")
+
+        assert utils._scan_filestream(file) == ("OK", None)
+
+    def test_stalled_scan_fails_at_deadline(self, clamd_config):
+        # the scan takes about 3 seconds
+        content = b"x" * 4096
+        clamd_config.byte_latency = 3 / len(content)
+
+        started_at = time.monotonic()
+        status, _ = utils._scan_filestream(FlaskFileStorage(BytesIO(content), "f"))
+
+        assert status == "ERR_DISABLED"
+        assert time.monotonic() - started_at < 1.5
+
+    def test_pooled_session_gets_idle_timeout_back(self, clamd_config, ckan_config, monkeypatch):
+        monkeypatch.setitem(ckan_config, "ckanext.clamav.pool.enabled", "True")
+        monkeypatch.setitem(ckan_config, "ckanext.clamav.timeout.idle", "20")
+        endpoint = router.Endpoint(socket.AF_UNIX, clamd_config.path)
+
+        for _ in range(2):
+            file = FlaskFileStorage(BytesIO(b"safe file content"), "file.txt")
+            assert utils._scan_filestream(file) == ("OK", None)
+
+            session = utils.get_pool(endpoint)._idle[0]
+            assert session._get_socket().gettimeout() == 20
+
+        assert utils.get_pool(endpoint).stats()["misses"] == 1
@@ -0,0 +1,79 @@
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+from clamd import EICAR
+from werkzeug.datastructures import FileStorage as FlaskFileStorage
+
+from ckanext.clamav import utils
+
+clean_string = b"safe file content"
+
+
+@pytest.fixture()
+def clamd_config(fake_clamd, ckan_config, monkeypatch):
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_type", "unix")
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_path", fake_clamd.path)
+    return fake_clamd
+
+
+def write_file(path: Path, content: bytes) -> Path:
+    path.write_bytes(content)
+    return path
+
+
+@pytest.mark.ckan_config("ckanext.clamav.fildes.enabled", "True")
+class TestFildes:
+
+    @pytest.mark.parametrize("pool_enabled", ["False", "True"])
+    def test_file_on_disk_is_passed_by_descriptor(
+        self, clamd_config, tmp_path: Path, ckan_config, monkeypatch, pool_enabled,
+    ):
+        monkeypatch.setitem(ckan_config, "ckanext.clamav.pool.enabled", pool_enabled)
+        path = write_file(tmp_path / "infected.txt", EICAR)
+
+        with open(path, "rb") as f:
+            file = FlaskFileStorage(f, "infected.txt")
+
+            assert utils._scan_filestream(file) == ("FOUND", "Win.Test.EICAR_HDB-1")
+            assert f.tell() == 0
+
+        assert "FILDES" in clamd_config.commands
+        assert "INSTREAM" not in clamd_config.commands
+
+    def test_in_memory_file_is_streamed(self, clamd_config):
+        file = FlaskFileStorage(BytesIO(clean_string), "safe.txt")
+
+        assert utils._scan_filestream(file) == ("OK", None)
+        assert clamd_config.commands == ["INSTREAM"]
+
+
+class TestSharedScanDir:
+
+    def test_file_in_shared_dir_is_scanned_by_path(
+        self, clamd_config, tmp_path: Path, ckan_config, monkeypatch,
+    ):
+        monkeypatch.setitem(ckan_config, "ckanext.clamav.shared_scan_dir", str(tmp_path))
+        path = write_file(tmp_path / "safe.txt", clean_string)
+
+        with open(path, "rb") as f:
+            file = FlaskFileStorage(f, "safe.txt")
+            assert utils._scan_filestream(file) == ("OK", None)
+
+        assert clamd_config.commands == ["SCAN"]
+
+    def test_file_outside_shared_dir_is_streamed(
+        self, clamd_config, tmp_path: Path, ckan_config, monkeypatch,
+    ):
+        shared_dir = tmp_path / "shared"
+        shared_dir.mkdir()
+        monkeypatch.setitem(
+            ckan_config, "ckanext.clamav.shared_scan_dir", str(shared_dir),
+        )
+        path = write_file(tmp_path / "safe.txt", clean_string)
+
+        with open(path, "rb") as f:
+            file = FlaskFileStorage(f, "safe.txt")
+            assert utils._scan_filestream(file) == ("OK", None)
+
+        assert clamd_config.commands == ["INSTREAM"]
@@ -0,0 +1,103 @@
+import socket
+import subprocess
+import sys
+from io import BytesIO
+from unittest.mock import patch
+
+import pytest
+from werkzeug.datastructures import FileStorage as FlaskFileStorage
+
+from ckanext.clamav import metrics, utils
+
+
+@pytest.fixture()
+def clamd_config(fake_clamd, ckan_config, monkeypatch):
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_type", "unix")
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_path", fake_clamd.path)
+    return fake_clamd
+
+
+@pytest.fixture()
+def statsd_server():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.settimeout(1)
+    yield sock
+    sock.close()
+
+
+@pytest.mark.ckan_config("ckanext.clamav.metrics.exporter", "prometheus")
+def test_prometheus_exporter_renders_the_scan(clamd_config):
+    file = FlaskFileStorage(BytesIO(b"safe file content"), "safe.txt")
+
+    assert utils._scan_filestream(file) == ("OK", None)
+
+    text = metrics.get_exporter().render()
+    endpoint = f'endpoint="unix://{clamd_config.path}"'
+    assert 'clamav_scans_total{status="OK"} 1' in text
+    assert 'clamav_scan_duration_seconds_count{size="1MiB"} 1' in text
+    assert 'clamav_scans_in_flight 0' in text
+    assert f"clamav_connect_seconds_count{{{endpoint}}} 1" in text
+    assert f"clamav_stream_bytes_per_second_count{{{endpoint}}} 1" in text
+
+
+def test_prometheus_multiprocess_metrics_are_summed(tmp_path):
+    stopped = subprocess.Popen([sys.executable, "-c", ""])
+    stopped.wait()
+    with patch("os.getpid", return_value=stopped.pid):
+        other = metrics.PrometheusExporter(str(tmp_path))
+        other.increment(metrics.SCANS_TOTAL, (("status", "OK"),))
+        # the process is gone in the middle of a scan
+        other.add(metrics.SCANS_IN_FLIGHT, 1)
+    exporter = metrics.PrometheusExporter(str(tmp_path))
+    exporter.increment(metrics.SCANS_TOTAL, (("status", "OK"),))
+    exporter.add(metrics.SCANS_IN_FLIGHT, 1)
+    exporter.add(metrics.SCANS_IN_FLIGHT, -1)
+
+    text = exporter.render()
+
+    assert 'clamav_scans_total{status="OK"} 2' in text
+    assert "clamav_scans_in_flight 0" in text
+
+
+@pytest.mark.ckan_config("ckanext.clamav.metrics.exporter", "prometheus")
+@pytest.mark.ckan_config("ckanext.clamav.socket_type", "unix")
+@pytest.mark.ckan_config("ckanext.clamav.socket_path", "/nonexistent/clamd.ctl")
+def test_connection_errors_are_counted():
+    file = FlaskFileStorage(BytesIO(b"safe file content"), "safe.txt")
+
+    status, _ = utils._scan_filestream(file)
+
+    text = metrics.get_exporter().render()
+    assert status == "ERR_DISABLED"
+    assert (
+        'clamav_connection_errors_total{endpoint="unix:///nonexistent/clamd.ctl"} 1'
+        in text
+    )
+    assert 'clamav_scans_total{status="ERR_DISABLED"} 1' in text
+
+
+def test_statsd_exporter_sends_datagrams(ckan_config, monkeypatch, statsd_server):
+    host, port = statsd_server.getsockname()
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.metrics.exporter", "statsd")
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.metrics.statsd.host", host)
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.metrics.statsd.port", str(port))
+
+    metrics.observe_scan("FOUND", 2 * 1024 * 1024, 0.5)
+
+    assert statsd_server.recv(1024) == b"clamav.scans_total.FOUND:1|c"
+    assert statsd_server.recv(1024) == b"clamav.scan_duration_ms.10MiB:500|ms"
+
+
+def test_histogram_buckets_are_cumulative():
+    exporter = metrics.PrometheusExporter()
+
+    for value in (0.002, 0.002, 3):
+        exporter.observe(metrics.CONNECT_SECONDS, value)
+
+    text = exporter.render()
+    assert 'clamav_connect_seconds_bucket{le="0.001"} 0' in text
+    assert 'clamav_connect_seconds_bucket{le="0.005"} 2' in text
+    assert 'clamav_connect_seconds_bucket{le="5"} 3' in text
+    assert 'clamav_connect_seconds_bucket{le="+Inf"} 3' in text
+    assert "clamav_connect_seconds_sum 3.004" in text
@@ -35,8 +35,8 @@ class TestMockClamAVLimitTesting:
     def test_clamav_hit_file_limit_error_throw_validation_error(
         self, eicar_file_path: Path,
     ):
-        with patch("ckanext.clamav.utils.ClamdUnixSocket") as mock_unix_socket:
-            # Make the instance that gets returned by ClamdUnixSocket()
+        with patch("ckanext.clamav.utils.CustomClamdUnixSocket") as mock_unix_socket:
+            # Make the instance that gets returned by CustomClamdUnixSocket()
             mock_clamd = MagicMock()
             mock_unix_socket.return_value = mock_clamd
             mock_clamd.instream.side_effect = BufferTooLongError()
@@ -70,8 +70,8 @@ class TestMockClamAVLimitTesting:
 
     @pytest.mark.ckan_config("ckanext.clamav.upload_unscanned", "True")
     def test_clamav_hit_file_limit_error_allow_unscanned(self, eicar_file_path: Path):
-        with patch("ckanext.clamav.utils.ClamdUnixSocket") as mock_unix_socket:
-            # Make the instance that gets returned by ClamdUnixSocket()
+        with patch("ckanext.clamav.utils.CustomClamdUnixSocket") as mock_unix_socket:
+            # Make the instance that gets returned by CustomClamdUnixSocket()
             mock_clamd = MagicMock()
             mock_unix_socket.return_value = mock_clamd
 
@@ -98,8 +98,8 @@ class TestMockClamAVLimitTesting:
 
     @pytest.mark.ckan_config("ckanext.clamav.upload_unscanned", "True")
     def test_clamav_connection_error_allow_unscanned(self, eicar_file_path: Path):
-        with patch("ckanext.clamav.utils.ClamdUnixSocket") as mock_unix_socket:
-            # Make the instance that gets returned by ClamdUnixSocket()
+        with patch("ckanext.clamav.utils.CustomClamdUnixSocket") as mock_unix_socket:
+            # Make the instance that gets returned by CustomClamdUnixSocket()
             mock_clamd = MagicMock()
             mock_unix_socket.return_value = mock_clamd
 
@@ -1,4 +1,6 @@
 import os
+import uuid
+from io import BytesIO
 from pathlib import Path
 
 import pytest
@@ -54,3 +56,59 @@ class TestUploadedUnscannedFlag:
             assert "eicar.com.txt" in str(
                 res,
             ), res  # provide nice message if we did not throw exception
+
+
+@pytest.mark.usefixtures("clean_db", "with_plugins", "clamd_storage")
+@pytest.mark.ckan_config("ckan.plugins", "clamav")
+@pytest.mark.ckan_config("ckanext.clamav.chunked.enabled", "True")
+class TestChunkedUpload:
+
+    content = b"safe file content" * 10
+
+    def send_chunk(self, app, action, resource_id, start, end, **data):
+        user = factories.Sysadmin()
+        content_range = f"bytes {start}-{end - 1}/{len(self.content)}"
+
+        with app.flask_app.test_request_context(
+            headers={"Content-Range": content_range},
+        ):
+            return helpers.call_action(
+                action,
+                context={"user": user["name"], "ignore_auth": False},
+                id=resource_id,
+                url="",
+                upload=FlaskFileStorage(BytesIO(self.content[start:end]), "chunked.bin"),
+                **data,
+            )
+
+    def test_chunk_is_not_stored(self, app, tmp_path: Path):
+        dataset = factories.Dataset()
+        resource_id = str(uuid.uuid4())
+
+        self.send_chunk(
+            app,
+            "resource_create",
+            resource_id,
+            0,
+            100,
+            package_id=dataset["id"],
+        )
+
+        assert not [path for path in tmp_path.rglob("*") if path.is_file()]
+
+    def test_complete_file_is_stored(self, app, tmp_path: Path):
+        dataset = factories.Dataset()
+        resource_id = str(uuid.uuid4())
+
+        self.send_chunk(
+            app,
+            "resource_create",
+            resource_id,
+            0,
+            100,
+            package_id=dataset["id"],
+        )
+        self.send_chunk(app, "resource_update", resource_id, 100, len(self.content))
+
+        stored = tmp_path / "resources" / resource_id[:3] / resource_id[3:6] / resource_id[6:]
+        assert stored.read_bytes() == self.content
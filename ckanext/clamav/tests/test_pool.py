@@ -0,0 +1,114 @@
+import socket
+from io import BytesIO
+
+import pytest
+from clamd import EICAR, BufferTooLongError
+
+from ckanext.clamav import pool, router, utils
+from ckanext.clamav.tests.fake_clamd import FakeClamd
+
+clean_string = b"safe file content"
+
+
+def make_pool(path: str, **kwargs) -> pool.ConnectionPool:
+    options = {"min_size": 1, "max_size": 2, "idle_timeout": 20}
+    options.update(kwargs)
+    return pool.ConnectionPool(socket.AF_UNIX, path, 5, **options)
+
+
+class TestClamdSession:
+
+    def test_session_commands(self, clamd_socket: str):
+        session = pool.ClamdSession(socket.AF_UNIX, clamd_socket, 5)
+        session.open()
+
+        assert session.ping() == "PONG"
+        assert session.version().startswith("ClamAV")
+        assert session.instream(BytesIO(clean_string)) == {"stream": ("OK", None)}
+        assert session.instream(BytesIO(EICAR)) == {
+            "stream": ("FOUND", "Win.Test.EICAR_HDB-1"),
+        }
+
+        session.close()
+
+    def test_session_stream_limit(self, clamd_socket: str):
+        session = pool.ClamdSession(socket.AF_UNIX, clamd_socket, 5)
+        session.open()
+
+        with pytest.raises(BufferTooLongError):
+            session.instream(BytesIO(b"x" * 1024 * 1024))
+
+
+class TestConnectionPool:
+
+    def test_sessions_are_reused(self, clamd_socket: str):
+        connection_pool = make_pool(clamd_socket)
+
+        for _ in range(3):
+            with connection_pool.session() as session:
+                session.instream(BytesIO(clean_string))
+
+        stats = connection_pool.stats()
+        assert stats["size"] == 1
+        assert stats["misses"] == 1
+        assert stats["hits"] == 2
+
+    def test_broken_session_is_discarded(self, clamd_socket: str):
+        connection_pool = make_pool(clamd_socket)
+
+        with pytest.raises(BufferTooLongError):
+            with connection_pool.session() as session:
+                session.instream(BytesIO(b"x" * 1024 * 1024))
+
+        assert connection_pool.stats()["size"] == 0
+
+    def test_idle_sessions_are_evicted(self, clamd_socket: str):
+        connection_pool = make_pool(clamd_socket, min_size=0, idle_timeout=0)
+
+        with connection_pool.session():
+            pass
+
+        with connection_pool.session():
+            pass
+
+        assert connection_pool.stats()["misses"] == 2
+
+    def test_prefill(self, clamd_socket: str):
+        connection_pool = make_pool(clamd_socket, min_size=2)
+        connection_pool.prefill()
+
+        assert connection_pool.stats()["idle"] == 2
+
+
+class TestWarmUp:
+
+    @pytest.fixture(autouse=True)
+    def clamd_config(self, ckan_config, monkeypatch, clamd_socket: str):
+        monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_type", "unix")
+        monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_path", clamd_socket)
+        monkeypatch.setitem(ckan_config, "ckanext.clamav.router.ping_interval", "0")
+        utils._signature_versions.clear()
+        yield
+        utils._signature_versions.clear()
+
+    def test_warm_up_checks_version(self, fake_clamd: FakeClamd):
+        utils.warm_up()
+
+        assert any(command.endswith("VERSION") for command in fake_clamd.commands)
+        assert utils._signature_versions
+
+    def test_warm_up_fills_pool(self, ckan_config, monkeypatch, clamd_socket: str):
+        monkeypatch.setitem(ckan_config, "ckanext.clamav.pool.enabled", "True")
+        monkeypatch.setitem(ckan_config, "ckanext.clamav.pool.min_size", "2")
+
+        utils.warm_up()
+
+        endpoint = router.Endpoint(socket.AF_UNIX, clamd_socket)
+        assert utils.get_pool(endpoint).stats()["idle"] == 2
+
+    def test_warm_up_tolerates_missing_clamd(self, ckan_config, monkeypatch):
+        monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_path", "/missing")
+
+        utils.warm_up()
+
+        assert not utils._signature_versions
@@ -0,0 +1,54 @@
+from io import BytesIO
+from unittest.mock import patch
+
+import pytest
+from werkzeug.datastructures import FileStorage as FlaskFileStorage
+
+import ckan.plugins.toolkit as tk
+from ckan.tests import factories, helpers
+
+clean_string = b"safe file content"
+
+
+def make_resources(count: int):
+    return [
+        {
+            "url": "",
+            "upload": FlaskFileStorage(BytesIO(clean_string), f"file-{number}.txt"),
+        }
+        for number in range(count)
+    ]
+
+
+@pytest.mark.usefixtures("with_plugins", "clean_db", "clean_index", "clamd_storage")
+@pytest.mark.ckan_config("ckan.plugins", "clamav")
+class TestPrescanActions:
+
+    def test_uploads_of_a_new_dataset_are_prescanned(self):
+        user = factories.Sysadmin()
+
+        with patch("ckanext.clamav.utils.prescan_uploads") as mock_prescan:
+            helpers.call_action(
+                "package_create",
+                context={"user": user["name"], "ignore_auth": False},
+                name="prescanned",
+                resources=make_resources(2),
+            )
+
+        mock_prescan.assert_called_once()
+        assert len(mock_prescan.call_args[0][0]) == 2
+
+    def test_unauthorized_uploads_are_not_scanned(self, clamd_storage):
+        dataset = factories.Dataset()
+        user = factories.User()
+
+        with pytest.raises(tk.NotAuthorized):
+            helpers.call_action(
+                "package_update",
+                context={"user": user["name"], "ignore_auth": False},
+                id=dataset["id"],
+                name=dataset["name"],
+                resources=make_resources(2),
+            )
+
+        assert "INSTREAM" not in clamd_storage.commands
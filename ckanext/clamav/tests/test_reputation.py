@@ -0,0 +1,155 @@
+import hashlib
+import io
+import os
+from io import BytesIO
+
+import pytest
+from clamd import EICAR
+from werkzeug.datastructures import FileStorage as FlaskFileStorage
+
+from ckanext.clamav import reputation, utils
+
+clean_string = b"safe file content"
+bad_string = b"known bad file content"
+
+
+def sha256(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+@pytest.fixture()
+def make_list(tmp_path):
+    def make(name: str, *contents: bytes) -> str:
+        path = str(tmp_path / name)
+        reputation.build(path, [bytes.fromhex(sha256(c)) for c in contents])
+        return path
+
+    return make
+
+
+@pytest.fixture()
+def clamd_config(fake_clamd, ckan_config, monkeypatch):
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_type", "unix")
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_path", fake_clamd.path)
+    return fake_clamd
+
+
+class TestHashList:
+    def test_membership(self, tmp_path):
+        digests = [os.urandom(32) for _ in range(1000)]
+        path = str(tmp_path / "list")
+
+        assert reputation.build(path, digests + digests[:10]) == 1000
+
+        hash_list = reputation.HashList(path)
+        assert len(hash_list) == 1000
+        assert all(digest in hash_list for digest in digests)
+        assert not any(os.urandom(32) in hash_list for _ in range(1000))
+
+    def test_filter_rejects_most_unknown_digests(self, tmp_path):
+        path = str(tmp_path / "list")
+        reputation.build(path, (os.urandom(32) for _ in range(10000)), 0.01)
+
+        hash_list = reputation.HashList(path)
+        hits = sum(hash_list.might_contain(os.urandom(32)) for _ in range(10000))
+
+        assert hits < 300
+
+    def test_empty_list(self, tmp_path):
+        path = str(tmp_path / "list")
+        reputation.build(path, [])
+
+        assert os.urandom(32) not in reputation.HashList(path)
+
+    def test_invalid_file(self, tmp_path):
+        path = tmp_path / "list"
+        path.write_bytes(b"not a hash list" * 10)
+
+        with pytest.raises(reputation.HashListError):
+            reputation.HashList(str(path))
+        assert reputation.get_hash_list(str(path)) is None
+
+    def test_rebuilt_list_is_remapped(self, make_list):
+        path = make_list("list", clean_string)
+        assert reputation.get_hash_list(path).size == 1
+
+        make_list("list", clean_string, bad_string)
+        assert reputation.get_hash_list(path).size == 2
+
+
+def test_read_feed():
+    feed = io.StringIO(
+        "# comment\n"
+        "\n"
+        f"{sha256(clean_string)}  clean.txt\n"
+        f"{sha256(bad_string).upper()}:22:Bad.File\n"
+        f"{hashlib.md5(bad_string).hexdigest()}:22:Bad.File\n"
+        f"{'z' * 64}\n",
+    )
+
+    assert list(reputation.read_feed(feed)) == [
+        bytes.fromhex(sha256(clean_string)),
+        bytes.fromhex(sha256(bad_string)),
+    ]
+
+
+class TestScan:
+    def test_denylisted_file_is_rejected_without_clamd(
+        self,
+        clamd_config,
+        make_list,
+        ckan_config,
+        monkeypatch,
+    ):
+        monkeypatch.setitem(
+            ckan_config,
+            "ckanext.clamav.reputation.denylist",
+            make_list("denylist", bad_string),
+        )
+        file = FlaskFileStorage(BytesIO(bad_string), "bad.txt")
+
+        with pytest.raises(utils.logic.ValidationError, match="Denylist"):
+            utils.scan_file_for_viruses({"upload": file})
+
+        assert not clamd_config.commands
+        assert file.stream.read() == bad_string
+
+    def test_allowlisted_file_is_accepted_without_clamd(
+        self,
+        clamd_config,
+        make_list,
+        ckan_config,
+        monkeypatch,
+    ):
+        monkeypatch.setitem(
+            ckan_config,
+            "ckanext.clamav.reputation.allowlist",
+            make_list("allowlist", EICAR),
+        )
+
+        utils.scan_file_for_viruses(
+            {"upload": FlaskFileStorage(BytesIO(EICAR), "eicar.txt")},
+        )
+
+        assert not clamd_config.commands
+
+    def test_unlisted_file_is_scanned(
+        self,
+        clamd_config,
+        make_list,
+        ckan_config,
+        monkeypatch,
+    ):
+        monkeypatch.setitem(
+            ckan_config,
+            "ckanext.clamav.reputation.denylist",
+            make_list("denylist", bad_string),
+        )
+
+        report = utils.scan_with_report(
+            FlaskFileStorage(BytesIO(clean_string), "clean.txt"),
+        )
+
+        assert report.status == "OK"
+        assert report.content_hash == sha256(clean_string)
+        assert "INSTREAM" in clamd_config.commands
@@ -0,0 +1,77 @@
+from io import BytesIO
+
+import pytest
+from werkzeug.datastructures import FileStorage as FlaskFileStorage
+
+import ckan.plugins.toolkit as tk
+from ckan.tests import factories, helpers
+
+from ckanext.clamav.model import ScanResult
+
+clean_string = b"safe file content"
+
+
+def create_uploaded_resource(content: bytes = clean_string):
+    user = factories.Sysadmin()
+    dataset = factories.Dataset(user=user)
+
+    return helpers.call_action(
+        "resource_create",
+        context={"user": user["name"], "ignore_auth": False},
+        package_id=dataset["id"],
+        url="",
+        upload=FlaskFileStorage(BytesIO(content), "safe.txt"),
+    )
+
+
+@pytest.mark.usefixtures("with_plugins", "clean_db", "clamd_storage")
+@pytest.mark.ckan_config("ckan.plugins", "clamav")
+@pytest.mark.ckan_config("ckanext.clamav.results.enabled", "True")
+class TestScanResults:
+
+    def test_upload_result_is_recorded(self):
+        resource = create_uploaded_resource()
+
+        result = helpers.call_action("clamav_scan_status", id=resource["id"])
+
+        assert result["status"] == "OK"
+        assert result["signature"] is None
+        assert result["engine_version"] == "ClamAV 1.0.0"
+        assert result["db_version"] == 27000
+        assert result["size"] == len(clean_string)
+        assert len(result["content_hash"]) == 64
+        assert result["duration"] >= 0
+
+    def test_missing_result(self):
+        resource = factories.Resource()
+
+        with pytest.raises(tk.ObjectNotFound):
+            helpers.call_action("clamav_scan_status", id=resource["id"])
+
+    def test_list_keeps_the_latest_result_per_resource(self):
+        first = create_uploaded_resource()
+        second = create_uploaded_resource()
+        ScanResult.record(first["id"], status="FOUND", signature="Eicar-Signature")
+
+        result = helpers.call_action(
+            "clamav_scan_status_list",
+            ids=[first["id"], second["id"]],
+        )
+
+        assert result["count"] == 2
+        assert [r["resource_id"] for r in result["results"]] == [
+            first["id"],
+            second["id"],
+        ]
+
+        infected = helpers.call_action("clamav_scan_status_list", status="FOUND")
+        assert [r["resource_id"] for r in infected["results"]] == [first["id"]]
+
+    def test_list_is_for_sysadmins(self):
+        user = factories.User()
+
+        with pytest.raises(tk.NotAuthorized):
+            helpers.call_action(
+                "clamav_scan_status_list",
+                context={"user": user["name"], "ignore_auth": False},
+            )
@@ -0,0 +1,136 @@
+import socket
+from collections import Counter
+from io import BytesIO
+from unittest.mock import MagicMock, patch
+
+import pytest
+from clamd import ConnectionError
+from werkzeug.datastructures import FileStorage as FlaskFileStorage
+
+from ckan.exceptions import CkanConfigurationException
+
+from ckanext.clamav import router, utils
+
+clean_string = b"safe file content"
+
+
+def make_router(*endpoints: router.Endpoint, strategy: str = "least_outstanding"):
+    return router.Router(
+        list(endpoints),
+        strategy,
+        max_failures=2,
+        ping_interval=0,
+        probe=lambda ep: None,
+    )
+
+
+class TestEndpoint:
+
+    def test_parse_unix_endpoint(self):
+        endpoint = router.parse_endpoint("unix:///var/run/clamav/clamd.ctl")
+
+        assert endpoint.family == socket.AF_UNIX
+        assert endpoint.address == "/var/run/clamav/clamd.ctl"
+        assert endpoint.weight == 1
+
+    def test_parse_tcp_endpoint(self):
+        endpoint = router.parse_endpoint("tcp://clamd:3310?weight=3")
+
+        assert endpoint.family == socket.AF_INET
+        assert endpoint.address == ("clamd", 3310)
+        assert endpoint.weight == 3
+
+    @pytest.mark.parametrize("value", ["clamd:3310", "tcp://clamd", "http://clamd:80"])
+    def test_parse_invalid_endpoint(self, value: str):
+        with pytest.raises(CkanConfigurationException):
+            router.parse_endpoint(value)
+
+
+class TestRouter:
+
+    def test_least_outstanding(self):
+        first = router.parse_endpoint("tcp://first:3310")
+        second = router.parse_endpoint("tcp://second:3310")
+        clamd_router = make_router(first, second)
+
+        with clamd_router.track(first):
+            assert clamd_router.pick() is second
+
+    def test_weighted_round_robin(self):
+        first = router.parse_endpoint("tcp://first:3310?weight=3")
+        second = router.parse_endpoint("tcp://second:3310")
+        clamd_router = make_router(first, second, strategy="round_robin")
+
+        picked = Counter(clamd_router.pick().name for _ in range(8))
+
+        assert picked == {first.name: 6, second.name: 2}
+
+    def test_failing_endpoint_is_ejected(self):
+        first = router.parse_endpoint("tcp://first:3310")
+        second = router.parse_endpoint("tcp://second:3310")
+        clamd_router = make_router(first, second)
+
+        clamd_router.report_failure(first)
+        assert first.healthy
+
+        clamd_router.report_failure(first)
+        assert not first.healthy
+        assert {clamd_router.pick() for _ in range(4)} == {second}
+
+        clamd_router.report_success(first)
+        assert first.healthy
+
+    def test_ejected_endpoints_are_used_as_last_resort(self):
+        first = router.parse_endpoint("tcp://first:3310")
+        second = router.parse_endpoint("tcp://second:3310")
+        clamd_router = make_router(first, second)
+
+        for _ in range(2):
+            clamd_router.report_failure(first)
+            clamd_router.report_failure(second)
+
+        assert clamd_router.pick() in (first, second)
+        assert clamd_router.pick(exclude=[first, second]) is None
+
+    def test_unknown_strategy(self):
+        with pytest.raises(CkanConfigurationException):
+            make_router(router.parse_endpoint("tcp://first:3310"), strategy="random")
+
+
+@pytest.mark.ckan_config(
+    "ckanext.clamav.endpoints",
+    "unix:///first/clamd.ctl unix:///second/clamd.ctl",
+)
+@pytest.mark.ckan_config("ckanext.clamav.router.ping_interval", "0")
+class TestScanRetries:
+
+    def test_scan_is_retried_on_another_endpoint(self):
+        broken_clamd = MagicMock()
+        broken_clamd.instream.side_effect = ConnectionError()
+        working_clamd = MagicMock()
+        working_clamd.instream.return_value = {"stream": ("OK", None)}
+
+        clamd_by_path = {
+            "/first/clamd.ctl": broken_clamd,
+            "/second/clamd.ctl": working_clamd,
+        }
+
+        with patch("ckanext.clamav.utils.CustomClamdUnixSocket") as mock_unix_socket:
+            mock_unix_socket.side_effect = lambda path, *timeouts: clamd_by_path[path]
+
+            for _ in range(2):
+                file = FlaskFileStorage(BytesIO(clean_string), "safe.txt")
+                assert utils._scan_filestream(file) == ("OK", None)
+
+        assert working_clamd.instream.call_count == 2
+
+    @pytest.mark.ckan_config("ckanext.clamav.router.retries", "0")
+    def test_scan_is_not_retried_without_retries(self):
+        with patch("ckanext.clamav.utils.CustomClamdUnixSocket") as mock_unix_socket:
+            mock_unix_socket.return_value.instream.side_effect = ConnectionError()
+
+            file = FlaskFileStorage(BytesIO(clean_string), "safe.txt")
+            status, _ = utils._scan_filestream(file)
+
+        assert status == "ERR_DISABLED"
+        assert mock_unix_socket.return_value.instream.call_count == 1
@@ -0,0 +1,94 @@
+from io import BytesIO
+from unittest.mock import patch
+
+import pytest
+from clamd import EICAR
+from werkzeug.datastructures import FileStorage as FlaskFileStorage
+
+import ckan.plugins.toolkit as tk
+
+from ckanext.clamav import segmented, utils
+
+
+@pytest.fixture()
+def clamd_config(fake_clamd, ckan_config, monkeypatch):
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_type", "unix")
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_path", fake_clamd.path)
+    return fake_clamd
+
+
+class TestIterWindows:
+
+    def test_adjacent_windows_overlap(self):
+        content = bytes(range(10))
+
+        windows = list(segmented.iter_windows(BytesIO(content), 4, 1))
+
+        assert windows == [content[0:4], content[3:7], content[6:10]]
+
+    def test_stream_shorter_than_window(self):
+        assert list(segmented.iter_windows(BytesIO(b"abc"), 4, 1)) == [b"abc"]
+
+    def test_signature_on_the_boundary_is_kept_whole(self):
+        content = b"x" * 480 + EICAR + b"x" * 1000
+
+        windows = segmented.iter_windows(BytesIO(content), 512, 128)
+
+        assert any(EICAR in window for window in windows)
+
+
+@pytest.mark.usefixtures("clamd_config")
+@pytest.mark.ckan_config("ckanext.clamav.segmented.enabled", "True")
+@pytest.mark.ckan_config("ckanext.clamav.segmented.window_size", "512")
+@pytest.mark.ckan_config("ckanext.clamav.segmented.overlap", "128")
+@pytest.mark.ckan_config("ckanext.clamav.stream_max_length", "1024")
+class TestSegmentedScan:
+
+    def test_oversize_clean_file(self):
+        file = FlaskFileStorage(BytesIO(b"x" * 4096), "big.txt")
+
+        status, signature = utils._scan_filestream(file)
+
+        assert status == "ERR_PARTIAL"
+        assert signature == segmented.PARTIAL_MESSAGE
+
+    @pytest.mark.ckan_config("ckanext.clamav.upload_unscanned", "False")
+    def test_partial_scan_is_not_accepted(self):
+        data_dict = {"upload": FlaskFileStorage(BytesIO(b"x" * 4096), "big.txt")}
+
+        with pytest.raises(tk.ValidationError):
+            utils.scan_file_for_viruses(data_dict)
+
+    @pytest.mark.ckan_config("ckanext.clamav.upload_unscanned", "True")
+    def test_partial_scan_is_accepted_as_unscanned(self):
+        data_dict = {"upload": FlaskFileStorage(BytesIO(b"x" * 4096), "big.txt")}
+
+        utils.scan_file_for_viruses(data_dict)
+
+    def test_malware_across_window_boundary_is_found(self):
+        content = b"x" * 480 + EICAR + b"x" * 4096
+        file = FlaskFileStorage(BytesIO(content), "big.txt")
+
+        status, signature = utils._scan_filestream(file)
+
+        assert status == "FOUND"
+        assert signature
+
+    def test_window_over_the_limit(self, ckan_config, monkeypatch):
+        # a method marker would be overridden by the one of the class
+        monkeypatch.setitem(ckan_config, "ckanext.clamav.segmented.window_size", "2048")
+        file = FlaskFileStorage(BytesIO(b"x" * 4096), "big.txt")
+
+        status, _ = utils._scan_filestream(file)
+
+        assert status == "ERR_FILELIMIT"
+
+    @pytest.mark.ckan_config("ckanext.clamav.upload_unscanned", "False")
+    def test_window_error_is_not_accepted(self, clamd_config):
+        data_dict = {"upload": FlaskFileStorage(BytesIO(b"x" * 4096), "big.txt")}
+
+        with patch(
+            "ckanext.clamav.utils._scan_segment",
+            return_value=("ERROR", "Can't allocate memory"),
+        ), pytest.raises(tk.ValidationError):
+            utils.scan_file_for_viruses(data_dict)
@@ -0,0 +1,225 @@
+import os
+from io import BytesIO
+from unittest.mock import Mock, patch
+
+import pytest
+from clamd import EICAR
+from werkzeug.datastructures import FileStorage as FlaskFileStorage
+
+from ckanext.clamav import sessions, utils
+
+infected_content = EICAR + b"x" * 100
+
+
+class FakeRedis:
+    """The Redis set commands the chunked uploads use, shared like Redis."""
+
+    def __init__(self):
+        self.sets: dict[str, set[bytes]] = {}
+        self.commands: list[tuple] = []
+
+    def pipeline(self):
+        return self
+
+    def sadd(self, key, member):
+        self.commands.append(("sadd", key, member.encode()))
+
+    def expire(self, key, seconds):
+        self.commands.append(("expire", key, seconds))
+
+    def smembers(self, key):
+        self.commands.append(("smembers", key))
+
+    def execute(self):
+        results = []
+        for command, key, *args in self.commands:
+            if command == "sadd":
+                self.sets.setdefault(key, set()).add(args[0])
+                results.append(1)
+            elif command == "expire":
+                results.append(True)
+            else:
+                results.append(set(self.sets.get(key, ())))
+        self.commands = []
+        return results
+
+    def delete(self, key):
+        return 1 if self.sets.pop(key, None) is not None else 0
+
+
+@pytest.fixture()
+def shared_redis():
+    redis = FakeRedis()
+    with patch("ckanext.clamav.sessions.connect_to_redis", return_value=redis):
+        yield redis
+
+
+@pytest.fixture()
+def clamd_config(fake_clamd, ckan_config, monkeypatch, tmp_path, shared_redis):
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_type", "unix")
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_path", fake_clamd.path)
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.router.ping_interval", "0")
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.spool.dir", str(tmp_path))
+    yield fake_clamd
+    for upload_id in list(sessions._sessions):
+        sessions.pop_session(upload_id).close()
+
+
+def send_chunks(content: bytes, chunks: list[tuple[int, int]]) -> list[bool]:
+    results = []
+    for start, end in chunks:
+        upload = FlaskFileStorage(BytesIO(content[start:end]), "upload.bin")
+        results.append(
+            utils.scan_upload_chunk(upload, "resource-id", start, len(content)),
+        )
+        assert upload.stream.tell() == 0
+    return results
+
+
+class TestParseContentRange:
+
+    @pytest.mark.parametrize(
+        ("value", "expected"),
+        [
+            ("bytes 0-99/200", (0, 100, 200)),
+            ("bytes 100-199/200", (100, 200, 200)),
+            ("bytes 100-200/200", None),
+            ("bytes 10-5/200", None),
+            ("bytes */200", None),
+            (None, None),
+        ],
+    )
+    def test_parse_content_range(self, value, expected):
+        assert sessions.parse_content_range(value) == expected
+
+
+@pytest.mark.usefixtures("clamd_config")
+class TestScanUploadChunk:
+
+    def test_chunks_in_order_are_streamed(self, fake_clamd):
+        results = send_chunks(infected_content, [(0, 30), (30, 80), (80, 168)])
+
+        assert results == [False, False, True]
+        assert fake_clamd.commands.count("INSTREAM") == 1
+
+    def test_verdict_is_attached_to_last_chunk(self):
+        send_chunks(infected_content, [(0, 30)])
+
+        upload = FlaskFileStorage(BytesIO(infected_content[30:]), "upload.bin")
+        assert utils.scan_upload_chunk(upload, "resource-id", 30, 168)
+
+        status, signature = utils.get_attached_verdict(upload)
+        assert status == "FOUND"
+        assert signature == "Win.Test.EICAR_HDB-1"
+        assert utils.scan_with_report(upload).size == 168
+
+    def test_chunks_out_of_order_are_scanned_once_complete(self, fake_clamd):
+        results = send_chunks(infected_content, [(80, 168), (0, 30), (30, 80)])
+
+        assert results == [False, False, True]
+        # the session doesn't start with the first chunk, so it's not
+        # streamed, and the complete file is scanned once it's in
+        assert fake_clamd.commands.count("INSTREAM") == 1
+
+    def test_clean_file(self):
+        content = b"safe file content" * 10
+
+        upload = FlaskFileStorage(BytesIO(content[100:]), "upload.bin")
+        send_chunks(content, [(0, 100)])
+        utils.scan_upload_chunk(upload, "resource-id", 100, len(content))
+
+        assert utils.get_attached_verdict(upload) == ("OK", None)
+
+    def test_retransmitted_chunk(self, fake_clamd):
+        results = send_chunks(infected_content, [(0, 30), (0, 30), (30, 168)])
+
+        assert results == [False, False, True]
+        assert fake_clamd.commands.count("INSTREAM") == 2
+
+    def test_last_chunk_gets_the_complete_file(self):
+        content = b"safe file content" * 10
+        send_chunks(content, [(0, 100)])
+
+        upload = FlaskFileStorage(BytesIO(content[100:]), "upload.bin")
+        assert utils.scan_upload_chunk(upload, "resource-id", 100, len(content))
+
+        assert upload.stream.read() == content
+
+    def test_chunks_reaching_other_processes(self, fake_clamd):
+        results = []
+        for start, end in [(0, 30), (30, 80)]:
+            results.extend(send_chunks(infected_content, [(start, end)]))
+            # the next chunk reaches a process without the session
+            sessions.pop_session("resource-id").close()
+        results.extend(send_chunks(infected_content, [(80, 168)]))
+
+        assert results == [False, False, True]
+        # the streaming of the first process is dropped, the complete file is
+        # scanned with a separate INSTREAM
+        assert fake_clamd.commands.count("INSTREAM") == 2
+
+    def test_chunk_is_rejected_without_redis(self, shared_redis):
+        shared_redis.execute = Mock(side_effect=ConnectionError("Redis is down"))
+        upload = FlaskFileStorage(BytesIO(infected_content[:30]), "upload.bin")
+
+        with pytest.raises(utils.logic.ValidationError):
+            utils.scan_upload_chunk(upload, "resource-id", 0, len(infected_content))
+
+    @pytest.mark.ckan_config("ckanext.clamav.chunked.max_streaming", "0")
+    def test_sessions_over_limit_are_spooled(self, fake_clamd):
+        results = send_chunks(infected_content, [(0, 30), (30, 168)])
+
+        assert results == [False, True]
+        assert fake_clamd.commands.count("INSTREAM") == 1
+
+
+class TestScanSession:
+
+    def test_idle_sessions_are_dropped(self):
+        writer = Mock()
+
+        def get_session(timeout: float) -> sessions.ScanSession:
+            return sessions.get_session("resource-id", 0, 10, lambda: writer, 1, timeout)
+
+        session = get_session(60)
+        assert get_session(60) is session
+
+        assert get_session(0) is not session
+        writer.close.assert_called_once()
+        sessions.pop_session("resource-id").close()
+
+
+@pytest.mark.usefixtures("shared_redis")
+class TestChunkedUpload:
+
+    def test_spool_has_the_complete_file(self, tmp_path):
+        upload = sessions.ChunkedUpload("resource-id", 10, str(tmp_path), 60)
+
+        end = upload.write(5, BytesIO(b"56789 and more"))
+        assert end == 10
+        assert not upload.add_range(5, end)
+
+        assert upload.add_range(0, upload.write(0, BytesIO(b"01234")))
+        with upload.open() as spool:
+            assert spool.read() == b"0123456789"
+        assert not os.listdir(tmp_path)
+
+    def test_chunks_of_processes_complete_the_file(self, tmp_path, shared_redis):
+        first = sessions.ChunkedUpload("resource-id", 10, str(tmp_path), 60)
+        second = sessions.ChunkedUpload("resource-id", 10, str(tmp_path), 60)
+
+        assert not first.add_range(0, first.write(0, BytesIO(b"01234")))
+        assert second.add_range(5, second.write(5, BytesIO(b"56789")))
+
+        assert not shared_redis.sets
+        with first.open() as spool:
+            assert spool.read() == b"0123456789"
+
+    def test_abandoned_uploads_are_removed(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(sessions, "_swept_at", 0.0)
+        upload = sessions.ChunkedUpload("resource-id", 10, str(tmp_path), 60)
+        upload.write(0, BytesIO(b"01234"))
+
+        sessions.drop_abandoned_uploads(str(tmp_path), 0)
+
+        assert not os.listdir(tmp_path)
@@ -0,0 +1,82 @@
+import os
+from io import BytesIO
+
+import pytest
+from clamd import EICAR
+from werkzeug.datastructures import FileStorage as FlaskFileStorage
+
+from ckanext.clamav import spool, utils
+
+large_content = b"x" * (3 * spool.CHUNK_SIZE + 5)
+
+
+@pytest.fixture()
+def clamd_config(fake_clamd, ckan_config, monkeypatch):
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_type", "unix")
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_path", fake_clamd.path)
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.spool.enabled", "True")
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.spool.threshold", "16")
+    return fake_clamd
+
+
+class TestSpoolUpload:
+
+    def test_large_stream_is_spooled(self, tmp_path):
+        stream = BytesIO(large_content)
+        stream.seek(10)
+        file = FlaskFileStorage(stream, "large.bin")
+
+        assert spool.spool_upload(file, 1024, str(tmp_path))
+
+        assert file.stream is not stream
+        assert stream.closed
+        assert file.stream.tell() == 10
+        file.stream.seek(0)
+        assert file.stream.read() == large_content
+
+    def test_spool_file_is_removed_on_close(self, tmp_path):
+        file = FlaskFileStorage(BytesIO(large_content), "large.bin")
+        spool.spool_upload(file, 1024, str(tmp_path))
+
+        assert os.listdir(tmp_path)
+        file.close()
+        assert not os.listdir(tmp_path)
+
+    def test_small_stream_stays_in_memory(self, tmp_path):
+        stream = BytesIO(b"small")
+        file = FlaskFileStorage(stream, "small.txt")
+
+        assert not spool.spool_upload(file, 1024, str(tmp_path))
+        assert file.stream is stream
+        assert not stream.closed
+
+    def test_file_stream_is_not_spooled(self, tmp_path):
+        path = tmp_path / "upload.bin"
+        path.write_bytes(large_content)
+
+        with open(path, "rb") as stream:
+            file = FlaskFileStorage(stream, "upload.bin")
+            assert not spool.spool_upload(file, 1024, str(tmp_path))
+            assert file.stream is stream
+
+
+@pytest.mark.usefixtures("clamd_config")
+class TestScanSpooledUpload:
+
+    def test_spooled_upload_is_scanned(self):
+        file = FlaskFileStorage(BytesIO(EICAR + b"x" * 64), "eicar.bin")
+
+        status, _signature = utils._scan_filestream(file)
+
+        assert status == "FOUND"
+        assert not isinstance(file.stream, BytesIO)
+        file.stream.seek(0)
+        assert file.stream.read().startswith(EICAR)
+
+    def test_spooling_can_be_disabled(self, ckan_config, monkeypatch):
+        monkeypatch.setitem(ckan_config, "ckanext.clamav.spool.enabled", "False")
+        file = FlaskFileStorage(BytesIO(b"x" * 64), "large.bin")
+
+        utils._scan_filestream(file)
+
+        assert isinstance(file.stream, BytesIO)
@@ -0,0 +1,110 @@
+import socket
+import threading
+from io import BytesIO
+from unittest.mock import patch
+
+import pytest
+from werkzeug.datastructures import FileStorage as FlaskFileStorage
+
+from ckanext.clamav import adapters, router, utils
+from ckanext.clamav.tests.fake_clamd import STREAM_MAX_LENGTH
+
+
+@pytest.fixture()
+def clamd_config(fake_clamd, ckan_config, monkeypatch):
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_type", "unix")
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_path", fake_clamd.path)
+    return fake_clamd
+
+
+@pytest.fixture()
+def reset_stream_limits():
+    utils._stream_limits.clear()
+    yield
+    utils._stream_limits.clear()
+
+
+def test_probe_finds_the_limit(fake_clamd):
+    limit = adapters.probe_stream_max_length(socket.AF_UNIX, fake_clamd.path, 5)
+
+    assert STREAM_MAX_LENGTH < limit <= STREAM_MAX_LENGTH * 65 // 64 + 1
+
+
+@pytest.mark.usefixtures("reset_stream_limits")
+class TestPreflight:
+
+    @pytest.mark.ckan_config("ckanext.clamav.stream_max_length", "1024")
+    def test_oversize_file_is_not_streamed(self, clamd_config):
+        file = FlaskFileStorage(BytesIO(b"x" * 4096), "big.txt")
+
+        status, _ = utils._scan_filestream(file)
+
+        assert status == "ERR_FILELIMIT"
+        assert "INSTREAM" not in clamd_config.commands
+        assert file.stream.tell() == 0
+
+    @pytest.mark.ckan_config("ckanext.clamav.stream_max_length", "1024")
+    def test_file_below_the_limit_is_scanned(self, clamd_config):
+        file = FlaskFileStorage(BytesIO(b"x" * 512), "small.txt")
+
+        assert utils._scan_filestream(file) == ("OK", None)
+        assert "INSTREAM" in clamd_config.commands
+
+    @pytest.mark.ckan_config("ckanext.clamav.stream_max_length.probe", "True")
+    def test_probed_limit_is_remembered(self, clamd_config):
+        for _ in range(2):
+            file = FlaskFileStorage(BytesIO(b"x" * 4096), "big.txt")
+            status, _ = utils._scan_filestream(file)
+            assert status == "ERR_FILELIMIT"
+
+        assert list(utils._stream_limits) == [f"unix://{clamd_config.path}"]
+
+    @pytest.mark.ckan_config("ckanext.clamav.stream_max_length", "1024")
+    def test_declared_content_length_is_not_trusted(self, clamd_config):
+        file = FlaskFileStorage(
+            BytesIO(b"x" * 4096),
+            "big.txt",
+            content_length=512,
+        )
+
+        status, _ = utils._scan_filestream(file)
+
+        assert status == "ERR_FILELIMIT"
+        assert "INSTREAM" not in clamd_config.commands
+
+    def test_declared_content_length_of_unseekable_stream_is_used(self):
+        stream = BytesIO(b"x" * 512)
+        stream.seekable = lambda: False
+        file = FlaskFileStorage(stream, "big.txt", content_length=4096)
+
+        assert utils._get_stream_size(file) == 4096
+
+
+@pytest.mark.usefixtures("reset_stream_limits")
+@pytest.mark.ckan_config("ckanext.clamav.stream_max_length.probe", "True")
+def test_slow_probe_does_not_block_other_endpoints():
+    slow = router.Endpoint(socket.AF_UNIX, "/slow.sock")
+    fast = router.Endpoint(socket.AF_UNIX, "/fast.sock")
+    entered, released = threading.Event(), threading.Event()
+
+    def probe(family, address, timeout):
+        if address == slow.address:
+            entered.set()
+            released.wait(5)
+        return 1024
+
+    with patch("ckanext.clamav.utils.probe_stream_max_length", side_effect=probe):
+        slow_thread = threading.Thread(target=utils._get_stream_limit, args=(slow,))
+        fast_thread = threading.Thread(target=utils._get_stream_limit, args=(fast,))
+        try:
+            slow_thread.start()
+            assert entered.wait(5)
+
+            fast_thread.start()
+            fast_thread.join(1)
+            assert not fast_thread.is_alive()
+            assert utils._stream_limits == {fast.name: 1024}
+        finally:
+            released.set()
+            slow_thread.join()
+            fast_thread.join()
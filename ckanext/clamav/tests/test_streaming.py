@@ -0,0 +1,139 @@
+from io import BytesIO
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+from clamd import EICAR
+from werkzeug.datastructures import FileStorage
+from werkzeug.formparser import FormDataParser
+from werkzeug.test import encode_multipart
+
+from ckanext.clamav import middleware, router, streaming, utils
+
+clean_string = b"safe file content"
+
+
+@pytest.fixture()
+def clamd_config(fake_clamd, ckan_config, monkeypatch):
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_type", "unix")
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_path", fake_clamd.path)
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.router.ping_interval", "0")
+    return fake_clamd
+
+
+def receive(content: bytes):
+    """Parse a multipart body with the upload, as werkzeug does for a request."""
+    boundary, body = encode_multipart(
+        {"upload": FileStorage(BytesIO(content), "upload.bin"), "name": "resource"},
+    )
+    parser = FormDataParser(
+        stream_factory=lambda *args, **kwargs: (
+            utils.open_scanning_spool() or BytesIO()
+        ),
+    )
+    _stream, form, files = parser.parse(
+        BytesIO(body),
+        "multipart/form-data",
+        len(body),
+        {"boundary": boundary},
+    )
+    assert form["name"] == "resource"
+    return files["upload"]
+
+
+@pytest.mark.usefixtures("clamd_config")
+class TestScanWhileReceiving:
+
+    def test_infected_file_is_scanned_while_received(self, fake_clamd):
+        upload = receive(EICAR)
+        assert isinstance(upload.stream, streaming.ScanningSpool)
+
+        assert utils._scan_filestream(upload) == ("FOUND", "Win.Test.EICAR_HDB-1")
+        assert fake_clamd.commands.count("INSTREAM") == 1
+        assert upload.stream.read() == EICAR
+
+    def test_verdict_is_attached(self, fake_clamd):
+        upload = receive(clean_string)
+
+        assert utils.get_attached_verdict(upload) == ("OK", None)
+        assert utils.get_attached_verdict(upload) == ("OK", None)
+        assert utils._scan_filestream(upload) == ("OK", None)
+        assert fake_clamd.commands.count("INSTREAM") == 1
+
+    def test_file_over_limit_is_scanned_as_usual(self, fake_clamd):
+        upload = receive(b"x" * 4096)
+
+        assert utils.get_attached_verdict(upload) is None
+        assert utils._scan_filestream(upload)[0] == "ERR_FILELIMIT"
+        upload.stream.seek(0)
+        assert upload.stream.read() == b"x" * 4096
+
+    @pytest.mark.ckan_config("ckanext.clamav.receive_scan.max_streaming", "0")
+    def test_streams_over_limit_are_not_scanned_while_received(self):
+        upload = receive(clean_string)
+
+        assert isinstance(upload.stream, BytesIO)
+
+    def test_stream_is_released(self):
+        upload = receive(clean_string)
+        upload.close()
+
+        assert streaming._streaming == 0
+
+    def test_streamed_verdict_is_reported_to_the_router(self):
+        with patch.object(router.Router, "report_success") as report_success:
+            upload = receive(clean_string)
+
+            assert utils._scan_filestream(upload) == ("OK", None)
+
+        report_success.assert_called_once()
+
+    def test_abandoned_stream_gives_the_pick_back(self):
+        with patch.object(router.Router, "release") as release, patch.object(
+            router.Router,
+            "report_success",
+        ) as report_success:
+            upload = receive(clean_string)
+            upload.close()
+
+        release.assert_called_once()
+        report_success.assert_not_called()
+
+
+class TestMiddleware:
+
+    @pytest.mark.parametrize(
+        ("endpoint", "view_args", "expected"),
+        [
+            ("api.action", {"logic_function": "resource_create"}, True),
+            ("api.action", {"logic_function": "package_show"}, False),
+            ("dataset_resource.new", {}, True),
+            ("dataset_resource.edit", {}, True),
+            ("resource.read", {}, False),
+            ("group.edit", {}, False),
+            (None, None, False),
+        ],
+    )
+    def test_is_resource_upload(self, endpoint, view_args, expected):
+        request = SimpleNamespace(endpoint=endpoint, view_args=view_args)
+
+        assert middleware.is_resource_upload(request) is expected
+
+    def test_install(self):
+        class Request:
+            def _get_file_stream(self, *args):
+                return BytesIO()
+
+        app = SimpleNamespace(request_class=Request)
+        middleware.install(app)
+        middleware.install(app)
+
+        assert app.request_class.__mro__[1:] == (
+            middleware.ScanningRequestMixin,
+            Request,
+            object,
+        )
+
+        request = app.request_class()
+        request.endpoint = "home.index"
+        assert isinstance(request._get_file_stream(100, "text/plain"), BytesIO)
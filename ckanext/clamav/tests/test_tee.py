@@ -0,0 +1,129 @@
+import hashlib
+from io import BytesIO, RawIOBase
+from unittest.mock import patch
+
+import pytest
+from clamd import EICAR
+from werkzeug.datastructures import FileStorage as FlaskFileStorage
+
+import ckan.plugins.toolkit as tk
+
+from ckanext.clamav import cache, tee, utils
+
+clean_string = b"safe file content"
+
+
+class UnseekableStream(RawIOBase):
+    def __init__(self, content: bytes):
+        self._content = BytesIO(content)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def read(self, size=-1):
+        return self._content.read(size)
+
+
+@pytest.fixture()
+def clamd_config(fake_clamd, ckan_config, monkeypatch):
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_type", "unix")
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_path", fake_clamd.path)
+    return fake_clamd
+
+
+class TestTeeReader:
+
+    def test_digests_are_computed_while_reading(self):
+        reader = tee.TeeReader(BytesIO(clean_string), ["sha256", "md5"], spool=False)
+
+        assert reader.hexdigests() == {}
+        while reader.read(4):
+            pass
+
+        assert reader.bytes_read == len(clean_string)
+        assert reader.hexdigests() == {
+            "sha256": hashlib.sha256(clean_string).hexdigest(),
+            "md5": hashlib.md5(clean_string).hexdigest(),
+        }
+
+    def test_content_is_spooled(self):
+        reader = tee.TeeReader(BytesIO(clean_string), [], spool=True)
+        reader.read(4)
+        reader.drain()
+
+        assert reader.detach_spool().read() == clean_string
+
+
+@pytest.mark.usefixtures("clamd_config")
+@pytest.mark.ckan_config("ckanext.clamav.tee.enabled", "True")
+class TestScanWithTee:
+
+    def test_resource_hash_is_set(self):
+        data_dict = {"upload": FlaskFileStorage(BytesIO(clean_string), "safe.txt")}
+
+        utils.scan_file_for_viruses(data_dict)
+
+        assert data_dict["hash"] == hashlib.sha256(clean_string).hexdigest()
+
+    def test_unseekable_stream_is_spooled_for_the_uploader(self):
+        file = FlaskFileStorage(UnseekableStream(clean_string), "safe.txt")
+
+        assert utils._scan_filestream(file) == ("OK", None)
+        assert file.stream.seekable()
+        assert file.stream.read() == clean_string
+
+    def test_unseekable_stream_over_limit_is_spooled_in_full(self):
+        content = b"x" * 4096
+        file = FlaskFileStorage(UnseekableStream(content), "big.txt")
+
+        status, _ = utils._scan_filestream(file)
+
+        assert status == "ERR_FILELIMIT"
+        assert file.stream.read() == content
+
+    def test_clamd_hanging_up_over_limit_is_not_an_error(self, fake_clamd):
+        # clamd drops the connection while the rest is being sent
+        fake_clamd.hang_up_on_limit = True
+        content = b"x" * 4 * 1024 * 1024
+        file = FlaskFileStorage(UnseekableStream(content), "big.txt")
+
+        status, _ = utils._scan_filestream(file)
+
+        assert status == "ERR_FILELIMIT"
+        assert file.stream.read() == content
+
+    @pytest.mark.ckan_config("ckanext.clamav.cache.enabled", "True")
+    def test_cached_file_is_hashed_once(self):
+        cache.get_cache().clear()
+        file = FlaskFileStorage(BytesIO(clean_string), "safe.txt")
+
+        with patch(
+            "ckanext.clamav.utils.cache.hash_stream",
+            wraps=cache.hash_stream,
+        ) as hash_stream, patch(
+            "ckanext.clamav.utils.tee.TeeReader",
+            wraps=tee.TeeReader,
+        ) as tee_reader:
+            assert utils._scan_filestream(file) == ("OK", None)
+
+        hash_stream.assert_called_once()
+        assert tee_reader.call_args[0][1] == []
+
+    @pytest.mark.ckan_config("ckanext.clamav.cache.enabled", "True")
+    def test_unseekable_stream_is_cached_by_the_tee_digest(self):
+        cache.get_cache().clear()
+        file = FlaskFileStorage(UnseekableStream(clean_string), "safe.txt")
+
+        utils._scan_filestream(file)
+
+        key = cache.make_key(hashlib.sha256(clean_string).hexdigest(), "27000")
+        assert cache.get_cache().get(key) == ("OK", None)
+
+    def test_infected_file_is_still_detected(self):
+        data_dict = {"upload": FlaskFileStorage(UnseekableStream(EICAR), "eicar.txt")}
+
+        with pytest.raises(tk.ValidationError):
+            utils.scan_file_for_viruses(data_dict)
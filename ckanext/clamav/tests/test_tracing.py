@@ -0,0 +1,57 @@
+from io import BytesIO
+
+import pytest
+from werkzeug.datastructures import FileStorage as FlaskFileStorage
+
+from ckanext.clamav import tracing, utils
+
+
+@pytest.fixture()
+def clamd_config(fake_clamd, ckan_config, monkeypatch):
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_type", "unix")
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_path", fake_clamd.path)
+    return fake_clamd
+
+
+@pytest.fixture()
+def spans(monkeypatch):
+    sdk_trace = pytest.importorskip("opentelemetry.sdk.trace")
+    export = pytest.importorskip("opentelemetry.sdk.trace.export")
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+        InMemorySpanExporter,
+    )
+
+    exporter = InMemorySpanExporter()
+    provider = sdk_trace.TracerProvider()
+    provider.add_span_processor(export.SimpleSpanProcessor(exporter))
+    monkeypatch.setattr(
+        tracing.trace,
+        "get_tracer",
+        lambda name, *args, **kwargs: provider.get_tracer(name),
+    )
+    return exporter
+
+
+def test_span_is_a_noop_without_a_tracer(clamd_config):
+    with tracing.span("clamav.test", {tracing.STATUS: "OK", "empty": None}) as current:
+        tracing.set_attributes(current, {tracing.FILE_SIZE: 1})
+
+    file = FlaskFileStorage(BytesIO(b"safe file content"), "safe.txt")
+    assert utils._scan_filestream(file) == ("OK", None)
+
+
+def test_scan_spans_are_nested(clamd_config, spans):
+    file = FlaskFileStorage(BytesIO(b"safe file content"), "safe.txt")
+
+    with tracing.span("request") as request_span:
+        utils._scan_filestream(file)
+
+    finished = {span.name: span for span in spans.get_finished_spans()}
+    instream = finished["clamav.instream"]
+    connect = finished["clamav.connect"]
+
+    assert instream.parent.span_id == request_span.get_span_context().span_id
+    assert connect.parent.span_id == instream.context.span_id
+    assert instream.attributes[tracing.ENDPOINT] == f"unix://{clamd_config.path}"
+    assert instream.attributes[tracing.FILE_SIZE] == len(b"safe file content")
+    assert instream.attributes[tracing.STATUS] == "OK"
@@ -0,0 +1,83 @@
+from io import BytesIO
+
+import pytest
+from werkzeug.datastructures import FileStorage as FlaskFileStorage
+
+from ckan.tests import factories, helpers
+
+from ckanext.clamav import jobs, tracking, utils
+from ckanext.clamav.model import ResourceScan
+
+clean_string = b"safe file content"
+
+
+def create_uploaded_resource():
+    user = factories.Sysadmin()
+    dataset = factories.Dataset(user=user)
+
+    return helpers.call_action(
+        "resource_create",
+        context={"user": user["name"], "ignore_auth": False},
+        package_id=dataset["id"],
+        url="",
+        upload=FlaskFileStorage(BytesIO(clean_string), "safe.txt"),
+    )
+
+
+@pytest.mark.usefixtures("with_plugins", "clean_db", "clamd_storage")
+@pytest.mark.ckan_config("ckan.plugins", "clamav")
+@pytest.mark.ckan_config("ckanext.clamav.tracking.enabled", "True")
+class TestScanTracking:
+
+    def test_upload_scan_is_recorded(self):
+        resource = create_uploaded_resource()
+
+        scan = ResourceScan.get(resource["id"])
+
+        assert scan.db_version == 27000
+        assert scan.size == len(clean_string)
+
+    def test_dataset_upload_scan_is_recorded(self):
+        user = factories.Sysadmin()
+
+        dataset = helpers.call_action(
+            "package_create",
+            context={"user": user["name"], "ignore_auth": False},
+            name="uploaded",
+            resources=[
+                {
+                    "url": "",
+                    "upload": FlaskFileStorage(BytesIO(clean_string), "safe.txt"),
+                },
+            ],
+        )
+
+        scan = ResourceScan.get(dataset["resources"][0]["id"])
+        assert scan.db_version == 27000
+        assert not tracking._get_pending()
+
+    def test_unclaimed_report_is_dropped(self):
+        rejected = FlaskFileStorage(BytesIO(clean_string), "safe.txt")
+        utils.attach_report(
+            rejected,
+            utils.ScanReport("OK", None, "1.0.0", 26999, None, None, 0.0),
+        )
+        tracking.remember_upload(rejected)
+        tracking.forget_uploads()
+
+        resource = factories.Resource(url="safe.txt", url_type="upload")
+
+        assert ResourceScan.get(resource["id"]) is None
+
+    def test_stale_resources_are_rescanned_within_budget(self):
+        first = create_uploaded_resource()
+        second = create_uploaded_resource()
+        ResourceScan.record(first["id"], 26998, len(clean_string))
+        ResourceScan.record(second["id"], 26999, len(clean_string))
+
+        counts = jobs.rescan_stale_resources(budget=len(clean_string))
+
+        assert counts == {"clean": 1, "infected": 0, "failed": 0}
+        assert ResourceScan.get(first["id"]).db_version == 27000
+        assert ResourceScan.get(second["id"]).db_version == 26999
+        assert ResourceScan.stale(27000).count() == 1
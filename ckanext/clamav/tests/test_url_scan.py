@@ -0,0 +1,163 @@
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+import pytest
+from clamd import EICAR
+
+from ckanext.clamav import cache, remote, utils
+
+clean_string = b"safe file content"
+
+CONTENT = {
+    "/clean.txt": clean_string,
+    "/infected.txt": b"prefix " + EICAR,
+    "/large.bin": b"x" * 4096,
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.hosts.append(self.headers["Host"])
+        if self.path.startswith("/redirect/"):
+            self.send_response(302)
+            self.send_header("Location", self.path[len("/redirect/"):].replace("_", "/", 2))
+            self.end_headers()
+            return
+
+        content = CONTENT.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header("ETag", f'"{len(content)}"')
+        if not self.server.hide_length:
+            self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture()
+def http_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.hide_length = False
+    server.hosts = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture()
+def base_url(http_server):
+    host, port = http_server.server_address
+    return f"http://{host}:{port}"
+
+
+@pytest.fixture()
+def clamd_config(fake_clamd, ckan_config, monkeypatch):
+    fake_clamd.stream_max_length = 1024 * 1024
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_type", "unix")
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.socket_path", fake_clamd.path)
+    monkeypatch.setitem(ckan_config, "ckanext.clamav.url_scan.allow_private", "true")
+    cache.get_cache().clear()
+    utils._signature_versions.clear()
+    return fake_clamd
+
+
+@pytest.mark.usefixtures("clamd_config")
+class TestUrlScan:
+    def test_clean_content(self, base_url):
+        assert utils._scan_url(f"{base_url}/clean.txt") == ("OK", None)
+
+    def test_infected_content(self, base_url):
+        with pytest.raises(utils.logic.ValidationError, match="EICAR"):
+            utils.scan_url_for_viruses({"url": f"{base_url}/infected.txt"})
+
+    def test_verdict_is_cached_by_etag(self, base_url, clamd_config):
+        for _ in range(2):
+            assert utils._scan_url(f"{base_url}/clean.txt") == ("OK", None)
+
+        assert clamd_config.commands.count("INSTREAM") == 1
+
+    @pytest.mark.ckan_config("ckanext.clamav.url_scan.max_size", "1024")
+    def test_declared_size_over_the_cap(self, base_url, clamd_config):
+        status, _ = utils._scan_url(f"{base_url}/large.bin")
+
+        assert status == "ERR_FILELIMIT"
+        assert "INSTREAM" not in clamd_config.commands
+
+    @pytest.mark.ckan_config("ckanext.clamav.url_scan.max_size", "1024")
+    def test_streamed_size_over_the_cap(self, base_url, http_server):
+        http_server.hide_length = True
+
+        status, _ = utils._scan_url(f"{base_url}/large.bin")
+
+        assert status == "ERR_FILELIMIT"
+
+    def test_missing_content(self, base_url):
+        status, signature = utils._scan_url(f"{base_url}/missing.txt")
+
+        assert status == "ERROR"
+        assert "404" in signature
+
+    def test_uploads_are_skipped(self, base_url, clamd_config):
+        utils.scan_url_for_viruses(
+            {"url": f"{base_url}/infected.txt", "url_type": "upload"},
+        )
+
+        assert not clamd_config.commands
+
+
+def test_private_hosts_are_refused():
+    with pytest.raises(remote.RemoteError, match="not a public host"):
+        remote.check_url("http://127.0.0.1/data.csv", allow_private=False)
+
+
+def test_connection_is_pinned_to_the_checked_address(http_server):
+    _host, port = http_server.server_address
+    getaddrinfo, create_connection = socket.getaddrinfo, socket.create_connection
+    connected = []
+
+    def resolve(host, *args, **kwargs):
+        # the test hosts pass the check as public ones
+        if host.endswith(".test"):
+            host = "8.8.8.8"
+        return getaddrinfo(host, *args, **kwargs)
+
+    def connect(address, *args):
+        connected.append(address[0])
+        return create_connection(("127.0.0.1", port), *args)
+
+    with patch("socket.getaddrinfo", side_effect=resolve), patch(
+        "socket.create_connection",
+        side_effect=connect,
+    ):
+        response = remote.open_url(
+            f"http://first.test:{port}/redirect/http:__second.test:{port}/clean.txt",
+            timeout=2,
+        )
+
+    assert response.read() == clean_string
+    assert connected == ["8.8.8.8", "8.8.8.8"]
+    assert http_server.hosts == [f"first.test:{port}", f"second.test:{port}"]
+
+
+def test_remote_stream_is_capped():
+    class Response:
+        def __init__(self):
+            self.blocks = [b"a" * 10, b"b" * 10]
+
+        def read(self, size):
+            return self.blocks.pop(0) if self.blocks else b""
+
+    stream = remote.RemoteStream(Response(), 15, float("inf"))
+
+    assert b"".join(iter(lambda: stream.read(4), b"")) == b"a" * 10 + b"b" * 5
+    assert stream.truncated
+    assert not stream.complete
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import contextlib
+from typing import Any, Iterator, Optional
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+from .router import Address, format_address
+
+TRACER_NAME: str = "ckanext.clamav"
+
+ENDPOINT: str = "clamav.endpoint"
+FILE_SIZE: str = "clamav.file.size"
+STATUS: str = "clamav.status"
+SIGNATURE: str = "clamav.signature"
+
+
+@contextlib.contextmanager
+def span(name: str, attributes: Optional[dict[str, Any]] = None) -> Iterator[Any]:
+    """Trace the block with an OpenTelemetry span.
+
+    The span is a child of the current one, e.g. of the CKAN request span
+    created by the Flask instrumentation. Without the `opentelemetry-api`
+    package, or without a configured tracer provider, nothing is recorded.
+
+    Yields:
+        The span, or None if OpenTelemetry is not installed.
+    """
+    if trace is None:
+        yield None
+        return
+
+    with trace.get_tracer(TRACER_NAME).start_as_current_span(
+        name,
+        attributes=_clean(attributes),
+    ) as current:
+        yield current
+
+
+def connect_span(
+    family: int,
+    address: Address,
+) -> contextlib.AbstractContextManager[Any]:
+    """Trace opening a connection to clamd."""
+    return span("clamav.connect", {ENDPOINT: format_address(family, address)})
+
+
+def set_attributes(current: Any, attributes: dict[str, Any]) -> None:
+    """Add the attributes, skipping the unknown ones, to the span."""
+    if current is not None and current.is_recording():
+        current.set_attributes(_clean(attributes))
+
+
+def _clean(attributes: Optional[dict[str, Any]]) -> dict[str, Any]:
+    return {
+        key: value for key, value in (attributes or {}).items() if value is not None
+    }
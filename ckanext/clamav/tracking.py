@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import logging
+import threading
+from typing import Any, Optional
+
+from werkzeug.datastructures import FileStorage
+
+from ckan.lib.munge import munge_filename
+
+from . import config as c
+from . import utils
+from .model import ResourceScan, ScanResult
+
+log = logging.getLogger(__name__)
+
+MAX_PENDING_UPLOADS: int = 16
+
+_uploads = threading.local()
+
+
+def is_enabled() -> bool:
+    """Check whether resource scans are recorded in any way."""
+    return c.tracking_enabled() or c.results_enabled()
+
+
+def remember_upload(file: FileStorage) -> None:
+    """Keep the scan report of an upload until its resource is saved.
+
+    The uploader scans the file before the resource gets its id, so the
+    scan is recorded later, from the resource and dataset hooks. Uploads are
+    matched with resources by the file name, as the upload becomes the last
+    segment of the resource URL. Unclaimed reports are dropped once the
+    dataset is saved or the request is over, see `forget_uploads`.
+    """
+    report = utils.get_attached_report(file)
+    if report is None or not file.filename:
+        return
+
+    pending: dict[str, utils.ScanReport] = _get_pending()
+    # uploads of resources that failed validation are never claimed
+    if len(pending) >= MAX_PENDING_UPLOADS:
+        pending.clear()
+    pending[munge_filename(file.filename)] = report
+
+
+def record_upload(resource: dict[str, Any]) -> None:
+    """Record the scan of the file uploaded to the resource, if any."""
+    if resource.get("url_type") != "upload":
+        return
+
+    filename = (resource.get("url") or "").rsplit("/", 1)[-1]
+    report = _get_pending().pop(filename, None)
+    if report is None:
+        return
+
+    record(resource["id"], report, resource.get("size"))
+
+
+def record_package_uploads(package: dict[str, Any]) -> None:
+    """Record the scans of the files uploaded to the dataset resources.
+
+    The dataset actions upload resource files without calling the resource
+    hooks. Every upload of the action has been scanned before the dataset
+    is saved, so the reports left unclaimed are dropped afterwards.
+    """
+    try:
+        for resource in package.get("resources") or []:
+            if resource.get("id"):
+                record_upload(resource)
+    finally:
+        forget_uploads()
+
+
+def forget_uploads(*args: Any) -> None:
+    """Drop the scan reports of the uploads that were never saved.
+
+    Also used as a request teardown callback, so a report of a rejected
+    resource is never matched with a resource of a later request.
+    """
+    _get_pending().clear()
+
+
+def record(
+    resource_id: str,
+    report: utils.ScanReport,
+    size: Optional[int] = None,
+) -> None:
+    """Save the scan of the resource file.
+
+    Args:
+        resource_id (str): the scanned resource
+        report (utils.ScanReport): the scan report
+        size (Optional[int]): the file size, if the report misses it
+    """
+    size = report.size if report.size is not None else size
+
+    if c.tracking_enabled() and report.db_version is not None:
+        ResourceScan.record(resource_id, report.db_version, size)
+        log.debug(
+            "Clamd: resource %s is scanned with signatures v%s",
+            resource_id,
+            report.db_version,
+        )
+
+    if c.results_enabled():
+        ScanResult.record(
+            resource_id,
+            content_hash=report.content_hash,
+            status=report.status,
+            signature=report.signature,
+            engine_version=report.engine_version,
+            db_version=report.db_version,
+            duration=report.duration,
+            size=size,
+        )
+
+
+def _get_pending() -> dict[str, utils.ScanReport]:
+    if not hasattr(_uploads, "pending"):
+        _uploads.pending = {}
+    return _uploads.pending
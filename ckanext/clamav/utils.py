@@ -1,23 +1,90 @@
 from __future__ import annotations
 
+import contextlib
+import contextvars
+import hashlib
 import logging
-from typing import Any, Optional, Union
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Any, Callable, Iterator, NamedTuple, Optional, TypeVar, Union
 
 from clamd import BufferTooLongError, ClamdNetworkSocket, ClamdUnixSocket
 from clamd import ConnectionError as ClamConnectionError
+from clamd import ResponseError as ClamResponseError
 from werkzeug.datastructures import FileStorage
 
 from ckan import logic
 from ckan import model
-from ckan.exceptions import CkanConfigurationException
+from ckan.common import request
+from ckan.lib import uploader
+from ckan.lib.munge import munge_filename
 from ckan.types import ErrorDict
 
+from . import cache
 from . import config as c
-from .adapters import CustomClamdNetworkSocket
-from .config import ClamAvStatus
+from . import (
+    admission,
+    aio,
+    deadlines,
+    metrics,
+    pool,
+    remote,
+    reputation,
+    router,
+    segmented,
+    sessions,
+    spool,
+    streaming,
+    tee,
+    tracing,
+)
+from .adapters import (
+    CustomClamdNetworkSocket,
+    CustomClamdUnixSocket,
+    InstreamWriter,
+    probe_stream_max_length,
+)
+from .config import ClamAvStatus, ScanStatus
 
 log = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+Connection = Union[
+    ClamdUnixSocket,
+    ClamdNetworkSocket,
+    pool.ClamdSession,
+    aio.SyncClamd,
+]
+
+VERDICT_ATTR: str = "clamav_verdict"
+DIGESTS_ATTR: str = "clamav_digests"
+CLAMD_VERSION_ATTR: str = "clamav_clamd_version"
+REPORT_ATTR: str = "clamav_report"
+QUARANTINE_CHUNK_SIZE: int = 1024 * 1024
+URL_FILELIMIT_MESSAGE: str = (
+    "The linked file exceeds the filesize limit. The file will not be scanned"
+)
+# the resource fields only the extension may change
+SCAN_FIELDS: tuple[str, ...] = ("scan_status", "clamav_quarantine_id")
+# the context flag of the resource updates made by the scan jobs
+SCAN_CONTEXT_KEY: str = "clamav_scan"
+
+_signature_versions: dict[str, tuple[float, Optional[str]]] = {}
+_signature_versions_locks: dict[str, threading.Lock] = {}
+
+_endpoint_locks_lock = threading.Lock()
+
+_stream_limits: dict[str, Optional[int]] = {}
+_stream_limits_locks: dict[str, threading.Lock] = {}
+
 
 def scan_file_for_viruses(data_dict: dict[str, Any]) -> None:
     """
@@ -30,14 +97,38 @@ def scan_file_for_viruses(data_dict: dict[str, Any]) -> None:
         logic.ValidationError: returns a validation error to the user
         upload form
     """
-    upload_unscanned: bool = c.upload_unscanned()
+    upload_unscanned: bool = c.get_settings().upload_unscanned
 
     file: FileStorage = data_dict["upload"]
-    status: str
-    signature: Optional[str]
-    status, signature = _scan_filestream(file)
+    with tracing.span("clamav.scan_file") as current:
+        report = scan_with_report(file)
+        status, signature = report.status, report.signature
+        tracing.set_attributes(
+            current,
+            {
+                tracing.FILE_SIZE: report.size,
+                tracing.STATUS: status,
+                tracing.SIGNATURE: signature if status == ClamAvStatus.FOUND else None,
+            },
+        )
+
+        _handle_verdict(data_dict, file, status, signature, upload_unscanned)
+
+
+def _handle_verdict(
+    data_dict: dict[str, Any],
+    file: FileStorage,
+    status: str,
+    signature: Optional[str],
+    upload_unscanned: bool,
+) -> None:
     package_id = _get_package_id(data_dict)
 
+    if c.tee_enabled() and not data_dict.get("hash"):
+        digest = get_attached_digests(file).get(c.tee_algorithms()[0])
+        if digest:
+            data_dict["hash"] = digest
+
     if status == ClamAvStatus.ERR_DISABLE:
         log.info("Clamd: unable to connect to clamav. Can't scan the file")
         if upload_unscanned:
@@ -51,13 +142,6 @@ def scan_file_for_viruses(data_dict: dict[str, Any]) -> None:
                     ],
                 },
             )
-    elif status in (ClamAvStatus.ERR_FILELIMIT,):
-        log.warning(signature)
-        if upload_unscanned:
-            log.info(_get_unscanned_file_message(file, package_id))
-        else:
-            err: ErrorDict = {"Virus checker": [f"{signature}"]}
-            raise logic.ValidationError(err)
     elif status == ClamAvStatus.FOUND:
         error_msg: str = (
             "malware has been found. "
@@ -66,6 +150,174 @@ def scan_file_for_viruses(data_dict: dict[str, Any]) -> None:
         log.warning(error_msg)
         err: ErrorDict = {"Virus checker": [error_msg]}
         raise logic.ValidationError(err)
+    elif status != ClamAvStatus.OK:
+        # ERR_FILELIMIT, ERR_PARTIAL, ERR_BUSY, or an ERROR reported by clamd
+        log.warning("Clamd: unable to scan the file %s. %s", file.filename, signature)
+        if upload_unscanned:
+            log.info(_get_unscanned_file_message(file, package_id))
+        else:
+            err: ErrorDict = {
+                "Virus checker": [f"{signature or 'The file can not be scanned'}"],
+            }
+            raise logic.ValidationError(err)
+
+
+def scan_url_for_viruses(data_dict: dict[str, Any]) -> None:
+    """Scan the content linked by a resource, streaming it into clamd.
+
+    Only new or changed links are scanned. The content is never stored,
+    and a verdict is cached by the URL and the ETag of the content.
+
+    Args:
+        data_dict (dict[str, Any]): resource data_dict
+
+    Raises:
+        logic.ValidationError: if malware is found, or if the content can't
+        be scanned and unscanned files are not allowed
+    """
+    url = data_dict.get("url")
+    if data_dict.get("url_type") or not remote.is_remote_url(url):
+        return
+
+    resource = model.Resource.get(data_dict["id"]) if data_dict.get("id") else None
+    if resource is not None and resource.url == url:
+        return
+
+    started_at = time.monotonic()
+    with tracing.span("clamav.scan_url") as current, metrics.track_in_flight():
+        status, signature = _scan_url(url)
+        tracing.set_attributes(current, {tracing.STATUS: status})
+    metrics.observe_scan(status, None, time.monotonic() - started_at)
+
+    if status == ClamAvStatus.FOUND:
+        error_msg: str = f"malware has been found. URL: {url}, signature: {signature}."
+        log.warning(error_msg)
+        raise logic.ValidationError({"Virus checker": [error_msg]})
+
+    if status != ClamAvStatus.OK:
+        log.warning("Clamd: unable to scan %s. %s", url, signature)
+        if not c.get_settings().upload_unscanned:
+            raise logic.ValidationError({"Virus checker": [f"{signature}"]})
+
+
+def _scan_url(url: str) -> tuple[str, Optional[str]]:
+    timeout = c.url_scan_timeout()
+    deadline = time.monotonic() + timeout
+
+    try:
+        response = remote.open_url(url, timeout, c.url_scan_allow_private())
+    except remote.RemoteError as e:
+        return (ClamAvStatus.ERROR, f"The linked file can't be downloaded. {e}")
+
+    with contextlib.closing(response):
+        content_length = response.headers.get("Content-Length", "")
+        size = int(content_length) if content_length.isdigit() else None
+        if size is not None and size > c.url_scan_max_size():
+            return (ClamAvStatus.ERR_FILELIMIT, URL_FILELIMIT_MESSAGE)
+
+        return _scan_admitted(
+            size,
+            lambda: _scan_url_routed(url, response, deadline),
+        )
+
+
+def _scan_url_routed(
+    url: str,
+    response: Any,
+    deadline: float,
+) -> tuple[str, Optional[str]]:
+    try:
+        return _call_with_retries(
+            lambda clamd_router, endpoint: _scan_url_on_endpoint(
+                clamd_router,
+                endpoint,
+                url,
+                response,
+                deadline,
+            ),
+        )
+    except BufferTooLongError:
+        return (ClamAvStatus.ERR_FILELIMIT, URL_FILELIMIT_MESSAGE)
+    except ClamConnectionError:
+        error_msg: str = "clamav is not accessible, check its status."
+        log.critical(error_msg)
+        return (ClamAvStatus.ERR_DISABLE, error_msg)
+
+
+def _scan_url_on_endpoint(
+    clamd_router: router.Router,
+    endpoint: router.Endpoint,
+    url: str,
+    response: Any,
+    deadline: float,
+) -> tuple[str, Optional[str]]:
+    """Stream the remote content into clamd on the given endpoint.
+
+    The verdict is cached only if the content has an ETag and has been
+    scanned completely.
+    """
+    limit = _get_stream_limit(endpoint)
+    max_size = c.url_scan_max_size()
+    stream = remote.RemoteStream(
+        response,
+        min(max_size, limit) if limit is not None else max_size,
+        deadline,
+    )
+    etag = response.headers.get("ETag")
+
+    cache_key = _get_url_cache_key(endpoint, url, etag) if etag else None
+    if cache_key:
+        verdict = cache.get_cache().get(cache_key)
+        if verdict:
+            log.debug("Clamd: verdict cache hit for %s", url)
+            clamd_router.release(endpoint)
+            return verdict
+
+    with clamd_router.track(endpoint), _connection(endpoint) as cd:
+        scan_result = _instream(endpoint, cd, stream, None)
+
+    clamd_router.report_success(endpoint)
+
+    if not scan_result:
+        return (ClamAvStatus.ERR_DISABLE, None)
+
+    verdict = next(iter(scan_result.values()))
+    if verdict[0] == ClamAvStatus.FOUND:
+        # malware in a part of the content is enough
+        if cache_key:
+            cache.get_cache().set(cache_key, verdict)
+        return verdict
+
+    if stream.error:
+        return (
+            ClamAvStatus.ERROR,
+            f"The linked file can't be downloaded. {stream.error}",
+        )
+    if stream.truncated:
+        return (ClamAvStatus.ERR_FILELIMIT, URL_FILELIMIT_MESSAGE)
+    if stream.timed_out:
+        return (
+            ClamAvStatus.ERR_FILELIMIT,
+            "The linked file can't be downloaded in time. "
+            "The file will not be scanned",
+        )
+
+    if cache_key and verdict[0] == ClamAvStatus.OK:
+        cache.get_cache().set(cache_key, verdict)
+    return verdict
+
+
+def _get_url_cache_key(
+    endpoint: router.Endpoint,
+    url: str,
+    etag: str,
+) -> Optional[str]:
+    db_version = _get_signature_version(endpoint)
+    if not db_version:
+        return None
+
+    digest = hashlib.sha256(f"{url}\0{etag}".encode()).hexdigest()
+    return cache.make_key(f"url:{digest}", db_version)
 
 
 def _get_package_id(data_dict: dict[str, Any]) -> str:
@@ -86,6 +338,359 @@ def _get_package_id(data_dict: dict[str, Any]) -> str:
     return resource.package.id
 
 
+class ScanReport(NamedTuple):
+    """The outcome of a file scan.
+
+    The clamd version and the content hash are known only if the scans are
+    tracked or recorded, or if the file is hashed anyway, e.g. by the tee.
+    """
+
+    status: str
+    signature: Optional[str]
+    engine_version: Optional[str]
+    db_version: Optional[int]
+    content_hash: Optional[str]
+    size: Optional[int]
+    duration: float
+
+
+def scan_with_report(file: FileStorage) -> ScanReport:
+    """Scan a file stream and collect the details of the scan.
+
+    Returns:
+        The report attached to the file by an earlier scan, or a new one.
+    """
+    attached_report = get_attached_report(file)
+    if attached_report:
+        return attached_report
+
+    if c.results_enabled() and not _is_hashed_by_tee():
+        content_hash = get_attached_digests(file).get("sha256") or cache.hash_stream(
+            file.stream,
+        )
+        if content_hash:
+            attach_digests(file, {"sha256": content_hash})
+
+    size = _get_stream_size(file)
+    started_at = time.monotonic()
+    status, signature = _scan_filestream(file)
+    duration = time.monotonic() - started_at
+
+    engine_version, db_version = _split_clamd_version(get_attached_clamd_version(file))
+    report = ScanReport(
+        status,
+        signature,
+        engine_version,
+        db_version,
+        get_attached_digests(file).get("sha256"),
+        size,
+        duration,
+    )
+    attach_report(file, report)
+
+    return report
+
+
+def scan_files_for_viruses(
+    files: list[FileStorage],
+    concurrency: Optional[int] = None,
+) -> list[ScanReport]:
+    """Scan many files at once.
+
+    The files are scanned concurrently, so it takes about as long as the
+    scan of the largest one. The report is attached to every file, and
+    the later `scan_file_for_viruses` call for it doesn't scan it again.
+
+    Args:
+        files (list[FileStorage]): the files to scan
+        concurrency (Optional[int]): the number of concurrent scans.
+            Defaults to ckanext.clamav.batch.concurrency
+
+    Returns:
+        The scan reports, in the order of the files.
+    """
+    concurrency = c.batch_concurrency() if concurrency is None else concurrency
+    if len(files) < 2 or concurrency < 2:
+        return [scan_with_report(file) for file in files]
+
+    with ThreadPoolExecutor(
+        max_workers=min(concurrency, len(files)),
+        thread_name_prefix="clamav-batch",
+    ) as executor:
+        # the context carries the current tracing span to the threads
+        futures = [
+            executor.submit(contextvars.copy_context().run, scan_with_report, file)
+            for file in files
+        ]
+        return [future.result() for future in futures]
+
+
+def prescan_uploads(resources: list[dict[str, Any]]) -> None:
+    """Scan the uploads of many resources at once, ahead of the uploader.
+
+    The uploader scans the resources one by one, so the uploads of a dataset
+    update are scanned together beforehand, and the uploader gets the
+    attached reports. Uploads of the async scan mode are left for the jobs.
+    """
+    if c.async_enabled() or c.batch_concurrency() < 2:
+        return
+
+    uploads = [
+        resource["upload"]
+        for resource in resources
+        if isinstance(resource.get("upload"), FileStorage)
+    ]
+    if len(uploads) < 2:
+        return
+
+    log.debug("Clamd: scanning %s uploads concurrently", len(uploads))
+    scan_files_for_viruses(uploads)
+
+
+def scan_stored_file(path: str, filename: str) -> ScanReport:
+    """Scan a file already kept by the uploader.
+
+    Args:
+        path (str): the file path in the storage
+        filename (str): the file name, for logging
+    """
+    with open(path, "rb") as stream:
+        return scan_with_report(FileStorage(stream, filename))
+
+
+def get_stored_path(resource_id: str, url: str) -> Optional[str]:
+    """Get the path of an uploaded resource file on the local disk.
+
+    Returns:
+        The file path, or None if the file doesn't exist or the uploader
+        doesn't keep files on the local disk.
+    """
+    upload = uploader.get_resource_uploader(
+        {"id": resource_id, "url": url, "url_type": "upload"},
+    )
+
+    get_path = getattr(upload, "get_path", None)
+    path = get_path(resource_id) if get_path else None
+    if not path or not os.path.isfile(path):
+        return None
+
+    return path
+
+
+def get_upload_chunk(data_dict: dict[str, Any]) -> Optional[tuple[str, int, int]]:
+    """Get the position of the upload in a chunked upload.
+
+    A chunk updates an existing resource and is sent with the
+    `Content-Range: bytes <start>-<end>/<total>` header.
+
+    Returns:
+        The resource id, the offset of the chunk and the size of the
+        complete file, or None if the upload is not a chunk.
+    """
+    upload = data_dict.get("upload")
+    if (
+        not data_dict.get("id")
+        or not isinstance(upload, FileStorage)
+        or _get_stream_position(upload.stream) is None
+    ):
+        return None
+
+    try:
+        content_range = request.headers.get("Content-Range")
+    except RuntimeError:
+        # outside of a request, e.g. in a background job
+        return None
+
+    chunk_range = sessions.parse_content_range(content_range)
+    if chunk_range is None:
+        return None
+
+    start, _end, total = chunk_range
+    return data_dict["id"], start, total
+
+
+def scan_upload_chunk(
+    upload: FileStorage,
+    upload_id: str,
+    offset: int,
+    total: int,
+) -> bool:
+    """Feed a chunk of a chunked upload to the scan session of the file.
+
+    The chunks are spooled outside of the resource storage until the file
+    is complete, see `sessions.ChunkedUpload`. The session of the process
+    streams them to clamd while they arrive in order. If they don't, the
+    complete file is scanned once the last chunk is in.
+
+    Args:
+        upload (FileStorage): the chunk
+        upload_id (str): the identifier of the upload, e.g. the resource id
+        offset (int): the position of the chunk in the file
+        total (int): the size of the complete file
+
+    Returns:
+        True once the file is complete. The chunk is replaced with the
+        complete file then, and the report of the file is attached to it,
+        so it's not scanned again. False for the other chunks, which must
+        not reach the uploader.
+
+    Raises:
+        logic.ValidationError: if the chunk can't be spooled
+    """
+    timeout = c.chunked_session_timeout()
+    chunked = sessions.ChunkedUpload(upload_id, total, c.spool_dir(), timeout)
+    session = sessions.get_session(
+        upload_id,
+        offset,
+        total,
+        _open_instream_writer,
+        c.chunked_max_streaming(),
+        timeout,
+    )
+
+    stream = upload.stream
+    position = _get_stream_position(stream)
+    try:
+        end = session.feed(offset, stream, chunked)
+        stream.seek(position)
+        spool = chunked.open() if chunked.add_range(offset, end) else None
+    except Exception as e:  # noqa: BLE001
+        # the spool directory or Redis is not available
+        log.exception("Clamd: unable to spool the chunk of %s", upload_id)
+        err: ErrorDict = {
+            "Virus checker": ["The chunk can not be accepted. Try again later"],
+        }
+        raise logic.ValidationError(err) from e
+    finally:
+        sessions.drop_abandoned_uploads(c.spool_dir(), timeout)
+
+    if spool is None:
+        return False
+
+    sessions.pop_session(upload_id)
+    with contextlib.closing(session):
+        started_at = time.monotonic()
+        verdict = session.finish()
+
+        if verdict is not None and verdict[0] in (ClamAvStatus.OK, ClamAvStatus.FOUND):
+            content_hash = cache.hash_stream(spool) if c.results_enabled() else None
+            report = ScanReport(
+                verdict[0],
+                verdict[1],
+                None,
+                None,
+                content_hash,
+                total,
+                time.monotonic() - started_at,
+            )
+            metrics.observe_scan(verdict[0], total, report.duration)
+        else:
+            log.debug("Clamd: scanning the complete file of %s", upload_id)
+            report = scan_with_report(FileStorage(spool, upload.filename))
+
+    # the uploader stores the complete file instead of the last chunk
+    spool.seek(0)
+    upload.stream = spool
+
+    attach_report(upload, report)
+    attach_verdict(upload, (report.status, report.signature))
+    if report.content_hash:
+        attach_digests(upload, {"sha256": report.content_hash})
+
+    return True
+
+
+def open_scanning_spool() -> Optional[streaming.ScanningSpool]:
+    """Open the container of a file part, streamed to clamd as it's received.
+
+    The content is kept in memory up to ckanext.clamav.spool.threshold and
+    in a file in ckanext.clamav.spool.dir above it.
+
+    Returns:
+        The container, or None if all the streams of the process are taken
+        or clamd is not accessible.
+    """
+    if not streaming.reserve(c.receive_scan_max_streaming()):
+        return None
+
+    writer = _open_instream_writer()
+    if writer is None:
+        streaming.cancel()
+        return None
+
+    spool = tempfile.SpooledTemporaryFile(  # noqa: SIM115
+        max_size=c.spool_threshold(),
+        dir=c.spool_dir(),
+    )
+    return streaming.ScanningSpool(spool, writer)
+
+
+class RoutedInstreamWriter(InstreamWriter):
+    """An INSTREAM command that reports its outcome to the router.
+
+    The endpoint is picked, and a half-open circuit gives it the trial
+    scan, when the command is opened. Reading the verdict reports a success,
+    a connection error reports a failure, and a command closed without the
+    verdict, e.g. when the upload is over the stream limit or it has been
+    cancelled, gives the pick back.
+    """
+
+    def __init__(
+        self,
+        conn: Union[CustomClamdNetworkSocket, CustomClamdUnixSocket],
+        clamd_router: router.Router,
+        endpoint: router.Endpoint,
+    ):
+        super().__init__(conn)
+        self.clamd_router = clamd_router
+        self.endpoint = endpoint
+
+        self._finishing = False
+        self._reported = False
+
+    def finish(self) -> dict[str, tuple[str, Optional[str]]]:
+        self._finishing = True
+        report = self.clamd_router.report_success
+        try:
+            return super().finish()
+        except ClamConnectionError:
+            report = self.clamd_router.report_failure
+            metrics.count_connection_error(self.endpoint.name)
+            raise
+        finally:
+            self._report(report)
+
+    def close(self) -> None:
+        super().close()
+        if not self._finishing:
+            self._report(self.clamd_router.release)
+
+    def _report(self, report: Callable[[router.Endpoint], None]) -> None:
+        if not self._reported:
+            self._reported = True
+            report(self.endpoint)
+
+
+def _open_instream_writer() -> Optional[InstreamWriter]:
+    """Open an INSTREAM command on the endpoint picked by the router.
+
+    Returns:
+        The writer, or None if clamd is not accessible.
+    """
+    clamd_router = get_router()
+    endpoint = clamd_router.pick()
+    if endpoint is None:
+        return None
+
+    try:
+        return RoutedInstreamWriter(_get_socket_conn(endpoint), clamd_router, endpoint)
+    except ClamConnectionError as e:
+        clamd_router.report_failure(endpoint)
+        metrics.count_connection_error(endpoint.name)
+        log.warning("Clamd: unable to start the chunked upload scan. %s", e)
+        return None
+
+
 def _scan_filestream(file: FileStorage) -> tuple[str, Optional[str]]:
     """Scan a file stream for malware using ClamAV.
 
@@ -99,14 +704,98 @@ def _scan_filestream(file: FileStorage) -> tuple[str, Optional[str]]:
                 If an error occurred, contains the error message.
                 If no malware found, is None.
     """
+    attached_verdict = get_attached_verdict(file)
+    if attached_verdict:
+        return attached_verdict
+
+    if c.spool_enabled():
+        spool.spool_upload(file, c.spool_threshold(), c.spool_dir())
+
+    size = (
+        _get_stream_size(file)
+        if metrics.get_exporter().enabled or c.admission_enabled()
+        else None
+    )
+    started_at = time.monotonic()
+
+    with metrics.track_in_flight():
+        verdict = _check_reputation(file) or _scan_admitted(
+            size,
+            lambda: _scan_routed(file),
+        )
+
+    metrics.observe_scan(verdict[0], size, time.monotonic() - started_at)
+    return verdict
 
-    cd: Union[ClamdUnixSocket, ClamdNetworkSocket] = _get_conn()
+
+def _scan_admitted(
+    size: Optional[int],
+    scan: Callable[[], tuple[str, Optional[str]]],
+) -> tuple[str, Optional[str]]:
+    """Run the scan once the admission controller lets it through.
+
+    Returns:
+        The scan verdict, or ERR_BUSY if the scan has waited in the queue
+        for longer than ckanext.clamav.admission.queue_timeout.
+    """
+    if not c.admission_enabled():
+        return scan()
 
     try:
-        scan_result: Union[dict[str, tuple[str, Optional[str]]], None] = cd.instream(
-            file.stream,
+        with admission.get_controller().admit(size):
+            return scan()
+    except admission.AdmissionTimeout:
+        return (
+            ClamAvStatus.ERR_BUSY,
+            "The virus checker is busy. The file will not be scanned",
+        )
+
+
+def _check_reputation(file: FileStorage) -> Optional[tuple[str, Optional[str]]]:
+    """Look the file up in the hash lists before sending it to clamd.
+
+    Returns:
+        The verdict for a listed file, or None if the lists are disabled,
+        the file is not listed or its stream can't be hashed.
+    """
+    if not reputation.is_enabled():
+        return None
+
+    content_hash = get_attached_digests(file).get("sha256") or cache.hash_stream(
+        file.stream,
+    )
+    if not content_hash:
+        return None
+
+    attach_digests(file, {"sha256": content_hash})
+
+    verdict = reputation.check(content_hash)
+    if verdict:
+        log.debug("Clamd: %s is in the hash list, %s", file.filename, verdict[0])
+    return verdict
+
+
+def _scan_routed(file: FileStorage) -> tuple[str, Optional[str]]:
+    """Scan a file stream on the endpoints picked by the router."""
+    stream = file.stream
+    start = _get_stream_position(stream)
+
+    try:
+        return _call_with_retries(
+            lambda clamd_router, endpoint: _scan_on_endpoint(
+                clamd_router,
+                endpoint,
+                file,
+            ),
+            rewind=None if start is None else lambda: stream.seek(start),
         )
     except BufferTooLongError:
+        # the tee replaces a stream that can't be rewound with a full spool
+        restart = start if file.stream is stream else 0
+        if c.segmented_enabled() and restart is not None:
+            file.stream.seek(restart)
+            return _scan_segmented(file)
+
         error_msg: str = (
             "The uploaded file exceeds the filesize limit. "
             "The file will not be scanned"
@@ -118,20 +807,709 @@ def _scan_filestream(file: FileStorage) -> tuple[str, Optional[str]]:
         log.critical(error_msg)
         return (ClamAvStatus.ERR_DISABLE, error_msg)
 
+
+def _call_with_retries(
+    func: Callable[[router.Router, router.Endpoint], T],
+    rewind: Optional[Callable[[], Any]] = None,
+) -> T:
+    """Call the function with an endpoint picked by the router.
+
+    After a connection error the endpoint is reported to the router and the
+    call is retried on another endpoint, up to ckanext.clamav.router.retries
+    times.
+
+    Args:
+        func (Callable): receives the router and the endpoint
+        rewind (Optional[Callable]): prepares the retry, e.g. rewinds the
+            consumed stream. The call is not retried without it
+
+    Raises:
+        ClamConnectionError: if all the attempts have failed
+    """
+    clamd_router = get_router()
+    tried: list[router.Endpoint] = []
+
+    while True:
+        endpoint = clamd_router.pick(exclude=tried)
+        if endpoint is None:
+            raise ClamConnectionError("No clamd endpoint is available")
+
+        try:
+            return func(clamd_router, endpoint)
+        except ClamConnectionError as e:
+            clamd_router.report_failure(endpoint)
+            metrics.count_connection_error(endpoint.name)
+            tried.append(endpoint)
+
+            if rewind is None or len(tried) > c.router_retries():
+                raise
+
+            log.warning("Clamd: %s, retrying on another endpoint", e)
+            rewind()
+
+
+def _scan_segmented(file: FileStorage) -> tuple[str, Optional[str]]:
+    """Scan a file over the clamd stream limit in overlapping windows.
+
+    Windows are scanned in parallel on the routed endpoints. Signatures that
+    need the whole file, e.g. inside archives, can't be matched this way,
+    so it only covers the raw content. A file without a match is reported
+    as ERR_PARTIAL and accepted only along with the unscanned files.
+    """
+    log.info(
+        "Clamd: the file %s exceeds the stream limit, scanning it in windows",
+        file.filename,
+    )
+
+    try:
+        return segmented.scan_windows(
+            file.stream,
+            _scan_segment,
+            c.segmented_window_size(),
+            c.segmented_overlap(),
+            c.segmented_concurrency(),
+        )
+    except BufferTooLongError:
+        error_msg: str = (
+            "The scan window exceeds the filesize limit. "
+            "The file will not be scanned"
+        )
+        log.error(error_msg)
+        return (ClamAvStatus.ERR_FILELIMIT, error_msg)
+    except ClamConnectionError:
+        error_msg: str = "clamav is not accessible, check its status."
+        log.critical(error_msg)
+        return (ClamAvStatus.ERR_DISABLE, error_msg)
+
+
+def _scan_segment(segment: bytes) -> tuple[str, Optional[str]]:
+    def scan(clamd_router: router.Router, endpoint: router.Endpoint):
+        limit = _get_stream_limit(endpoint)
+        if limit is not None and len(segment) > limit:
+            raise BufferTooLongError(f"The window exceeds the limit of {limit} bytes")
+
+        with clamd_router.track(endpoint), _connection(endpoint) as cd:
+            scan_result = _instream(endpoint, cd, BytesIO(segment), len(segment))
+
+        clamd_router.report_success(endpoint)
+        if not scan_result:
+            raise ClamConnectionError("Empty reply from clamd")
+        return next(iter(scan_result.values()))
+
+    return _call_with_retries(scan, rewind=lambda: None)
+
+
+def _scan_on_endpoint(
+    clamd_router: router.Router,
+    endpoint: router.Endpoint,
+    file: FileStorage,
+) -> tuple[str, Optional[str]]:
+    """Scan a file stream on the given clamd endpoint.
+
+    Raises:
+        BufferTooLongError: if the file exceeds the clamd stream limit
+        ClamConnectionError: if the endpoint is not accessible
+    """
+    _check_stream_limit(endpoint, file)
+
+    if c.tracking_enabled() or c.results_enabled():
+        attach_clamd_version(file, _get_clamd_version(endpoint))
+
+    # a cached verdict needs neither a connection nor a healthy clamd. The
+    # digest is attached to the file, so the tee doesn't compute it again
+    cache_key: Optional[str] = (
+        _get_cache_key(endpoint, file) if c.cache_enabled() else None
+    )
+    if cache_key:
+        verdict = cache.get_cache().get(cache_key)
+        if verdict:
+            log.debug("Clamd: verdict cache hit for %s", file.filename)
+            clamd_router.release(endpoint)
+            return verdict
+
+    tee_reader = _make_tee(file) if c.tee_enabled() else None
+
+    try:
+        with clamd_router.track(endpoint), _connection(endpoint) as cd:
+            size = _get_stream_size(file)
+            started_at = time.monotonic()
+            scan_result: Union[dict[str, tuple[str, Optional[str]]], None] = (
+                _scan_local(endpoint, cd, file)
+                or _instream(endpoint, cd, tee_reader or file.stream, size)
+            )
+            elapsed = time.monotonic() - started_at
+            metrics.observe_stream(endpoint.name, size, elapsed)
+            if c.adaptive_timeout() and scan_result:
+                deadlines.get_model().observe(endpoint.name, size, elapsed)
+    finally:
+        if tee_reader:
+            _commit_tee(file, tee_reader)
+
+    clamd_router.report_success(endpoint)
+
     if not scan_result:
         return (ClamAvStatus.ERR_DISABLE, None)
 
-    return scan_result["stream"]
+    # INSTREAM reports the file as `stream`, FILDES and SCAN - by descriptor or
+    # path, but there is always a single file
+    verdict = next(iter(scan_result.values()))
+    if c.cache_enabled() and not cache_key:
+        # a stream that can't be rewound is hashed by the tee during the scan
+        cache_key = _get_cache_key(endpoint, file, hash_content=False)
+    if cache_key and verdict[0] in (ClamAvStatus.OK, ClamAvStatus.FOUND):
+        cache.get_cache().set(cache_key, verdict)
+
+    return verdict
+
+
+def _instream(
+    endpoint: router.Endpoint,
+    cd: Connection,
+    stream: Any,
+    size: Optional[int],
+) -> Optional[dict[str, tuple[str, Optional[str]]]]:
+    """Stream the content to clamd with INSTREAM, in a tracing span.
+
+    With ckanext.clamav.timeout.adaptive, the scan must be over by the
+    deadline expected for its size on the endpoint.
+    """
+    if c.adaptive_timeout():
+        stream = deadlines.DeadlineStream(
+            stream,
+            cd,
+            time.monotonic() + deadlines.get_total_timeout(endpoint.name, size),
+            c.get_settings().idle_timeout,
+        )
+
+    with tracing.span(
+        "clamav.instream",
+        {tracing.ENDPOINT: endpoint.name, tracing.FILE_SIZE: size},
+    ) as current:
+        try:
+            scan_result = cd.instream(stream)
+        except ClamConnectionError:
+            raise
+        except OSError as e:
+            # the clamd library lets through the errors of sending the stream,
+            # e.g. a broken pipe when clamd hangs up early
+            raise ClamConnectionError(
+                f"Error streaming to {endpoint.name}. {e}.",
+            ) from e
+        finally:
+            if isinstance(stream, deadlines.DeadlineStream):
+                stream.restore()
+
+        if scan_result:
+            tracing.set_attributes(
+                current,
+                {tracing.STATUS: next(iter(scan_result.values()))[0]},
+            )
+
+    return scan_result
+
+
+def _check_stream_limit(endpoint: router.Endpoint, file: FileStorage) -> None:
+    """Refuse a file over the stream limit before streaming any of it.
+
+    Raises:
+        BufferTooLongError: if the file size is known and exceeds the limit
+    """
+    limit = _get_stream_limit(endpoint)
+    if limit is None or _can_scan_locally(endpoint, file.stream):
+        return
+
+    size = _get_stream_size(file)
+    if size is not None and size > limit:
+        log.debug(
+            "Clamd: the file %s of %s bytes exceeds the %s limit of %s bytes",
+            file.filename,
+            size,
+            endpoint.name,
+            limit,
+        )
+        raise BufferTooLongError(f"The file exceeds the limit of {limit} bytes")
+
+
+def _get_stream_limit(endpoint: router.Endpoint) -> Optional[int]:
+    """Get the stream size limit of the endpoint.
+
+    The limit is either set in the config, or probed once per endpoint.
+
+    Returns:
+        The limit in bytes or None if it's unknown.
+    """
+    limit = c.stream_max_length()
+    if limit is not None or not c.stream_max_length_probe():
+        return limit
+
+    if endpoint.name in _stream_limits:
+        return _stream_limits[endpoint.name]
+
+    # the probe of a slow endpoint holds back only the scans on it
+    with _get_endpoint_lock(_stream_limits_locks, endpoint):
+        if endpoint.name not in _stream_limits:
+            try:
+                _stream_limits[endpoint.name] = probe_stream_max_length(
+                    endpoint.family,
+                    endpoint.address,
+                    c.get_settings().connect_timeout,
+                )
+            except ClamConnectionError as e:
+                log.warning("Clamd: unable to probe the stream limit. %s", e)
+                return None
+
+            log.info(
+                "Clamd: the stream limit of %s is %s bytes",
+                endpoint.name,
+                _stream_limits[endpoint.name],
+            )
+
+        return _stream_limits[endpoint.name]
+
+
+def _get_stream_size(file: FileStorage) -> Optional[int]:
+    """Get the number of bytes left in the file, without reading it.
+
+    The content length is declared by the client, so it's trusted only for
+    a stream that can't be measured.
+
+    Returns:
+        For a stream that can be rewound, e.g. a file on disk, the distance
+        to its end. Otherwise the declared content length, if any.
+    """
+    stream = file.stream
+    position = _get_stream_position(stream)
+    if position is None:
+        return file.content_length or None
+
+    try:
+        end = stream.seek(0, os.SEEK_END)
+    finally:
+        stream.seek(position)
+
+    return end - position
+
+
+def _make_tee(file: FileStorage) -> tee.TeeReader:
+    """Wrap the upload stream, so it's hashed while clamd reads it.
+
+    A stream that can't be rewound is also copied to a spool file, which
+    replaces it once the scan is over, so the real uploader still gets the
+    full content.
+    """
+    attached = get_attached_digests(file)
+    algorithms = [name for name in c.tee_algorithms() if name not in attached]
+    spool = _get_stream_position(file.stream) is None
+
+    return tee.TeeReader(file.stream, algorithms, spool)
+
+
+def _commit_tee(file: FileStorage, tee_reader: tee.TeeReader) -> None:
+    """Keep the digests and hand the spooled content over to the uploader."""
+    if tee_reader.spooling:
+        # clamd may stop reading early, e.g. when the stream limit is hit,
+        # and the rest must not be lost
+        tee_reader.drain()
+        file.stream = tee_reader.detach_spool()
+
+    attach_digests(file, tee_reader.hexdigests())
+
+
+def attach_digests(file: FileStorage, digests: dict[str, str]) -> None:
+    """Remember the content digests on the file, so it's not hashed again."""
+    setattr(file, DIGESTS_ATTR, dict(get_attached_digests(file), **digests))
+
+
+def get_attached_digests(file: FileStorage) -> dict[str, str]:
+    return getattr(file, "__dict__", {}).get(DIGESTS_ATTR, {})
+
+
+def attach_clamd_version(file: FileStorage, version: Optional[str]) -> None:
+    """Remember the version of clamd the file is scanned with."""
+    setattr(file, CLAMD_VERSION_ATTR, version)
+
+
+def get_attached_clamd_version(file: FileStorage) -> Optional[str]:
+    return getattr(file, "__dict__", {}).get(CLAMD_VERSION_ATTR)
+
+
+def attach_report(file: FileStorage, report: ScanReport) -> None:
+    """Remember the scan report on the file, so it's not scanned again."""
+    setattr(file, REPORT_ATTR, report)
+
+
+def get_attached_report(file: FileStorage) -> Optional[ScanReport]:
+    return getattr(file, "__dict__", {}).get(REPORT_ATTR)
+
+
+def _is_hashed_by_tee() -> bool:
+    return c.tee_enabled() and "sha256" in c.tee_algorithms()
+
+
+def _scan_local(
+    endpoint: router.Endpoint,
+    cd: Connection,
+    file: FileStorage,
+) -> Optional[dict[str, tuple[str, Optional[str]]]]:
+    """Scan a file that is already on the local disk without streaming it.
+
+    The open descriptor is passed to clamd with FILDES over a unix socket,
+    or the file path is sent with SCAN if the file is in the directory
+    shared with clamd.
+
+    Returns:
+        The scan result, or None if neither is possible or clamd failed to
+        read the file. The file is streamed with INSTREAM then.
+    """
+    stream = file.stream
+    if not _can_scan_locally(endpoint, stream):
+        return None
+
+    scan_result = None
+
+    try:
+        fd = _get_fileno(stream) if c.fildes_enabled() else None
+        if fd is not None and endpoint.family == socket.AF_UNIX:
+            scan_result = _get_fildes_conn(endpoint, cd).fildes(fd)
+        else:
+            path = _get_shared_path(stream)
+            if path:
+                scan_result = cd.scan(path)
+    except ClamResponseError as e:
+        log.warning("Clamd: unable to scan the local file, streaming it. %s", e)
+        return None
+    finally:
+        # clamd shares the file offset with us when it reads a passed descriptor
+        stream.seek(0)
+
+    if not scan_result:
+        return None
+
+    status, _signature = next(iter(scan_result.values()))
+    if status == ClamAvStatus.ERROR:
+        log.warning("Clamd: unable to scan the local file, streaming it")
+        return None
+
+    return scan_result
+
+
+def _can_scan_locally(endpoint: router.Endpoint, stream: Any) -> bool:
+    """Check whether clamd can read the file itself, with FILDES or SCAN."""
+    if _get_stream_position(stream) != 0:
+        return False
+
+    if c.fildes_enabled() and endpoint.family == socket.AF_UNIX:
+        if _get_fileno(stream) is not None:
+            return True
+
+    return _get_shared_path(stream) is not None
+
+
+def _get_fildes_conn(
+    endpoint: router.Endpoint,
+    cd: Connection,
+) -> Union[pool.ClamdSession, CustomClamdUnixSocket]:
+    if isinstance(cd, pool.ClamdSession):
+        return cd
+    return CustomClamdUnixSocket(endpoint.address, c.get_settings().timeout)
+
+
+def _get_fileno(stream: Any) -> Optional[int]:
+    """Get the descriptor of a stream backed by a file on disk."""
+    # fileno() rolls an in-memory SpooledTemporaryFile over to disk
+    if isinstance(stream, tempfile.SpooledTemporaryFile) and not stream._rolled:
+        return None
+
+    try:
+        return stream.fileno()
+    except (AttributeError, OSError):
+        return None
+
+
+def _get_shared_path(stream: Any) -> Optional[str]:
+    """Get the path of a stream backed by a file inside the shared directory."""
+    shared_dir = c.shared_scan_dir()
+    name = getattr(stream, "name", None)
+
+    if not shared_dir or not isinstance(name, str) or not os.path.isfile(name):
+        return None
+
+    path = os.path.realpath(name)
+    shared_dir = os.path.realpath(shared_dir)
+    if os.path.commonpath([path, shared_dir]) != shared_dir:
+        return None
+
+    return path
+
+
+def _get_stream_position(stream: Any) -> Optional[int]:
+    """Get the current stream position, if the stream can be rewound."""
+    try:
+        return stream.tell() if stream.seekable() else None
+    except (AttributeError, OSError):
+        return None
+
+
+def attach_verdict(file: FileStorage, verdict: tuple[str, Optional[str]]) -> None:
+    """Remember the verdict on the file, so it's not scanned again.
+
+    Used for files that have already been scanned before they reach the
+    uploader, e.g. the ones promoted from the quarantine.
+    """
+    setattr(file, VERDICT_ATTR, verdict)
+
 
+def get_attached_verdict(file: FileStorage) -> Optional[tuple[str, Optional[str]]]:
+    """Get the verdict remembered on the file.
 
-def _get_conn() -> Union[ClamdUnixSocket, CustomClamdNetworkSocket]:
+    The verdict of a file streamed to clamd while it was received is read
+    and attached on the first call.
+    """
+    # FileStorage proxies unknown attributes to the stream, so check the
+    # instance dict only
+    verdict = getattr(file, "__dict__", {}).get(VERDICT_ATTR)
+    stream = getattr(file, "stream", None)
+    if verdict is None and isinstance(stream, streaming.ScanningSpool):
+        verdict = stream.verdict()
+        if verdict is not None:
+            attach_verdict(file, verdict)
+
+    return verdict
+
+
+def quarantine_upload(data_dict: dict[str, Any]) -> None:
+    """Move the upload to the quarantine instead of scanning it right away.
+
+    The upload is removed from the data_dict, so the real uploader doesn't
+    store anything, and the resource is marked with the pending scan status.
+    The background job picks the file up from the quarantine after the
+    resource has been created, see `jobs.enqueue_scan`.
+
+    Args:
+        data_dict (dict[str, Any]): upload resource data_dict
+    """
+    file: FileStorage = data_dict.pop("upload")
+    quarantine_id = str(uuid.uuid4())
+    path = get_quarantine_path(quarantine_id)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # write into a temporary name first, so a job never sees a partial file
+    with open(path + ".part", "wb") as dest:
+        shutil.copyfileobj(file.stream, dest, QUARANTINE_CHUNK_SIZE)
+    os.rename(path + ".part", path)
+
+    data_dict["url"] = munge_filename(file.filename or quarantine_id)
+    data_dict["url_type"] = "upload"
+    data_dict["scan_status"] = ScanField(ScanStatus.PENDING)
+    data_dict["clamav_quarantine_id"] = ScanField(quarantine_id)
+
+    log.info(
+        "Clamd: the file %s has been quarantined as %s",
+        file.filename,
+        quarantine_id,
+    )
+
+
+class ScanField(str):
+    """A scan field value set by the extension.
+
+    The parsed user input never contains it, so it tells the values of the
+    quarantined upload from the ones sent by the user.
+    """
+
+
+def protect_scan_fields(
+    resource: dict[str, Any],
+    stored: Optional[dict[str, Any]],
+) -> None:
+    """Replace the scan fields sent by the user with the stored ones.
+
+    Otherwise any editor could clear the infected or pending status, or
+    point the resource to the quarantined file of another resource.
+
+    Args:
+        resource (dict[str, Any]): the resource data_dict
+        stored (Optional[dict[str, Any]]): the stored fields of the resource,
+            None for a new one
+    """
+    for field in SCAN_FIELDS:
+        if isinstance(resource.get(field), ScanField):
+            continue
+
+        if stored and stored.get(field):
+            resource[field] = stored[field]
+        else:
+            resource.pop(field, None)
+
+
+def get_quarantine_path(quarantine_id: str) -> str:
+    """Get the path of the quarantined file.
+
+    Raises:
+        ValueError: if the quarantine id is not a UUID. The id comes from the
+            resource extras, so it must never be trusted as a path.
+    """
+    quarantine_id = str(uuid.UUID(quarantine_id))
+    return os.path.join(c.quarantine_path(), quarantine_id)
+
+
+def _get_cache_key(
+    endpoint: router.Endpoint,
+    file: FileStorage,
+    hash_content: bool = True,
+) -> Optional[str]:
+    """Build the verdict cache key for the file.
+
+    The content is hashed only if it has not been hashed yet, e.g. by the
+    hash lists or the tee.
+
+    Args:
+        endpoint (router.Endpoint): the clamd endpoint
+        file (FileStorage): the file
+        hash_content (bool): whether to hash the stream if its digest is not
+            known yet
+
+    Returns:
+        The cache key, or None if either the content hash or the signature
+        database version are not available. The file is scanned without the
+        cache in this case.
+    """
+    content_hash = get_attached_digests(file).get("sha256")
+    if not content_hash and hash_content:
+        content_hash = cache.hash_stream(file.stream)
+    if not content_hash:
+        return None
+
+    attach_digests(file, {"sha256": content_hash})
+
+    db_version = _get_signature_version(endpoint)
+    if not db_version:
+        return None
+
+    return cache.make_key(content_hash, db_version)
+
+
+def _get_signature_version(
+    endpoint: router.Endpoint,
+    cd: Optional[Connection] = None,
+) -> Optional[str]:
+    """Get the clamd signature database version of the endpoint.
+
+    Returns:
+        The signature database version or None if clamd can't be reached
+        or doesn't report it.
+    """
+    parts = (_get_clamd_version(endpoint, cd) or "").split("/")
+    return parts[1] if len(parts) > 1 else None
+
+
+def _get_clamd_version(
+    endpoint: router.Endpoint,
+    cd: Optional[Connection] = None,
+) -> Optional[str]:
+    """Get the clamd version of the endpoint.
+
+    clamd replies to VERSION with `ClamAV <engine>/<db version>/<db date>`.
+    The value is remembered for `ckanext.clamav.cache.version_ttl` seconds,
+    so we are not asking clamd on every upload.
+
+    Args:
+        endpoint (router.Endpoint): the clamd endpoint
+        cd (Optional[Connection]): an open connection to the endpoint. A new
+            one is opened if the version has to be asked for
+
+    Returns:
+        The version, the last known one if clamd can't be reached, or None
+        if it has never been reached.
+    """
+    expires_at, version = _signature_versions.get(endpoint.name, (0.0, None))
+    if expires_at > time.monotonic():
+        return version
+
+    # a slow endpoint holds back only the scans on it
+    with _get_endpoint_lock(_signature_versions_locks, endpoint):
+        expires_at, version = _signature_versions.get(endpoint.name, (0.0, None))
+        if expires_at > time.monotonic():
+            return version
+
+        try:
+            if cd is None:
+                with _connection(endpoint) as conn:
+                    version = conn.version()
+            else:
+                version = cd.version()
+        except ClamConnectionError:
+            log.warning("Clamd: unable to get the signature database version")
+            return _signature_versions.get(endpoint.name, (0.0, None))[1]
+
+        _signature_versions[endpoint.name] = (
+            time.monotonic() + c.cache_version_ttl(),
+            version,
+        )
+
+    return version
+
+
+def _get_endpoint_lock(
+    locks: dict[str, threading.Lock],
+    endpoint: router.Endpoint,
+) -> threading.Lock:
+    """Get the lock of the endpoint from the given set of locks."""
+    with _endpoint_locks_lock:
+        return locks.setdefault(endpoint.name, threading.Lock())
+
+
+def get_signature_version() -> Optional[int]:
+    """Get the signature database version of a clamd endpoint.
+
+    Returns:
+        The version, or None if clamd can't be reached.
+    """
+
+    def get_version(clamd_router: router.Router, endpoint: router.Endpoint):
+        with _connection(endpoint) as cd:
+            return _parse_db_version(_get_signature_version(endpoint, cd))
+
+    try:
+        return _call_with_retries(get_version, rewind=lambda: None)
+    except ClamConnectionError:
+        return None
+
+
+def _parse_db_version(db_version: Optional[str]) -> Optional[int]:
+    try:
+        return int(db_version) if db_version else None
+    except ValueError:
+        return None
+
+
+def _split_clamd_version(
+    version: Optional[str],
+) -> tuple[Optional[str], Optional[int]]:
+    """Split the clamd version into the engine and the signature versions."""
+    if not version:
+        return None, None
+
+    parts = version.split("/")
+    return parts[0], _parse_db_version(parts[1] if len(parts) > 1 else None)
+
+
+def _get_conn(
+    endpoint: Optional[router.Endpoint] = None,
+) -> Union[CustomClamdUnixSocket, CustomClamdNetworkSocket, aio.SyncClamd]:
     """
     Simply connects to the ClamAV via TCP/IP or Unix socket and returns
     the connection object
 
+    Args:
+        endpoint (Optional[router.Endpoint]): the endpoint to connect to.
+        Defaults to the one configured with ckanext.clamav.socket_type
+
     Returns:
-        Union[ClamdUnixSocket, CustomClamdNetworkSocket]: a connection to ClamAV
-        Support two type of connection mechanism - TCP/IP or Unix socket
+        Union[CustomClamdUnixSocket, CustomClamdNetworkSocket, aio.SyncClamd]: a
+        connection to ClamAV. Support two type of connection mechanism - TCP/IP or
+        Unix socket, either with the `clamd` library or with the asyncio client
 
     Raises:
         CkanConfigurationException: if the TCP/IP connection mechanism has been choosen,
@@ -140,21 +1518,113 @@ def _get_conn() -> Union[ClamdUnixSocket, CustomClamdNetworkSocket]:
         CkanConfigurationException: raises an exception, if the unsupported connection
         mechanism has been choosen
     """
-    conn_timeout: int = c.conn_timeout()
+    settings = c.get_settings()
+    if endpoint is None:
+        endpoint = router.Endpoint(*settings.endpoints[0])
+
+    if settings.asyncio_enabled:
+        return aio.SyncClamd(endpoint.family, endpoint.address, settings.timeout)
 
-    if c.socket_type() == c.SocketTypes.UNIX:
-        socket_path: str = c.socket_path()
-        return ClamdUnixSocket(socket_path, conn_timeout)
-    tcp_host: str = c.tcp_host()
-    tcp_port = c.tcp_port()
+    return _get_socket_conn(endpoint)
 
-    if not tcp_port or not tcp_host:
-        raise CkanConfigurationException(
-            f"Clamd: please, provide TCP/IP host:port for ClamAV "
-            f"received host: '{tcp_host}', port: '{tcp_port}'",
+
+def _get_socket_conn(
+    endpoint: router.Endpoint,
+) -> Union[CustomClamdUnixSocket, CustomClamdNetworkSocket]:
+    """Get a connection to the endpoint with the `clamd` library."""
+    settings = c.get_settings()
+    if endpoint.family == socket.AF_UNIX:
+        return CustomClamdUnixSocket(
+            endpoint.address,
+            settings.idle_timeout,
+            settings.connect_timeout,
         )
 
-    return CustomClamdNetworkSocket(tcp_host, tcp_port, conn_timeout)
+    tcp_host, tcp_port = endpoint.address
+    return CustomClamdNetworkSocket(
+        tcp_host,
+        tcp_port,
+        settings.idle_timeout,
+        settings.connect_timeout,
+    )
+
+
+@contextlib.contextmanager
+def _connection(endpoint: router.Endpoint) -> Iterator[Connection]:
+    """Provide a connection to the ClamAV endpoint for the duration of the block.
+
+    If the connection pool is enabled, a persistent session is checked out
+    of the endpoint pool and returned back afterwards. Otherwise, a fresh
+    connection object is created with `_get_conn`.
+    """
+    if not c.get_settings().pool_enabled:
+        yield _get_conn(endpoint)
+        return
+
+    with get_pool(endpoint).session() as session:
+        yield session
+
+
+def get_pool(endpoint: router.Endpoint) -> pool.ConnectionPool:
+    """Return the connection pool of the clamd endpoint in the current process."""
+    settings = c.get_settings()
+    return pool.get_pool(
+        endpoint.family,
+        endpoint.address,
+        settings.idle_timeout,
+        c.pool_min_size(),
+        c.pool_max_size(),
+        c.pool_idle_timeout(),
+        settings.connect_timeout,
+    )
+
+
+def get_router() -> router.Router:
+    """Return the clamd endpoints router of the current process.
+
+    Endpoints come from ckanext.clamav.endpoints. If it's not set, the single
+    endpoint configured with ckanext.clamav.socket_type is used.
+    """
+    return router.get_router(
+        [router.Endpoint(*endpoint) for endpoint in c.get_settings().endpoints],
+        c.router_strategy(),
+        c.router_max_failures(),
+        c.router_ping_interval(),
+        _ping_endpoint,
+        c.breaker_failure_threshold() if c.breaker_enabled() else None,
+        c.breaker_reset_timeout(),
+    )
+
+
+def _ping_endpoint(endpoint: router.Endpoint) -> None:
+    """Check that the endpoint replies to PING.
+
+    Raises:
+        ClamConnectionError: if the endpoint is not accessible
+    """
+    _get_conn(endpoint).ping()
+
+
+def warm_up() -> None:
+    """Prepare the clamd connections before the first upload.
+
+    Every endpoint is asked for its VERSION, which is remembered for the
+    scans, and the connection pools are filled, if they are enabled. An
+    endpoint that is not accessible is only logged, as clamd may start
+    after CKAN.
+    """
+    for endpoint in get_router().endpoints:
+        try:
+            if c.get_settings().pool_enabled:
+                get_pool(endpoint).prefill()
+
+            with _connection(endpoint) as cd:
+                version = _get_clamd_version(endpoint, cd)
+        except ClamConnectionError as e:
+            log.warning("Clamd: unable to warm up %s. %s", endpoint.name, e)
+            continue
+
+        log.info("Clamd: %s is ready, %s", endpoint.name, version)
 
 
 def _get_unscanned_file_message(file: FileStorage, pkg_id: str) -> str:
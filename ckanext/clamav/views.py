@@ -0,0 +1,29 @@
+from __future__ import annotations
+
+from flask import Blueprint
+
+import ckan.plugins.toolkit as tk
+
+from ckanext.clamav import metrics
+
+PROMETHEUS_CONTENT_TYPE: str = "text/plain; version=0.0.4; charset=utf-8"
+
+clamav = Blueprint("clamav", __name__)
+
+
+@clamav.route("/clamav/metrics")
+def prometheus_metrics():
+    """Expose the scan metrics to Prometheus.
+
+    These are the metrics of the current process, or of all the processes
+    of the host in the multiprocess mode.
+    """
+    exporter = metrics.get_exporter()
+    if not isinstance(exporter, metrics.PrometheusExporter):
+        return tk.abort(404)
+
+    return exporter.render(), 200, {"Content-Type": PROMETHEUS_CONTENT_TYPE}
+
+
+def get_blueprints() -> list[Blueprint]:
+    return [clamav]